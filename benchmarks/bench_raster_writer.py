@@ -0,0 +1,89 @@
+"""图片化PDF写入性能对比
+
+对比原先的写入流程（临时JPG + 单页canvas PDF + PdfMerger合并）与
+RasterPdfWriter直写流程的每秒页数和临时磁盘写入量。
+
+用法: python benchmarks/bench_raster_writer.py [页数] [dpi]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+from PyPDF2 import PdfMerger
+from reportlab.pdfgen import canvas
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from app_main import RasterPdfWriter  # noqa: E402
+
+
+def make_pages(count, dpi):
+    """生成带噪声的A4页面，避免JPEG编码过于理想化"""
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    rng = np.random.default_rng(0)
+    base = rng.integers(200, 256, size=(height, width, 3), dtype=np.uint8)
+    return [Image.fromarray(np.roll(base, i * 7, axis=1)) for i in range(count)]
+
+
+def legacy_write(pages, output_path, temp_dir, jpg_quality):
+    """原先的写入流程，返回临时文件写入字节数"""
+    temp_bytes = 0
+    pdf_files = []
+    for i, page in enumerate(pages):
+        temp_jpg = os.path.join(temp_dir, f"page_{i}.jpg")
+        page.save(temp_jpg, "JPEG", quality=jpg_quality)
+        temp_pdf = os.path.join(temp_dir, f"page_{i}.pdf")
+        c = canvas.Canvas(temp_pdf, pagesize=(page.width, page.height))
+        c.drawImage(temp_jpg, 0, 0, page.width, page.height)
+        c.save()
+        temp_bytes += os.path.getsize(temp_jpg) + os.path.getsize(temp_pdf)
+        pdf_files.append(temp_pdf)
+
+    merger = PdfMerger()
+    for pdf_file in pdf_files:
+        merger.append(pdf_file)
+    merger.write(output_path)
+    merger.close()
+    return temp_bytes
+
+
+def direct_write(pages, output_path, jpg_quality):
+    with RasterPdfWriter(output_path) as writer:
+        for page in pages:
+            writer.add_image_page(page, jpg_quality)
+    return 0
+
+
+def main():
+    page_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    dpi = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    jpg_quality = 70
+    pages = make_pages(page_count, dpi)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        results = []
+        for name in ("legacy", "direct"):
+            temp_dir = tempfile.mkdtemp(dir=work_dir)
+            output_path = os.path.join(work_dir, f"{name}.pdf")
+            start = time.perf_counter()
+            if name == "legacy":
+                temp_bytes = legacy_write(pages, output_path, temp_dir, jpg_quality)
+            else:
+                temp_bytes = direct_write(pages, output_path, jpg_quality)
+            elapsed = time.perf_counter() - start
+            results.append((name, page_count / elapsed, temp_bytes, os.path.getsize(output_path)))
+
+        print(f"{page_count} 页 @ {dpi}dpi, JPEG质量 {jpg_quality}")
+        print(f"{'方式':<8}{'页/秒':>10}{'临时写入(MB)':>16}{'输出(MB)':>12}")
+        for name, pages_per_sec, temp_bytes, output_bytes in results:
+            print(f"{name:<8}{pages_per_sec:>10.2f}{temp_bytes / 1e6:>16.2f}{output_bytes / 1e6:>12.2f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,13 +7,22 @@ import io
 import tempfile
 from pathlib import Path
 import sys
-from pdf2image import convert_from_path, convert_from_bytes
+from pdf2image import convert_from_path, convert_from_bytes, pdfinfo_from_path
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib.colors import Color
-from PyPDF2 import PdfReader, PdfWriter, PdfMerger
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, IndirectObject, NameObject,
+                            NumberObject, StreamObject)
 import shutil
 import threading
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from collections import deque, OrderedDict, Counter
+import queue
 import re
 import decimal
 import platform
@@ -21,12 +30,18 @@ import glob
 import numpy as np
 from math import sin, cos, radians
 import json
+import csv
+import argparse
 import smtplib
 import ssl
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 import time
+import hashlib
+import functools
+import contextlib
+import zlib
 import sys
 import os
 
@@ -37,15 +52,15 @@ if getattr(sys, 'frozen', False):
     os.environ['PATH'] = application_path + os.pathsep + os.environ.get('PATH', '')
     
     # 添加调试信息
-    print(f"Running from: {application_path}")
-    print(f"PATH: {os.environ['PATH']}")
+    print(f"Running from: {application_path}", file=sys.stderr)
+    print(f"PATH: {os.environ['PATH']}", file=sys.stderr)
 
 # 检查必要的依赖
 try:
     import openpyxl
-    print(f"openpyxl version: {openpyxl.__version__}")
+    print(f"openpyxl version: {openpyxl.__version__}", file=sys.stderr)
 except ImportError as e:
-    print(f"Error importing openpyxl: {e}")
+    print(f"Error importing openpyxl: {e}", file=sys.stderr)
     import tkinter.messagebox as messagebox
     messagebox.showerror("依赖错误", "无法加载 openpyxl 模块。请重新安装程序。")
     sys.exit(1)
@@ -178,6 +193,3021 @@ class ModernGlassUI:
         style.configure('TSeparator', background=self.colors['glass_border'])
 
 
+# 批次页面缓存的默认内存上限（字节），超出部分溢出到磁盘
+RASTER_CACHE_MEMORY_LIMIT = 1024 * 1024 * 1024
+
+# 跨运行页面栅格磁盘缓存的默认大小上限（字节）
+RASTER_DISK_CACHE_LIMIT = 4 * 1024 * 1024 * 1024
+
+# 流式渲染时每次调用pdftoppm处理的页数
+RASTER_WINDOW_PAGES = 8
+
+# 每个引擎最多缓存的旋转水印图章数量
+STAMP_CACHE_SIZE = 32
+
+# 每个引擎最多缓存的矢量水印叠加页模板数量
+OVERLAY_TEMPLATE_CACHE_SIZE = 16
+
+# 矢量模式高度压缩时每个对象流容纳的对象数
+OBJECT_STREAM_SIZE = 100
+
+# 批处理进度清单的文件名（保存在输出目录中）和最短写入间隔（秒）
+MANIFEST_FILENAME = "batch_manifest.json"
+MANIFEST_SAVE_INTERVAL = 2.0
+
+# 批处理计时报告的文件名（不含扩展名，保存在输出目录中，JSON和CSV各一份）
+REPORT_FILENAME = "batch_report"
+
+# 命令行模式在没有控制台时（--windowed 打包）写入输出目录的日志和JSON汇总文件名
+CLI_LOG_FILENAME = "batch.log"
+CLI_SUMMARY_FILENAME = "batch_summary.json"
+
+# 批处理流水线中各阶段之间的队列容量（公司数）
+BATCH_QUEUE_SIZE = 8
+
+
+@functools.lru_cache(maxsize=64)
+def load_truetype_font(font_path, size, index=0):
+    """加载TrueType字体，按 (路径, 字号, 索引) 在进程内缓存
+
+    simsun.ttc、msyh.ttc 等大型中文字体集合解析较慢，同一进程内只打开一次。
+    """
+    return ImageFont.truetype(font_path, size, index=index)
+
+
+@functools.lru_cache(maxsize=1024)
+def measure_text(font, text, font_size):
+    """返回文字在指定字体下的 (宽, 高)，按字体对象、文字和字号缓存
+
+    测量方式与原先一致：优先 ImageDraw.textsize，其次 font.getsize，
+    都不可用时按 字号 × 字数 估算。
+    """
+    if hasattr(ImageDraw.ImageDraw, 'textsize'):
+        return ImageDraw.Draw(Image.new('L', (1, 1))).textsize(text, font=font)
+    if hasattr(font, 'getsize'):
+        return font.getsize(text)
+    return font_size * len(text), font_size * 1.5
+
+
+@functools.lru_cache(maxsize=None)
+def register_reportlab_font(font_path):
+    """将TrueType字体注册到reportlab，每个进程每个字体文件只注册一次，返回注册名"""
+    font_name = "Wm-" + hashlib.sha1(os.path.abspath(font_path).encode('utf-8')).hexdigest()[:12]
+    pdfmetrics.registerFont(TTFont(font_name, font_path, subfontIndex=0))
+    return font_name
+
+
+def watermark_seed(*params):
+    """由水印参数导出确定的随机种子，相同参数每次生成相同的纹理"""
+    digest = hashlib.sha256(repr(params).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+def file_digest(path):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def peak_rss_bytes():
+    """当前进程的峰值常驻内存（字节），无法获取时返回None"""
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux以KB为单位，macOS以字节为单位；Linux上子进程的峰值从创建时父进程的常驻内存算起
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    try:
+        # Windows: 通过 GetProcessMemoryInfo 读取峰值工作集
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                    ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except (ImportError, AttributeError, OSError):
+        pass
+    return None
+
+
+def iter_pdf_page_images(pdf_path, dpi, work_dir, window=RASTER_WINDOW_PAGES, grayscale=False):
+    """按页窗口流式渲染PDF，逐页返回图像
+
+    每个窗口调用一次pdftoppm，将页面写入临时目录（仅返回路径），
+    再逐页读入内存并删除文件。内存中任何时刻只保留当前页，
+    峰值内存与总页数无关。
+    """
+    page_count = int(pdfinfo_from_path(pdf_path)["Pages"])
+    window_dir = tempfile.mkdtemp(dir=work_dir)
+    try:
+        for first_page in range(1, page_count + 1, window):
+            last_page = min(first_page + window - 1, page_count)
+            page_files = convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page,
+                                           output_folder=window_dir, paths_only=True, grayscale=grayscale)
+            for page_file in page_files:
+                with Image.open(page_file) as image:
+                    image.load()
+                os.remove(page_file)
+                yield image
+    finally:
+        shutil.rmtree(window_dir, ignore_errors=True)
+
+
+def default_cache_dir():
+    """返回当前用户的程序缓存目录"""
+    if platform.system() == 'Windows':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~\\AppData\\Local')
+    elif platform.system() == 'Darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, "PDFWatermarkTool")
+
+
+@functools.lru_cache(maxsize=64)
+def _memoized_file_digest(path, mtime_ns, size):
+    return file_digest(path)
+
+
+def pdf_content_hash(pdf_path):
+    """计算PDF文件内容的SHA-256（按路径、修改时间和大小记忆）"""
+    stat = os.stat(pdf_path)
+    return _memoized_file_digest(os.path.abspath(pdf_path), stat.st_mtime_ns, stat.st_size)
+
+
+class RasterDiskCache:
+    """跨运行的页面栅格磁盘缓存
+
+    按 (PDF内容哈希, 页码, dpi, 是否灰度) 将解码后的页面以 .npy 格式保存在用户缓存目录中，
+    之后的批处理和预览通过内存映射直接载入，不再调用pdftoppm。文件的修改时间作为最近使用时间，
+    总大小超过上限时删除最久未使用的页面（LRU），正在使用的文档（pin）不会被删除。
+    文件先写入临时文件再原子替换，多个进程可共用同一目录。
+    """
+
+    def __init__(self, cache_dir=None, size_limit=RASTER_DISK_CACHE_LIMIT):
+        self.cache_dir = cache_dir or os.path.join(default_cache_dir(), "raster_pages")
+        self.size_limit = size_limit
+        self._pinned = Counter()  # 文档哈希 -> 使用中的批次数
+        self._pin_lock = threading.Lock()
+        self.hit_pages = 0
+        self.stored_pages = 0
+        self.evicted_pages = 0
+
+    def pin(self, doc_hash):
+        """标记文档正在被批次使用，清理时跳过其页面"""
+        with self._pin_lock:
+            self._pinned[doc_hash] += 1
+
+    def unpin(self, doc_hash):
+        with self._pin_lock:
+            self._pinned[doc_hash] -= 1
+            if self._pinned[doc_hash] <= 0:
+                del self._pinned[doc_hash]
+
+    def _prefix(self, doc_hash, dpi, grayscale):
+        return os.path.join(self.cache_dir, f"{doc_hash}_{dpi}{'g' if grayscale else 'c'}")
+
+    def page_path(self, doc_hash, page_num, dpi, grayscale=False):
+        return f"{self._prefix(doc_hash, dpi, grayscale)}_{page_num}.npy"
+
+    def page_count(self, doc_hash, dpi, grayscale=False):
+        """文档的所有页面都已缓存时返回页数，否则返回 None"""
+        try:
+            with open(self._prefix(doc_hash, dpi, grayscale) + ".pages", 'r') as f:
+                page_count = int(f.read())
+        except (OSError, ValueError):
+            return None
+        for page_num in range(1, page_count + 1):
+            if not os.path.exists(self.page_path(doc_hash, page_num, dpi, grayscale)):
+                return None
+        return page_count
+
+    def load(self, doc_hash, page_num, dpi, grayscale=False):
+        """通过内存映射载入缓存的页面，未缓存时返回 None"""
+        path = self.page_path(doc_hash, page_num, dpi, grayscale)
+        try:
+            image = Image.fromarray(np.load(path, mmap_mode='r'))
+            os.utime(path)  # 更新最近使用时间
+        except (OSError, ValueError):
+            return None
+        self.hit_pages += 1
+        return image
+
+    def store(self, doc_hash, page_num, dpi, image, grayscale=False):
+        """保存页面，返回缓存文件路径"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.page_path(doc_hash, page_num, dpi, grayscale)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.save(f, np.asarray(image))
+        os.replace(temp_path, path)
+        self.stored_pages += 1
+        return path
+
+    def finish_document(self, doc_hash, dpi, page_count, grayscale=False):
+        """整份文档的页面已全部写入：记录页数并按大小上限清理（不清理该文档自身）"""
+        temp_path = f"{self._prefix(doc_hash, dpi, grayscale)}.pages.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(str(page_count))
+        os.replace(temp_path, self._prefix(doc_hash, dpi, grayscale) + ".pages")
+        self.evict(keep=doc_hash)
+
+    def get_page(self, pdf_path, page_num, dpi, grayscale=False):
+        """返回单个页面（用于预览），未缓存时渲染后写入缓存"""
+        doc_hash = pdf_content_hash(pdf_path)
+        image = self.load(doc_hash, page_num, dpi, grayscale)
+        if image is None:
+            image = convert_from_path(pdf_path, dpi=dpi, first_page=page_num, last_page=page_num,
+                                      grayscale=grayscale)[0]
+            self.store(doc_hash, page_num, dpi, image, grayscale)
+            self.evict(keep=doc_hash)
+        return image
+
+    def _entries(self):
+        """返回 [(修改时间, 大小, 路径)]，只包含页面文件"""
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.endswith(".npy"):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def evict(self, keep=None):
+        """总大小超过上限时按最近使用时间从旧到新删除页面，keep 和已 pin 的文档哈希不删除"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.size_limit:
+            return
+        with self._pin_lock:
+            protected = set(self._pinned)
+        if keep is not None:
+            protected.add(keep)
+        for _, size, path in sorted(entries):
+            if os.path.basename(path).split("_", 1)[0] in protected:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            # 文档不再完整，删除其页数记录
+            with contextlib.suppress(OSError):
+                os.remove(path.rsplit("_", 1)[0] + ".pages")
+            self.evicted_pages += 1
+            total -= size
+            if total <= self.size_limit:
+                break
+
+    def stats(self):
+        """缓存目录的统计信息"""
+        entries = self._entries()
+        documents = set(os.path.basename(path).rsplit("_", 1)[0] for _, _, path in entries)
+        return {
+            "cache_dir": self.cache_dir,
+            "documents": len(documents),
+            "pages": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "size_limit": self.size_limit,
+            "hit_pages": self.hit_pages,
+            "stored_pages": self.stored_pages,
+            "evicted_pages": self.evicted_pages,
+        }
+
+    def clear(self):
+        """删除所有缓存的页面"""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+class PageRasterCache:
+    """批次级页面栅格缓存
+
+    同一批次中所有公司共用同一份源PDF，按 (PDF内容哈希, 页码, dpi, 是否灰度) 缓存渲染结果，
+    每页只调用一次pdftoppm。解码后的页面优先保存在内存中，超过内存上限后
+    以 .npy 格式溢出到磁盘，读取时通过内存映射载入。
+
+    指定 disk_cache (RasterDiskCache) 时，渲染结果同时写入跨运行的磁盘缓存，
+    之前运行或预览中已完整缓存的文档直接从磁盘缓存载入。批次使用的文档在 clear() 之前保持 pin，
+    内存放不下的页面以硬链接保存到溢出目录，其他进程清理磁盘缓存时不受影响。
+    """
+
+    def __init__(self, spill_dir, memory_limit=RASTER_CACHE_MEMORY_LIMIT, disk_cache=None):
+        self.spill_dir = spill_dir
+        self.memory_limit = memory_limit
+        self.disk_cache = disk_cache
+        self._memory = {}  # key -> PIL.Image
+        self._spilled = {}  # key -> .npy 文件路径
+        self._memory_bytes = 0
+        self._page_counts = {}  # (内容哈希, dpi, 是否灰度) -> 页数
+        self._pinned_docs = set()  # 在磁盘缓存中 pin 的文档哈希
+        self._lock = threading.Lock()
+        self.rendered_pages = 0
+        self.hit_pages = 0
+        self.spilled_pages = 0
+        self.disk_pages = 0
+
+    def content_hash(self, pdf_path):
+        """计算PDF文件内容的SHA-256（按路径、修改时间和大小记忆）"""
+        return pdf_content_hash(pdf_path)
+
+    def iter_pages(self, pdf_path, dpi, grayscale=False):
+        """按页序返回渲染后的页面图像
+
+        返回的图像由缓存持有，调用方不得原地修改。
+        """
+        doc_hash = self.content_hash(pdf_path)
+        doc_key = (doc_hash, dpi, grayscale)
+        page_count = self._page_counts.get(doc_key)
+        os.makedirs(self.spill_dir, exist_ok=True)
+        if self.disk_cache is not None:
+            with self._lock:
+                if doc_hash not in self._pinned_docs:
+                    self._pinned_docs.add(doc_hash)
+                    self.disk_cache.pin(doc_hash)
+
+        if page_count is None and self.disk_cache is not None:
+            page_count = self.disk_cache.page_count(doc_hash, dpi, grayscale)
+            if page_count is not None:
+                # 之前的运行已完整缓存：从磁盘缓存载入，不调用pdftoppm
+                for page_num in range(1, page_count + 1):
+                    image = self.disk_cache.load(doc_hash, page_num, dpi, grayscale)
+                    if image is None:
+                        # 检查之后被其他进程清理：单独渲染该页
+                        image = convert_from_path(pdf_path, dpi=dpi, first_page=page_num, last_page=page_num,
+                                                  grayscale=grayscale)[0]
+                        self.disk_cache.store(doc_hash, page_num, dpi, image, grayscale)
+                    self._store((doc_hash, page_num, dpi, grayscale), image,
+                                self.disk_cache.page_path(doc_hash, page_num, dpi, grayscale))
+                    self.disk_pages += 1
+                    yield image
+                self._page_counts[doc_key] = page_count
+                return
+
+        if page_count is None:
+            # 首次访问：流式渲染整份文档，边写入缓存边返回
+            page_num = 0
+            for page_num, image in enumerate(iter_pdf_page_images(pdf_path, dpi, self.spill_dir, grayscale=grayscale),
+                                             start=1):
+                disk_path = None
+                if self.disk_cache is not None:
+                    disk_path = self.disk_cache.store(doc_hash, page_num, dpi, image, grayscale)
+                self._store((doc_hash, page_num, dpi, grayscale), image, disk_path)
+                self.rendered_pages += 1
+                yield image
+            self._page_counts[doc_key] = page_num
+            if self.disk_cache is not None:
+                self.disk_cache.finish_document(doc_hash, dpi, page_num, grayscale)
+            return
+
+        for page_num in range(1, page_count + 1):
+            self.hit_pages += 1
+            yield self._load((doc_hash, page_num, dpi, grayscale))
+
+    def _store(self, key, image, disk_path=None):
+        nbytes = self._image_nbytes(image)
+        with self._lock:
+            if key in self._memory or key in self._spilled:
+                # 上一次渲染中途中断时已缓存的页面
+                return
+            if self._memory_bytes + nbytes <= self.memory_limit:
+                self._memory[key] = image
+                self._memory_bytes += nbytes
+                return
+
+        # 内存已满，溢出到磁盘；磁盘缓存中已有的页面建立硬链接（不复制数据），
+        # 之后磁盘缓存文件被清理或替换时溢出文件仍然有效，无法建立硬链接时写入副本
+        doc_hash, page_num, dpi, grayscale = key
+        spill_path = os.path.join(self.spill_dir, f"{doc_hash[:16]}_{dpi}{'g' if grayscale else 'c'}_{page_num}.npy")
+        try:
+            if disk_path is None:
+                raise OSError
+            os.link(disk_path, spill_path)
+        except OSError:
+            np.save(spill_path, np.asarray(image))
+        with self._lock:
+            self._spilled[key] = spill_path
+            self.spilled_pages += 1
+
+    def _load(self, key):
+        with self._lock:
+            image = self._memory.get(key)
+            spill_path = self._spilled.get(key)
+        if image is not None:
+            return image
+        return Image.fromarray(np.load(spill_path, mmap_mode='r'))
+
+    @staticmethod
+    def _image_nbytes(image):
+        # PIL 对多通道图像按每像素4字节存储
+        bytes_per_pixel = 1 if image.mode in ('1', 'L', 'P') else 4
+        return image.width * image.height * bytes_per_pixel
+
+    def clear(self):
+        """释放内存中的页面、删除溢出文件并取消磁盘缓存中的 pin"""
+        with self._lock:
+            self._memory.clear()
+            self._spilled.clear()
+            self._page_counts.clear()
+            self._memory_bytes = 0
+            pinned_docs, self._pinned_docs = self._pinned_docs, set()
+        for doc_hash in pinned_docs:
+            self.disk_cache.unpin(doc_hash)
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+
+class SourcePdfCache:
+    """批次级源PDF解析缓存
+
+    矢量模式下同一批次的所有公司共用同一份解析后的源PDF（整份读入内存，不保留文件句柄）。
+    各公司的输出通过 PdfWriter.add_page 克隆页面，未修改的图片、字体等对象按原始编码复制，不会重新解码。
+    """
+
+    def __init__(self):
+        self._readers = {}  # (路径, 修改时间, 大小) -> PdfReader
+        self._lock = threading.Lock()
+        self.parsed_documents = 0
+        self.hit_documents = 0
+
+    def get_reader(self, pdf_path):
+        """返回源PDF的解析结果，调用方只能读取，不得修改其中的对象"""
+        stat = os.stat(pdf_path)
+        key = (os.path.abspath(pdf_path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            reader = self._readers.get(key)
+            if reader is not None:
+                self.hit_documents += 1
+                return reader
+
+        reader = PdfReader(pdf_path)
+        with self._lock:
+            self._readers[key] = reader
+            self.parsed_documents += 1
+        return reader
+
+    def clear(self):
+        with self._lock:
+            self._readers.clear()
+
+
+class StageTimer:
+    """单个任务的阶段计时，记录每次执行的 (阶段名称, 秒)
+
+    可在多个线程中同时记录；批处理结束后由 BatchReport 按公司和整个批次汇总。
+    pages 为任务成功写入的页数，由生成PDF的流程在完成时设置。
+    """
+
+    def __init__(self):
+        self.samples = []
+        self.pages = 0
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.append((stage, seconds))
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        """计时 with 块，出错时也记录"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start_time)
+
+
+class StagedPipeline:
+    """由有界队列连接的多阶段线程流水线
+
+    第一个阶段迭代 source 产生条目，之后每个阶段对上游的结果调用处理函数；各阶段在独立线程中
+    同时运行，阶段之间的队列容量为 queue_size，上游过快时阻塞等待，内存保持有界。
+    stages 为 [(阶段名称, 处理函数, 线程数)]，线程数大于1的阶段内部并行处理并保持输入顺序。
+    迭代流水线得到最后一个阶段的结果；任一阶段出错时整条流水线停止，异常在迭代处重新抛出。
+    指定 timer (StageTimer) 时，每个条目在每个阶段的耗时都记录为一个样本。
+    """
+
+    _END = object()
+
+    def __init__(self, source_name, source, stages, queue_size=BATCH_QUEUE_SIZE, timer=None):
+        self.source = source
+        self.stages = [(source_name, None, 1)] + [(name, func, max(1, int(workers)))
+                                                  for name, func, workers in stages]
+        self.queue_size = max(1, int(queue_size))
+        self.timer = timer
+        self.elapsed = 0.0
+        self._busy = [0.0] * len(self.stages)
+        self._items = [0] * len(self.stages)
+        # 每个阶段输出队列的 [采样次数, 深度合计, 最大深度]，每次放入条目后采样
+        self._depths = [[0, 0, 0] for _ in self.stages]
+        self._queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._error = None
+
+    def __iter__(self):
+        threads = [threading.Thread(target=self._run_source, daemon=True)]
+        threads += [threading.Thread(target=self._run_stage, args=(index,), daemon=True)
+                    for index in range(1, len(self.stages))]
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(self._queues[-1])
+                if item is self._END:
+                    break
+                yield item
+            if self._error is not None:
+                raise self._error
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self.elapsed = time.perf_counter() - start_time
+
+    def _run_source(self):
+        """第一个阶段：迭代 source，迭代本身的耗时计为该阶段的忙碌时间"""
+        iterator = iter(self.source)
+        try:
+            while True:
+                start_time = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                self._add_busy(0, time.perf_counter() - start_time)
+                if not self._put(0, item):
+                    return
+            self._put(0, self._END)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            # 提前停止时在本线程中关闭生成器，及时清理其临时文件
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    def _run_stage(self, index):
+        """中间阶段：从上游队列取出条目，处理后按输入顺序放入本阶段的输出队列"""
+        name, func, workers = self.stages[index]
+
+        def process(item):
+            start_time = time.perf_counter()
+            result = func(item)
+            self._add_busy(index, time.perf_counter() - start_time)
+            return result
+
+        try:
+            if workers <= 1:
+                while True:
+                    item = self._get(self._queues[index - 1])
+                    if item is self._END:
+                        break
+                    if not self._put(index, process(item)):
+                        return
+            else:
+                # 同时在途的条目数有上限，按提交顺序输出
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    in_flight = deque()
+                    while True:
+                        item = self._get(self._queues[index - 1])
+                        if item is self._END:
+                            break
+                        in_flight.append(pool.submit(process, item))
+                        if len(in_flight) >= workers * 2 and not self._put(index, in_flight.popleft().result()):
+                            return
+                    while in_flight:
+                        if not self._put(index, in_flight.popleft().result()):
+                            return
+            self._put(index, self._END)
+        except BaseException as e:
+            self._fail(e)
+
+    def _get(self, source_queue):
+        """取出一个条目；流水线停止时返回结束标记"""
+        while not self._stop.is_set():
+            try:
+                return source_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return self._END
+
+    def _put(self, index, item):
+        """放入阶段 index 的输出队列并采样队列深度；流水线停止时返回False"""
+        target_queue = self._queues[index]
+        while not self._stop.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            if item is not self._END:
+                depth = target_queue.qsize()
+                with self._lock:
+                    samples = self._depths[index]
+                    samples[0] += 1
+                    samples[1] += depth
+                    samples[2] = max(samples[2], depth)
+            return True
+        return False
+
+    def _add_busy(self, index, seconds):
+        with self._lock:
+            self._busy[index] += seconds
+            self._items[index] += 1
+        if self.timer is not None:
+            self.timer.record(self.stages[index][0], seconds)
+
+    def _fail(self, error):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+    def stats(self):
+        """各阶段的处理条目数、忙碌时间（多线程阶段为各线程合计）和输出队列深度"""
+        stages = []
+        for index, (name, func, workers) in enumerate(self.stages):
+            samples, total_depth, max_depth = self._depths[index]
+            stages.append({
+                "name": name,
+                "workers": workers,
+                "items": self._items[index],
+                "busy_seconds": round(self._busy[index], 3),
+                "queue_mean_depth": round(total_depth / samples, 2) if samples else 0.0,
+                "queue_max_depth": max_depth,
+                "queue_size": self.queue_size,
+            })
+        return {"seconds": round(self.elapsed, 3), "stages": stages}
+
+    def busy_seconds(self, name):
+        """指定阶段的忙碌时间（秒），没有该阶段时为0"""
+        for index, (stage_name, func, workers) in enumerate(self.stages):
+            if stage_name == name:
+                return self._busy[index]
+        return 0.0
+
+    def summary(self):
+        """一行文字的统计：每个阶段的忙碌时间和其后队列的平均/最大深度"""
+        parts = []
+        for stage in self.stats()["stages"]:
+            parts.append(f"{stage['name']} {stage['items']} 项 忙 {stage['busy_seconds']:.2f} 秒"
+                         f" [队列 平均 {stage['queue_mean_depth']:.1f} 最大 {stage['queue_max_depth']}"
+                         f"/{stage['queue_size']}]")
+        return f"总计 {self.elapsed:.2f} 秒；" + " → ".join(parts)
+
+
+class RasterPdfWriter:
+    """图片化PDF直写器
+
+    将每页的JPEG数据以DCTDecode图像对象原样写入同一个多页PDF，
+    不经过临时JPG文件、单页PDF和PdfMerger合并，也不重新编码。
+    页面尺寸（点）与图像像素尺寸一致，和原先canvas.drawImage的输出相同。
+    先写入输出文件旁的临时文件，close 成功后才替换为输出文件；出错时删除临时文件，不留下不完整的PDF。
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self._temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file = open(self._temp_path, 'wb')
+        self._offsets = {}  # 对象编号 -> 文件偏移
+        self._page_ids = []
+        self._next_id = 3  # 1: Catalog, 2: Pages
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    @staticmethod
+    def encode_page(image, jpg_quality):
+        """将PIL图像编码为JPEG，返回 (JPEG数据, 宽, 高, 模式)"""
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=jpg_quality)
+        return buffer.getvalue(), image.width, image.height, image.mode
+
+    def add_image_page(self, image, jpg_quality):
+        """将PIL图像编码为JPEG后作为新页面写入"""
+        self.add_jpeg_page(*self.encode_page(image, jpg_quality))
+
+    def add_jpeg_page(self, jpeg_data, width, height, mode='RGB'):
+        """将已编码的JPEG数据直接写入为新页面"""
+        image_id, content_id, page_id = self._next_id, self._next_id + 1, self._next_id + 2
+        self._next_id += 3
+
+        color_space = "/DeviceGray" if mode == 'L' else "/DeviceRGB"
+        self._write_stream(image_id,
+                           f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                           f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /DCTDecode",
+                           jpeg_data)
+        self._write_stream(content_id, "", f"q {width} 0 0 {height} 0 0 cm /Im0 Do Q".encode('ascii'))
+        self._write_object(page_id,
+                           f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+                           f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> "
+                           f"/Contents {content_id} 0 R >>".encode('ascii'))
+        self._page_ids.append(page_id)
+
+    def close(self):
+        """写入页面树、交叉引用表和文件尾，然后将临时文件替换为输出文件"""
+        try:
+            kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+            self._write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>"
+                               .encode('ascii'))
+            self._write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+            xref_offset = self._file.tell()
+            size = self._next_id
+            lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+            for obj_id in range(1, size):
+                lines.append(f"{self._offsets[obj_id]:010d} 00000 n \n")
+            lines.append(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+            self._file.write("".join(lines).encode('ascii'))
+            self._file.close()
+            os.replace(self._temp_path, self.output_path)
+        except BaseException:
+            self.discard()
+            raise
+
+    def discard(self):
+        """放弃输出：关闭并删除临时文件，已有的输出文件保持不变"""
+        self._file.close()
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+    def _write_object(self, obj_id, body):
+        self._offsets[obj_id] = self._file.tell()
+        self._file.write(f"{obj_id} 0 obj\n".encode('ascii') + body + b"\nendobj\n")
+
+    def _write_stream(self, obj_id, dictionary, data):
+        header = f"<< {dictionary} /Length {len(data)} >>\nstream\n".encode('ascii')
+        self._write_object(obj_id, header + data + b"\nendstream")
+
+
+def copy_pdf_object(obj, map_reference):
+    """复制PDF对象（流数据按原始编码共享），其中的间接引用通过 map_reference 映射"""
+    if isinstance(obj, IndirectObject):
+        return map_reference(obj)
+    if isinstance(obj, StreamObject):
+        copy = obj.__class__()
+        copy._data = obj._data
+        copy.update({key: copy_pdf_object(value, map_reference) for key, value in obj.items()})
+        return copy
+    if isinstance(obj, DictionaryObject):
+        return DictionaryObject({key: copy_pdf_object(value, map_reference) for key, value in obj.items()})
+    if isinstance(obj, ArrayObject):
+        return ArrayObject(copy_pdf_object(value, map_reference) for value in obj)
+    return obj
+
+
+class IncrementalPdfUpdate:
+    """增量更新方式输出PDF
+
+    原文件字节原样复制，其后只追加新对象和修改后的对象，交叉引用段通过 /Prev 指向原文件的交叉引用，
+    格式（传统xref表或xref流）与原文件保持一致。写入的对象中引用其他PDF（如reportlab生成的叠加页）
+    的间接对象会在文件末尾重新编号后一并写入。加密的PDF不适用。
+    与 RasterPdfWriter 相同，先写入临时文件，close 成功后才替换为输出文件；出错时删除临时文件，
+    避免只复制了原文件字节、仍可打开但没有水印的PDF出现在输出文件名下。
+    """
+
+    def __init__(self, reader, output_path):
+        self.reader = reader
+        self.output_path = output_path
+        self._temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._offsets = {}  # 对象编号 -> (文件偏移, 代号)
+        self._imported = {}  # (来源PDF, 对象编号, 代号) -> 新的间接引用
+        self._pending = deque()
+        # xref流格式的文件解析后 trailer 中可能没有 /Size，按已知的最大对象编号计算
+        known_ids = [obj_id for ids in reader.xref.values() for obj_id in ids] + list(reader.xref_objStm)
+        self._next_id = max([int(reader.trailer.get("/Size", 0))] + [obj_id + 1 for obj_id in known_ids])
+
+        with reader.stream.getbuffer() as data:
+            tail = bytes(data[-1024:])
+            startxref = tail.rfind(b"startxref")
+            if startxref < 0:
+                raise ValueError("源PDF缺少startxref")
+            self._prev_xref = int(tail[startxref + len(b"startxref"):].split()[0])
+            self._use_xref_stream = bytes(data[self._prev_xref:self._prev_xref + 4]) != b"xref"
+
+            self._file = open(self._temp_path, 'wb')
+            try:
+                self._file.write(data)
+                if tail[-1:] not in (b"\n", b"\r"):
+                    self._file.write(b"\n")
+            except BaseException:
+                self.discard()
+                raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def add_object(self, obj):
+        """追加新对象，返回其间接引用"""
+        ref = self._allocate()
+        self._write_object(ref.idnum, 0, obj)
+        return ref
+
+    def update_object(self, ref, obj):
+        """以同一对象编号写入修改后的对象，覆盖原文件中的版本"""
+        self._write_object(ref.idnum, ref.generation, obj)
+
+    def close(self):
+        """写入交叉引用段和文件尾，然后将临时文件替换为输出文件"""
+        try:
+            trailer = DictionaryObject()
+            for key in ("/Root", "/Info", "/ID"):
+                if key in self.reader.trailer:
+                    trailer[NameObject(key)] = self.reader.trailer.raw_get(key)
+            trailer[NameObject("/Prev")] = NumberObject(self._prev_xref)
+
+            xref_offset = self._file.tell()
+            if self._use_xref_stream:
+                xref_id = self._allocate().idnum
+                self._offsets[xref_id] = (xref_offset, 0)
+                trailer[NameObject("/Type")] = NameObject("/XRef")
+                self._write_xref_stream(xref_id, trailer)
+            else:
+                lines = ["xref\n"]
+                for start, ids in self._xref_sections():
+                    lines.append(f"{start} {len(ids)}\n")
+                    for obj_id in ids:
+                        offset, generation = self._offsets[obj_id]
+                        lines.append(f"{offset:010d} {generation:05d} n \n")
+                self._file.write("".join(lines).encode('ascii'))
+                trailer[NameObject("/Size")] = NumberObject(self._next_id)
+                self._file.write(b"trailer\n")
+                trailer.write_to_stream(self._file, None)
+            self._file.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
+            self._file.close()
+            os.replace(self._temp_path, self.output_path)
+        except BaseException:
+            self.discard()
+            raise
+
+    def discard(self):
+        """放弃输出：关闭并删除临时文件，已有的输出文件保持不变"""
+        self._file.close()
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+    def _allocate(self):
+        ref = IndirectObject(self._next_id, 0, self.reader)
+        self._next_id += 1
+        return ref
+
+    def _write_object(self, obj_id, generation, obj):
+        obj = self._translate(obj)
+        self._offsets[obj_id] = (self._file.tell(), generation)
+        self._file.write(f"{obj_id} {generation} obj\n".encode('ascii'))
+        obj.write_to_stream(self._file, None)
+        self._file.write(b"\nendobj\n")
+
+        # 写入被引用的其他PDF中的对象
+        while self._pending:
+            pending_id, pending_obj = self._pending.popleft()
+            self._write_object(pending_id, 0, pending_obj)
+
+    def _translate(self, obj):
+        """复制对象，将引用其他PDF的间接对象映射为本文件中的新编号"""
+        return copy_pdf_object(obj, self._map_reference)
+
+    def _map_reference(self, ref):
+        if ref.pdf is self.reader:
+            return ref
+        key = (id(ref.pdf), ref.idnum, ref.generation)
+        mapped = self._imported.get(key)
+        if mapped is None:
+            mapped = self._imported[key] = self._allocate()
+            self._pending.append((mapped.idnum, ref.get_object()))
+        return mapped
+
+    def _xref_sections(self):
+        """将对象编号按连续区间分组"""
+        sections = []
+        for obj_id in sorted(self._offsets):
+            if sections and sections[-1][0] + len(sections[-1][1]) == obj_id:
+                sections[-1][1].append(obj_id)
+            else:
+                sections.append((obj_id, [obj_id]))
+        return sections
+
+    def _write_xref_stream(self, xref_id, trailer):
+        offset_width = max(4, (self._file.tell().bit_length() + 7) // 8)
+        index = ArrayObject()
+        rows = []
+        for start, ids in self._xref_sections():
+            index.extend([NumberObject(start), NumberObject(len(ids))])
+            for obj_id in ids:
+                offset, generation = self._offsets[obj_id]
+                rows.append(b"\x01" + offset.to_bytes(offset_width, 'big') + generation.to_bytes(2, 'big'))
+
+        content = DecodedStreamObject()
+        content.set_data(b"".join(rows))
+        xref = content.flate_encode()
+        xref.update(trailer)
+        xref.update({
+            NameObject("/Size"): NumberObject(self._next_id),
+            NameObject("/W"): ArrayObject([NumberObject(1), NumberObject(offset_width), NumberObject(2)]),
+            NameObject("/Index"): index,
+        })
+        self._file.write(f"{xref_id} 0 obj\n".encode('ascii'))
+        xref.write_to_stream(self._file, None)
+        self._file.write(b"\nendobj")
+
+
+def compress_pdf_streams(writer):
+    """对写入器中所有未压缩的流（页面内容、字体、图像等）进行Flate压缩
+
+    压缩后反而变大的短小流保持原样，返回实际压缩的流数量
+    """
+    compressed = 0
+    for obj in writer._objects:
+        if isinstance(obj, StreamObject) and "/Filter" not in obj:
+            data = zlib.compress(obj._data, 9)
+            if len(data) + len(" /Filter /FlateDecode") < len(obj._data):
+                obj._data = data
+                obj[NameObject("/Filter")] = NameObject("/FlateDecode")
+                compressed += 1
+    return compressed
+
+
+def write_compact_pdf(writer, output_path, object_streams=False):
+    """合并重复对象后重新编号写出PDF，返回合并掉的对象数
+
+    只输出从文档目录和文档信息可达的对象。object_streams 为 True 时，
+    非流对象打包进Flate压缩的对象流 (ObjStm)，交叉引用以xref流写出（PDF 1.5）。
+    """
+    roots = [writer._root, writer._info]
+
+    # 收集可达对象（按遍历顺序）
+    objects = {}
+    stack = list(reversed(roots))
+    while stack:
+        item = stack.pop()
+        if isinstance(item, IndirectObject):
+            if item.pdf is not writer:
+                raise ValueError("PDF中存在未导入的外部对象引用")
+            if item.idnum in objects:
+                continue
+            obj_id = item.idnum
+            item = objects[obj_id] = writer._objects[obj_id - 1]
+        if isinstance(item, DictionaryObject):
+            stack.extend(reversed(list(item.values())))
+        elif isinstance(item, ArrayObject):
+            stack.extend(reversed(item))
+
+    # 合并内容完全相同的对象；页面树、目录和注释等有结构意义的对象不参与合并
+    canonical = {obj_id: obj_id for obj_id in objects}
+
+    def serialize(obj):
+        buffer = io.BytesIO()
+        copy_pdf_object(obj, lambda ref: IndirectObject(canonical[ref.idnum], 0, None)).write_to_stream(buffer, None)
+        return buffer.getvalue()
+
+    mergeable = [obj_id for obj_id, obj in objects.items()
+                 if not (isinstance(obj, DictionaryObject)
+                         and (obj.get("/Type") in ("/Page", "/Pages", "/Catalog", "/Annot", "/Outlines")
+                              or "/Parent" in obj))]
+    for _ in range(8):
+        first_seen = {}
+        changed = False
+        for obj_id in mergeable:
+            if canonical[obj_id] != obj_id:
+                continue
+            target = first_seen.setdefault(hashlib.sha256(serialize(objects[obj_id])).digest(), obj_id)
+            if target != obj_id:
+                canonical[obj_id] = target
+                changed = True
+        for obj_id in canonical:
+            while canonical[canonical[obj_id]] != canonical[obj_id]:
+                canonical[obj_id] = canonical[canonical[obj_id]]
+        if not changed:
+            break
+
+    # 按遍历顺序重新编号
+    new_ids = {}
+    for obj_id in objects:
+        if canonical[obj_id] == obj_id:
+            new_ids[obj_id] = len(new_ids) + 1
+
+    def renumber(obj):
+        return copy_pdf_object(obj, lambda ref: IndirectObject(new_ids[canonical[ref.idnum]], 0, None))
+
+    entries = {}  # 新编号 -> (1, 文件偏移) 或 (2, 对象流编号, 序号)
+    with open(output_path, 'wb') as f:
+        f.write(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n" if object_streams else b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+        def write_object(obj_id, obj):
+            entries[obj_id] = (1, f.tell())
+            f.write(f"{obj_id} 0 obj\n".encode('ascii'))
+            obj.write_to_stream(f, None)
+            f.write(b"\nendobj\n")
+
+        packed = []
+        for obj_id, new_id in new_ids.items():
+            obj = renumber(objects[obj_id])
+            if object_streams and not isinstance(obj, StreamObject):
+                packed.append((new_id, obj))
+            else:
+                write_object(new_id, obj)
+
+        next_id = len(new_ids) + 1
+        for start in range(0, len(packed), OBJECT_STREAM_SIZE):
+            chunk = packed[start:start + OBJECT_STREAM_SIZE]
+            stream_id = next_id
+            next_id += 1
+            header, body = [], io.BytesIO()
+            for index, (new_id, obj) in enumerate(chunk):
+                header.append(f"{new_id} {body.tell()}")
+                obj.write_to_stream(body, None)
+                body.write(b"\n")
+                entries[new_id] = (2, stream_id, index)
+            header = (" ".join(header) + "\n").encode('ascii')
+            content = DecodedStreamObject()
+            content.set_data(header + body.getvalue())
+            object_stream = content.flate_encode()
+            object_stream.update({
+                NameObject("/Type"): NameObject("/ObjStm"),
+                NameObject("/N"): NumberObject(len(chunk)),
+                NameObject("/First"): NumberObject(len(header)),
+            })
+            write_object(stream_id, object_stream)
+
+        trailer = DictionaryObject({
+            NameObject("/Root"): renumber(writer._root),
+            NameObject("/Info"): renumber(writer._info),
+        })
+        xref_offset = f.tell()
+        if object_streams:
+            xref_id = next_id
+            next_id += 1
+            entries[xref_id] = (1, xref_offset)
+            offset_width = max(4, (xref_offset.bit_length() + 7) // 8)
+            rows = [b"\x00" + bytes(offset_width) + b"\xff\xff"]
+            for obj_id in range(1, next_id):
+                entry = entries[obj_id]
+                if entry[0] == 1:
+                    rows.append(b"\x01" + entry[1].to_bytes(offset_width, 'big') + b"\x00\x00")
+                else:
+                    rows.append(b"\x02" + entry[1].to_bytes(offset_width, 'big') + entry[2].to_bytes(2, 'big'))
+            content = DecodedStreamObject()
+            content.set_data(b"".join(rows))
+            xref = content.flate_encode()
+            xref.update(trailer)
+            xref.update({
+                NameObject("/Type"): NameObject("/XRef"),
+                NameObject("/Size"): NumberObject(next_id),
+                NameObject("/W"): ArrayObject([NumberObject(1), NumberObject(offset_width), NumberObject(2)]),
+            })
+            f.write(f"{xref_id} 0 obj\n".encode('ascii'))
+            xref.write_to_stream(f, None)
+            f.write(b"\nendobj\n")
+        else:
+            lines = [f"xref\n0 {next_id}\n", "0000000000 65535 f \n"]
+            for obj_id in range(1, next_id):
+                lines.append(f"{entries[obj_id][1]:010d} 00000 n \n")
+            f.write("".join(lines).encode('ascii'))
+            trailer[NameObject("/Size")] = NumberObject(next_id)
+            f.write(b"trailer\n")
+            trailer.write_to_stream(f, None)
+            f.write(b"\n")
+        f.write(f"startxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
+
+    return len(objects) - len(new_ids)
+
+
+class WatermarkEngine:
+    """水印处理引擎
+
+    不依赖Tk界面，负责图片化与矢量水印的实际处理。界面线程和批处理子进程
+    各自持有独立的实例，日志通过 log 回调输出。
+    """
+
+    def __init__(self, system_fonts, temp_dir, log=None):
+        self.system_fonts = system_fonts
+        self.temp_dir = temp_dir
+        self.log = log or print
+
+        # 旋转后的水印图章缓存（页面并行时多线程共享）
+        self._stamp_cache = OrderedDict()
+        self._stamp_lock = threading.Lock()
+
+        # 字体名和字号 -> (字体对象, 实际字号)
+        self._font_choices = {}
+        self._font_lock = threading.Lock()
+
+        # (reportlab字体注册名, 字符集) -> (子集字体引用列表, 字符编码表)，矢量模式整个批次共用
+        self._font_subsets = {}
+
+        # 矢量水印叠加页模板（样式参数和页面尺寸 -> 内容流片段、文字占位和资源字典）
+        self._overlay_templates = OrderedDict()
+        self._template_lock = threading.Lock()
+
+    def add_text_watermark_to_image(self, image, text, opacity=0.5, angle=30, font_size=36,
+                                    font_family="宋体", color="#FF0000", density=1, position="center",
+                                    effect_type="outline", outline_width=2, shadow_offset=3,
+                                    effect_intensity=70, pattern_density=5, layout_cache=None, in_place=False):
+        """在页面图像上叠加文字水印，返回RGB图像
+
+        in_place 为 True 时直接修改传入的RGB图像（调用方须保证该图像不被其他地方共享）。
+        """
+        # 确保所有参数为正确类型
+        float_opacity = float(opacity)
+        int_angle = int(angle)
+        int_font_size = int(font_size)
+        int_density = int(density)
+        int_outline_width = int(outline_width)
+        int_shadow_offset = int(shadow_offset)
+        int_effect_intensity = int(effect_intensity)
+        int_pattern_density = int(pattern_density)
+
+        # 直接在RGB页面上混合水印，不再生成整页RGBA图层
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        elif not in_place:
+            image = image.copy()
+
+        # 同一文档中相同尺寸的页面共用同一份水印布局
+        layout_key = (image.size, text, float_opacity, int_angle, int_font_size, font_family, color, int_density,
+                      position, effect_type, int_outline_width, int_shadow_offset, int_effect_intensity,
+                      int_pattern_density)
+        layout = layout_cache.get(layout_key) if layout_cache is not None else None
+        if layout is None:
+            layout = self._build_watermark_layout(
+                image.size, text, float_opacity, int_angle, int_font_size, font_family, color, int_density,
+                position, effect_type, int_outline_width, int_shadow_offset, int_effect_intensity,
+                int_pattern_density
+            )
+            if layout_cache is not None:
+                layout_cache[layout_key] = layout
+
+        # 只在每个图章的范围内混合，超出页面的部分由 paste 自动裁剪
+        stamp_rgb, stamp_mask, positions = layout
+        for box in positions:
+            image.paste(stamp_rgb, box, stamp_mask)
+        return image
+
+    def _build_watermark_layout(self, size, text, float_opacity, int_angle, int_font_size, font_family, color,
+                                int_density, position, effect_type, int_outline_width, int_shadow_offset,
+                                int_effect_intensity, int_pattern_density):
+        """按页面尺寸计算水印布局，返回 (图章RGB, 图章蒙版, 粘贴位置列表)"""
+        width, height = size
+
+        # 解析颜色（支持十六进制）- 修复颜色问题
+        if color.startswith('#'):
+            r = int(color[1:3], 16)
+            g = int(color[3:5], 16)
+            b = int(color[5:7], 16)
+        else:
+            # 为常见颜色名称提供映射
+            color_map = {
+                "red": (255, 0, 0),
+                "green": (0, 255, 0),
+                "blue": (0, 0, 255),
+                "black": (0, 0, 0),
+                "white": (255, 255, 255),
+                "gray": (128, 128, 128)
+            }
+            r, g, b = color_map.get(color.lower(), (255, 0, 0))  # 默认红色
+
+        # 设置水印文字透明度（0-255）
+        alpha = int(float_opacity * 255)
+
+        # 加载字体（按字体名和字号缓存）
+        font, int_font_size = self._load_watermark_font(font_family, int_font_size)
+
+        # 获取文本尺寸（按字体和文字缓存）
+        text_width, text_height = measure_text(font, text, int_font_size)
+
+        # 所有位置使用同一个图章，只渲染和旋转一次
+        stamp_rgb, stamp_mask = self._get_watermark_stamp(
+            text, font, (font_family, int_font_size), text_width, text_height, int_angle, r, g, b, alpha,
+            effect_type, int_outline_width, int_shadow_offset, int_effect_intensity, int_pattern_density
+        )
+
+        # 根据位置和密度设置水印
+        positions = []
+        if position == "tile":
+            # 计算平铺的水印间距
+            x_spacing = max(text_width * 1.5, width // int_density)  # 确保足够的间距，防止拥挤
+            y_spacing = max(text_height * 1.5, height // int_density)
+
+            # 计算水印覆盖的行列数
+            cols = max(int_density, int(width / x_spacing) + 1)  # 确保至少有density个水印，并覆盖整个宽度
+            rows = max(int_density, int(height / y_spacing) + 1)  # 确保至少有density个水印，并覆盖整个高度
+
+            for i in range(cols):
+                for j in range(rows):
+                    # 计算水印位置，确保均匀分布
+                    x = i * width / cols
+                    y = j * height / rows
+                    positions.append((int(x), int(y)))
+        else:  # center
+            # 居中放置单个水印
+            x = (width - text_width) // 2
+            y = (height - text_height) // 2
+            positions.append((int(x - stamp_rgb.width // 2), int(y - stamp_rgb.height // 2)))
+
+        return stamp_rgb, stamp_mask, positions
+
+    def _load_watermark_font(self, font_family, font_size):
+        """解析并加载水印字体，返回 (字体, 实际字号)
+
+        解析结果按 (字体名, 字号) 缓存，备用字体的路径探测和日志只在首次加载时进行。
+        """
+        key = (font_family, font_size)
+        with self._font_lock:
+            if key in self._font_choices:
+                return self._font_choices[key]
+
+        font = None
+        try:
+            # 尝试从系统字体映射获取字体路径
+            font_path = None
+            if font_family in self.system_fonts:
+                font_path = self.system_fonts[font_family]
+
+            # 根据字体粗细调整字体路径
+            if font_path and os.path.exists(font_path):
+                font = load_truetype_font(font_path, font_size)
+                self.log(f"使用字体: {font_family} ({font_path})")
+            else:
+                # 尝试常见中文字体路径
+                if platform.system() == 'Darwin':  # macOS
+                    possible_fonts = [
+                        '/System/Library/Fonts/PingFang.ttc',
+                        '/Library/Fonts/Arial Unicode.ttf',
+                        '/System/Library/Fonts/STHeiti Medium.ttc',
+                        '/System/Library/Fonts/STHeiti Bold.ttc',
+                        '/System/Library/Fonts/Hiragino Sans GB.ttc'
+                    ]
+                    for path in possible_fonts:
+                        if os.path.exists(path):
+                            font = load_truetype_font(path, font_size)
+                            self.log(f"使用备用字体: {path}")
+                            break
+
+                # 如果找不到合适的字体，使用默认字体
+                if font is None:
+                    font = ImageFont.load_default()
+                    self.log("使用系统默认字体")
+                    font_size = 24  # 调整默认字体大小
+        except Exception as e:
+            self.log(f"加载字体时出错: {str(e)}")
+            font = ImageFont.load_default()
+            font_size = 24
+
+        with self._font_lock:
+            self._font_choices[key] = (font, font_size)
+        return font, font_size
+
+    def _get_watermark_stamp(self, text, font, font_key, text_width, text_height, angle, r, g, b, alpha,
+                             effect_type, outline_width, shadow_offset, intensity, pattern_density):
+        """返回应用效果并旋转后的水印图章 (RGB图像, L蒙版)
+
+        按 (文字, 字体, 字号, 角度, 颜色, 透明度, 效果参数) 缓存，
+        平铺时每个位置直接粘贴同一个图章。返回的图章为共享对象，不得原地修改。
+        """
+        key = (text, font_key, angle, (r, g, b), alpha, effect_type, outline_width, shadow_offset,
+               intensity, pattern_density)
+        with self._stamp_lock:
+            stamp = self._stamp_cache.get(key)
+            if stamp is not None:
+                self._stamp_cache.move_to_end(key)
+                return stamp
+
+        # 创建水印文字，所有效果共用同一个字形蒙版，文字只光栅化一次
+        txt = Image.new('RGBA', (int(text_width + 60), int(text_height + 60)), (0, 0, 0, 0))
+        glyph = Image.new('L', txt.size, 0)
+        ImageDraw.Draw(glyph).text((30, 30), text, font=font, fill=255)
+
+        # 根据效果类型应用不同的水印效果
+        if effect_type == "outline":
+            # 轮廓效果
+            self._apply_outline_effect(txt, glyph, r, g, b, alpha, outline_width, intensity)
+        elif effect_type == "shadow":
+            # 阴影效果
+            self._apply_shadow_effect(txt, glyph, r, g, b, alpha, shadow_offset, intensity)
+        elif effect_type == "emboss":
+            # 浮雕效果
+            self._apply_emboss_effect(txt, glyph, r, g, b, alpha, intensity)
+        elif effect_type == "texture":
+            # 纹理效果
+            seed = watermark_seed(text, font_key, (r, g, b), alpha, pattern_density, intensity)
+            self._apply_texture_effect(txt, glyph, r, g, b, alpha, pattern_density, intensity, seed)
+        else:
+            # 默认效果
+            txt.paste((r, g, b, alpha), mask=glyph)
+
+        rotated = txt.rotate(angle, expand=True)
+
+        # 原先图章以自身透明度贴到全黑透明图层后再与页面合成，颜色和覆盖率都各乘了一次 alpha/255，
+        # 这里预先算好对应的颜色和蒙版，直接贴到RGB页面上保持相同的视觉效果
+        stamp_array = np.asarray(rotated, dtype=np.uint16)
+        stamp_alpha = stamp_array[:, :, 3:4]
+        stamp_rgb = Image.fromarray(((stamp_array[:, :, :3] * stamp_alpha + 127) // 255).astype(np.uint8), 'RGB')
+        stamp_mask = Image.fromarray(((stamp_alpha[:, :, 0] * stamp_alpha[:, :, 0] + 127) // 255).astype(np.uint8),
+                                     'L')
+        stamp = (stamp_rgb, stamp_mask)
+
+        with self._stamp_lock:
+            self._stamp_cache[key] = stamp
+            while len(self._stamp_cache) > STAMP_CACHE_SIZE:
+                self._stamp_cache.popitem(last=False)
+        return stamp
+
+    @staticmethod
+    def _shift_mask(mask, dx, dy):
+        """返回平移 (dx, dy) 后的字形蒙版，移出范围的部分被裁掉
+
+        与在偏移位置重新绘制文字的结果一致（整数偏移下字形光栅化结果不变）。
+        """
+        shifted = Image.new('L', mask.size, 0)
+        shifted.paste(mask, (dx, dy))
+        return shifted
+
+    def _apply_outline_effect(self, txt, glyph, r, g, b, alpha, outline_width, intensity):
+        """应用轮廓效果"""
+        # 计算轮廓颜色（稍深于主颜色）
+        outline_r = max(0, r - 50)
+        outline_g = max(0, g - 50)
+        outline_b = max(0, b - 50)
+
+        # 计算轮廓透明度（基于强度）
+        outline_alpha = int(alpha * (intensity / 100))
+
+        # 多层8个方向的轮廓颜色相同，逐次叠加的覆盖率为 1 - ∏(1 - m)，
+        # 先合并成一个蒙版再一次性填充，与逐层绘制文字的结果相同
+        uncovered = np.ones((glyph.height, glyph.width))
+        for i in range(outline_width, 0, -1):
+            for dx, dy in ((i, i), (i, -i), (-i, i), (-i, -i), (i, 0), (-i, 0), (0, i), (0, -i)):
+                uncovered *= 1 - np.asarray(self._shift_mask(glyph, dx, dy), dtype=np.float64) / 255
+        outline_mask = Image.fromarray(np.round((1 - uncovered) * 255).astype(np.uint8), 'L')
+        txt.paste((outline_r, outline_g, outline_b, outline_alpha), mask=outline_mask)
+
+        # 绘制主文字
+        txt.paste((r, g, b, alpha), mask=glyph)
+
+    def _apply_shadow_effect(self, txt, glyph, r, g, b, alpha, shadow_offset, intensity):
+        """应用阴影效果"""
+        # 计算阴影透明度（基于强度）
+        shadow_alpha = int(alpha * 0.5 * (intensity / 100))
+
+        # 绘制阴影
+        txt.paste((0, 0, 0, shadow_alpha), mask=self._shift_mask(glyph, shadow_offset, shadow_offset))
+
+        # 绘制主文字
+        txt.paste((r, g, b, alpha), mask=glyph)
+
+    def _apply_emboss_effect(self, txt, glyph, r, g, b, alpha, intensity):
+        """应用浮雕效果"""
+        # 计算高光和阴影颜色
+        highlight_r = min(255, r + 100)
+        highlight_g = min(255, g + 100)
+        highlight_b = min(255, b + 100)
+
+        shadow_r = max(0, r - 100)
+        shadow_g = max(0, g - 100)
+        shadow_b = max(0, b - 100)
+
+        # 计算效果透明度（基于强度）
+        effect_alpha = int(alpha * (intensity / 100))
+
+        # 绘制高光（左上角）
+        txt.paste((highlight_r, highlight_g, highlight_b, effect_alpha), mask=self._shift_mask(glyph, -2, -2))
+
+        # 绘制阴影（右下角）
+        txt.paste((shadow_r, shadow_g, shadow_b, effect_alpha), mask=self._shift_mask(glyph, 2, 2))
+
+        # 绘制主文字（中间）
+        txt.paste((r, g, b, alpha), mask=glyph)
+
+    def _apply_texture_effect(self, txt, glyph, r, g, b, alpha, pattern_density, intensity, seed):
+        """应用纹理效果"""
+        # 绘制主文字
+        txt.paste((r, g, b, alpha), mask=glyph)
+
+        # 添加纹理点
+        point_alpha = int(alpha * 0.7 * (intensity / 100))
+        point_size = max(1, pattern_density // 3)
+
+        # 单个纹理点的形状只绘制一次
+        dot = Image.new('L', (point_size + 1, point_size + 1), 0)
+        ImageDraw.Draw(dot).ellipse([0, 0, point_size, point_size], fill=255)
+        dot_ys, dot_xs = np.nonzero(np.asarray(dot))
+
+        # 在文字周围添加点，位置由种子确定，一次生成全部坐标
+        rng = np.random.default_rng(seed)
+        points = rng.integers(20, 181, size=(pattern_density * 10, 2))
+        texture = np.zeros((200 + point_size + 1, 200 + point_size + 1), dtype=np.uint8)
+        texture[points[:, 1:2] + dot_ys, points[:, 0:1] + dot_xs] = point_alpha
+
+        # 将纹理应用到主文字（纹理区域为200x200，超出部分裁掉）
+        txt.paste((r, g, b, point_alpha), (30, 30), Image.fromarray(np.ascontiguousarray(texture[:200, :200]), 'L'))
+
+    def apply_watermark_to_pdf(self, input_path, output_path, text, opacity=0.5, angle=30,
+                               font_size=36, font_family="宋体", color="#FF0000",
+                               density=1, position="center", quality=100, rasterize=True,
+                               compression_level=0, effect_type="outline", outline_width=2,
+                               shadow_offset=3, effect_intensity=70, pattern_density=5, page_cache=None,
+                               page_threads=1, source_cache=None, incremental=False, font_charset=None,
+                               stage_timer=None):
+        """生成单个公司的水印PDF；指定 stage_timer (StageTimer) 时记录各阶段耗时"""
+        if rasterize:
+            # 将PDF转换为图像，添加水印，然后转回PDF
+            self.rasterize_pdf_with_watermark(
+                input_path, output_path, text, opacity, angle, font_size,
+                font_family, color, density, position, quality, compression_level,
+                effect_type, outline_width, shadow_offset, effect_intensity, pattern_density,
+                page_cache=page_cache, page_threads=page_threads, stage_timer=stage_timer
+            )
+        else:
+            # 直接添加水印到PDF（不图片化）
+            self.add_watermark_to_pdf(
+                input_path, output_path, text, opacity, angle, font_size,
+                font_family, color, density, position, compression_level,
+                effect_type, outline_width, shadow_offset, effect_intensity, pattern_density,
+                source_cache=source_cache, incremental=incremental, font_charset=font_charset,
+                stage_timer=stage_timer
+            )
+
+    def rasterize_pdf_with_watermark(self, input_path, output_path, text, opacity, angle,
+                                     font_size, font_family, color, density, position, quality,
+                                     compression_level=0, effect_type="outline", outline_width=2,
+                                     shadow_offset=3, effect_intensity=70, pattern_density=5,
+                                     page_cache=None, page_threads=1, stage_timer=None):
+        # 创建临时目录
+        temp_img_dir = os.path.join(self.temp_dir, "temp_images")
+        if not os.path.exists(temp_img_dir):
+            os.makedirs(temp_img_dir, exist_ok=True)
+
+        try:
+            # 确保关键参数为正确类型
+            int_quality = int(quality)  # 保证是整数
+            float_opacity = float(opacity)  # 保证是浮点数
+            int_angle = int(angle)  # 保证是整数
+            int_font_size = int(font_size)  # 保证是整数
+            int_density = int(density)  # 保证是整数
+            int_compression = int(compression_level)  # 保证是整数
+            int_outline_width = int(outline_width)  # 保证是整数
+            int_shadow_offset = int(shadow_offset)  # 保证是整数
+            int_effect_intensity = int(effect_intensity)  # 保证是整数
+            int_pattern_density = int(pattern_density)  # 保证是整数
+
+            # 将PDF流式转换为图像（批量处理时从页面缓存读取，避免重复渲染）
+            if page_cache is not None:
+                images = page_cache.iter_pages(input_path, int_quality)
+            else:
+                images = iter_pdf_page_images(input_path, int_quality, temp_img_dir)
+
+            # 根据压缩级别设置JPEG质量
+            jpg_quality = self.get_jpg_quality_from_compression_level(int_compression)
+
+            # 本文档内按页面尺寸缓存的水印布局
+            layout_cache = {}
+
+            # 流式渲染的页面用完即弃，可以原地叠加水印；缓存中的页面是共享的，需要先复制
+            pages_shared = page_cache is not None
+
+            def composite_page(img):
+                return self.add_text_watermark_to_image(
+                    img, text, float_opacity, int_angle, int_font_size, font_family,
+                    color, int_density, position, effect_type, int_outline_width,
+                    int_shadow_offset, int_effect_intensity, int_pattern_density,
+                    layout_cache=layout_cache, in_place=not pages_shared
+                )
+
+            def encode_page(watermarked):
+                return RasterPdfWriter.encode_page(watermarked, jpg_quality)
+
+            # 渲染、水印合成、JPEG编码和写入四个阶段由有界队列连接，各自在独立线程中同时进行；
+            # 合成与编码按 page_threads 多线程并行（Pillow在合成、旋转和JPEG编码时释放GIL），
+            # 写入阶段保持页序，每个队列最多容纳 page_threads 页（至少2页），内存保持有界
+            threads = max(1, int(page_threads))
+            with RasterPdfWriter(output_path) as writer:
+                pipeline = StagedPipeline("渲染", images, [
+                    ("水印合成", composite_page, threads),
+                    ("JPEG编码", encode_page, threads),
+                    ("写入", lambda page: writer.add_jpeg_page(*page), 1),
+                ], queue_size=max(2, threads), timer=stage_timer)
+                page_count = 0
+                for _ in pipeline:
+                    page_count += 1
+            if stage_timer is not None:
+                stage_timer.pages = page_count
+            self.log(f"页面流水线: {pipeline.summary()}")
+
+        except Exception as e:
+            self.log(f"图片化PDF处理出错: {str(e)}")
+            raise e
+        finally:
+            # 清理临时文件
+            try:
+                shutil.rmtree(temp_img_dir)
+            except Exception as e:
+                self.log(f"清理临时文件出错: {str(e)}")
+
+    def add_watermark_to_pdf(self, input_path, output_path, text, opacity, angle,
+                             font_size, font_family, color, density, position, compression_level=0,
+                             effect_type="outline", outline_width=2, shadow_offset=3,
+                             effect_intensity=70, pattern_density=5, source_cache=None, incremental=False,
+                             font_charset=None, stage_timer=None):
+        # 未指定计时器时计时结果直接丢弃
+        stage_timer = stage_timer or StageTimer()
+        try:
+            # 确保参数类型正确
+            float_opacity = float(opacity)  # 保证是浮点数
+            int_angle = int(angle)  # 保证是整数
+            int_font_size = int(font_size)  # 保证是整数
+            int_density = int(density)  # 保证是整数
+            int_compression = int(compression_level)  # 保证是整数
+            int_outline_width = int(outline_width)  # 保证是整数
+            int_shadow_offset = int(shadow_offset)  # 保证是整数
+            int_effect_intensity = int(effect_intensity)  # 保证是整数
+            int_pattern_density = int(pattern_density)  # 保证是整数
+            start_time = time.time()
+
+            # 读取输入PDF（批量处理时各公司共用同一份解析结果）
+            with stage_timer.measure("读取源PDF"):
+                if source_cache is not None:
+                    input_pdf = source_cache.get_reader(input_path)
+                else:
+                    input_pdf = PdfReader(input_path)
+
+            # 查找可嵌入的TrueType字体，找不到或无法加载时使用Helvetica-Bold（仅支持西文字符）
+            reportlab_font = "Helvetica-Bold"  # 默认使用粗体字体
+            text_runs = None
+            charset = None
+            if font_family in self.system_fonts:
+                font_path = self.system_fonts[font_family]
+                try:
+                    reportlab_font = register_reportlab_font(font_path)
+                    self.log(f"使用字体: {font_family} ({font_path})")
+                except Exception as e:
+                    self.log(f"ReportLab无法加载字体 {font_path}，使用默认Helvetica-Bold: {str(e)}")
+
+            if reportlab_font != "Helvetica-Bold":
+                # 子集字体覆盖整个批次的字符，所有公司和页面共用同一份字体对象
+                charset = "".join(sorted(set(font_charset or "") | set(text)))
+                subset_fonts, assignments = self._get_font_subset(reportlab_font, charset)
+                font_refs = {NameObject(f"/WmF{n}"): font_ref for n, font_ref in enumerate(subset_fonts)}
+                text_runs = " ".join(f"/WmF{n} {int_font_size} Tf <{codes.hex()}> Tj"
+                                     for n, codes in self._encode_subset_text(text, assignments))
+
+            # 解析颜色 - 修复颜色问题
+            if color.startswith('#'):
+                r = int(color[1:3], 16) / 255.0
+                g = int(color[3:5], 16) / 255.0
+                b = int(color[5:7], 16) / 255.0
+                # 添加日志，确认颜色值
+                self.log(f"水印颜色: RGB({r:.2f}, {g:.2f}, {b:.2f}) 来自 {color}")
+            else:
+                # 为常见颜色名称提供映射
+                color_map = {
+                    "red": (1, 0, 0),
+                    "green": (0, 1, 0),
+                    "blue": (0, 0, 1),
+                    "black": (0, 0, 0),
+                    "white": (1, 1, 1),
+                    "gray": (0.5, 0.5, 0.5)
+                }
+                r, g, b = color_map.get(color.lower(), (1, 0, 0))  # 默认红色
+                self.log(f"水印颜色: 使用命名颜色 {color} -> RGB({r}, {g}, {b})")
+
+            string_width = pdfmetrics.stringWidth(text, reportlab_font, int_font_size)
+
+            def build_overlay_template(page_width, page_height):
+                """按页面尺寸生成水印叠加页模板，返回 (内容流片段, 文字占位列表, 资源字典)
+
+                子集字体的文字在内容流中以占位注释代替，占位列表记录每处的 (x, y, 是否居中)，
+                由 fill_overlay_template 按各公司的文字填入。平铺模式下叠加页只包含原点处的单个图章。
+                """
+
+                # 创建水印
+                packet = io.BytesIO()
+
+                c = canvas.Canvas(packet, pagesize=(page_width, page_height))
+
+                # 纹理点由水印样式和页面尺寸确定，相同输入每次输出一致，同批次各公司相同
+                rng = np.random.default_rng(watermark_seed(
+                    font_family, int_font_size, color, float_opacity, int_angle, int_pattern_density,
+                    page_width, page_height
+                ))
+
+                # 设置透明度和颜色 - 确保颜色正确设置
+                c.setFillColorRGB(r, g, b, alpha=float_opacity)
+
+                # 设置字体（TrueType字体的文字直接以子集编码写入，不在叠加页中嵌入字体）
+                if text_runs is None:
+                    c.setFont(reportlab_font, int_font_size)
+
+                placeholders = []
+
+                def draw_text(x, y, centred=False):
+                    """在 (x, y) 处绘制水印文字，centred 为 True 时以该点为中心"""
+                    if text_runs is None:
+                        if centred:
+                            x -= string_width / 2
+                        c.drawString(x, y, text)
+                    else:
+                        c.addLiteral(f"%WmText{len(placeholders)}")
+                        placeholders.append((x, y, centred))
+
+                # 保存当前图形状态
+                c.saveState()
+
+                if position == "tile":
+                    # 只在原点绘制一个旋转的图章，作为表单XObject放置到平铺网格的每个位置
+                    c.saveState()
+                    c.rotate(int_angle)
+
+                    # 根据效果类型应用不同的水印效果
+                    if effect_type == "outline":
+                        # 轮廓效果
+                        c.setLineWidth(int_outline_width)
+                        c.setStrokeColorRGB(r * 0.7, g * 0.7, b * 0.7, alpha=float_opacity * 0.7)
+                        c.setFillColorRGB(r, g, b, alpha=float_opacity)
+                        draw_text(0, 0)
+                    elif effect_type == "shadow":
+                        # 阴影效果
+                        c.setFillColorRGB(0, 0, 0, alpha=float_opacity * 0.5)
+                        draw_text(int_shadow_offset, -int_shadow_offset)
+                        c.setFillColorRGB(r, g, b, alpha=float_opacity)
+                        draw_text(0, 0)
+                    elif effect_type == "emboss":
+                        # 浮雕效果
+                        c.setFillColorRGB(min(1, r + 0.4), min(1, g + 0.4), min(1, b + 0.4),
+                                          alpha=float_opacity * 0.7)
+                        draw_text(-1, 1)
+                        c.setFillColorRGB(max(0, r - 0.4), max(0, g - 0.4), max(0, b - 0.4),
+                                          alpha=float_opacity * 0.7)
+                        draw_text(1, -1)
+                        c.setFillColorRGB(r, g, b, alpha=float_opacity)
+                        draw_text(0, 0)
+                    elif effect_type == "texture":
+                        # 纹理效果
+                        c.setFillColorRGB(r, g, b, alpha=float_opacity)
+                        draw_text(0, 0)
+                        # 添加纹理点
+                        c.setFillColorRGB(r, g, b, alpha=float_opacity * 0.7)
+                        for tx, ty in rng.integers(-20, 21, size=(int_pattern_density, 2)).tolist():
+                            c.circle(tx, ty, 1, fill=1, stroke=0)
+                    else:
+                        # 默认效果
+                        draw_text(0, 0)
+
+                    c.restoreState()
+                else:  # center
+                    # 居中放置单个水印
+                    c.saveState()
+                    c.translate(page_width / 2, page_height / 2)
+                    c.rotate(int_angle)
+
+                    # 根据效果类型应用不同的水印效果
+                    if effect_type == "outline":
+                        # 轮廓效果
+                        c.setLineWidth(int_outline_width)
+                        c.setStrokeColorRGB(r * 0.7, g * 0.7, b * 0.7, alpha=float_opacity * 0.7)
+                        c.setFillColorRGB(r, g, b, alpha=float_opacity)
+                        draw_text(0, 0, centred=True)
+                    elif effect_type == "shadow":
+                        # 阴影效果
+                        c.setFillColorRGB(0, 0, 0, alpha=float_opacity * 0.5)
+                        draw_text(int_shadow_offset, -int_shadow_offset, centred=True)
+                        c.setFillColorRGB(r, g, b, alpha=float_opacity)
+                        draw_text(0, 0, centred=True)
+                    elif effect_type == "emboss":
+                        # 浮雕效果
+                        c.setFillColorRGB(min(1, r + 0.4), min(1, g + 0.4), min(1, b + 0.4), alpha=float_opacity * 0.7)
+                        draw_text(-1, 1, centred=True)
+                        c.setFillColorRGB(max(0, r - 0.4), max(0, g - 0.4), max(0, b - 0.4), alpha=float_opacity * 0.7)
+                        draw_text(1, -1, centred=True)
+                        c.setFillColorRGB(r, g, b, alpha=float_opacity)
+                        draw_text(0, 0, centred=True)
+                    elif effect_type == "texture":
+                        # 纹理效果
+                        c.setFillColorRGB(r, g, b, alpha=float_opacity)
+                        draw_text(0, 0, centred=True)
+                        # 添加纹理点
+                        c.setFillColorRGB(r, g, b, alpha=float_opacity * 0.7)
+                        for tx, ty in rng.integers(-20, 21, size=(int_pattern_density, 2)).tolist():
+                            c.circle(tx, ty, 1, fill=1, stroke=0)
+                    else:
+                        # 默认效果
+                        draw_text(0, 0, centred=True)
+
+                    c.restoreState()
+
+                # 恢复图形状态
+                c.restoreState()
+                c.save()
+
+                packet.seek(0)
+                overlay_page = PdfReader(packet).pages[0]
+                resources = overlay_page["/Resources"].get_object()
+                if text_runs is not None:
+                    # 引用批次共用的子集字体
+                    if "/Font" not in resources:
+                        resources[NameObject("/Font")] = DictionaryObject()
+                    resources["/Font"].get_object().update(font_refs)
+                parts = re.split(rb"%WmText\d+", overlay_page.get_contents().get_data())
+                return parts, placeholders, resources
+
+            def fill_overlay_template(parts, placeholders):
+                """在模板的占位处填入本次水印文字，返回叠加页内容流"""
+                content = [parts[0]]
+                for (x, y, centred), part in zip(placeholders, parts[1:]):
+                    if centred:
+                        x -= string_width / 2
+                    content.append(f"BT 1 0 0 1 {x:g} {y:g} Tm {text_runs} ET".encode('ascii'))
+                    content.append(part)
+                return b"".join(content)
+
+            def get_tiling(page_width, page_height):
+                """平铺参数 (横向间距, 纵向间距, 列数, 行数, 图章边界)，随文字宽度变化"""
+                # 测量文本尺寸（在ReportLab中）
+                text_width = string_width
+                text_height = int_font_size * 1.2  # 估计文本高度
+
+                # 计算平铺的水印间距，确保足够的覆盖
+                x_spacing = max(text_width * 1.5, page_width / int_density)
+                y_spacing = max(text_height * 1.5, page_height / int_density)
+
+                # 计算水印覆盖的行列数
+                cols = max(int_density, int(page_width / x_spacing) + 1)
+                rows = max(int_density, int(page_height / y_spacing) + 1)
+
+                # 图章XObject的边界需包含旋转后的整个图章（含效果和纹理点的外扩）
+                margin = 21 + int_outline_width + int_shadow_offset
+                corners = [(x0, y0) for x0 in (-margin, text_width + margin)
+                           for y0 in (-int_font_size * 0.3 - margin, text_height + margin)]
+                cos_a, sin_a = cos(radians(int_angle)), sin(radians(int_angle))
+                xs = [x0 * cos_a - y0 * sin_a for x0, y0 in corners]
+                ys = [x0 * sin_a + y0 * cos_a for x0, y0 in corners]
+                return page_width / cols, page_height / rows, cols, rows, (min(xs), min(ys), max(xs), max(ys))
+
+            # 叠加页模板与公司名称无关（Helvetica-Bold回退时文字直接写入模板，按文字区分），
+            # 在引擎中跨调用缓存，同一批次只运行一次reportlab和解析
+            template_key = (reportlab_font, text if text_runs is None else charset, font_family, int_font_size,
+                            (r, g, b), float_opacity, int_angle, position, effect_type, int_outline_width,
+                            int_shadow_offset, int_pattern_density)
+
+            # 每种页面尺寸的水印只生成一次，作为表单XObject写入输出PDF，各页面通过 Do 引用
+            stamps = {}
+            # 页面已有同名XObject（如再次处理本工具的输出）时改用的名称 -> 引用该名称的追加内容流
+            renamed_stamps = {}
+
+            def get_stamp(page, add_object, clone_into=None):
+                """返回页面尺寸对应的水印XObject，名称与页面已有的XObject不重复"""
+                # 获取页面尺寸并转换为float类型
+                page_size = (float(page.mediabox.width), float(page.mediabox.height))
+                stamp = stamps.get(page_size)
+                if stamp is None:
+                    with stage_timer.measure("生成水印层"):
+                        parts, placeholders, resources = self._get_overlay_template(
+                            template_key + page_size, lambda: build_overlay_template(*page_size)
+                        )
+                        content = fill_overlay_template(parts, placeholders)
+                        tiling = get_tiling(*page_size) if position == "tile" else None
+                        if clone_into is not None:
+                            resources = resources.clone(clone_into)
+                        stamp = stamps[page_size] = self._add_form_xobject(
+                            add_object, content, resources, tiling, page_size, f"/WmStamp{len(stamps)}"
+                        )
+                name, form_ref, prefix_ref, suffix_ref = stamp
+                free_name = self._free_xobject_name(page, name)
+                if free_name != name:
+                    suffix_ref = renamed_stamps.get(free_name)
+                    if suffix_ref is None:
+                        suffix_ref = renamed_stamps[free_name] = add_object(self._stamp_suffix(free_name))
+                    stamp = (free_name, form_ref, prefix_ref, suffix_ref)
+                return stamp
+
+            if incremental and input_pdf.is_encrypted:
+                self.log("源PDF已加密，无法增量更新，改为完整重写")
+                incremental = False
+
+            if incremental:
+                # 增量更新：原文件字节原样保留，只追加水印对象和修改后的页面字典
+                # 写入阶段为复制原文件字节；修改后的页面在合并时直接追加
+                with stage_timer.measure("写入"):
+                    update = IncrementalPdfUpdate(input_pdf, output_path)
+                with update:
+                    for page in input_pdf.pages:
+                        stamp = get_stamp(page, update.add_object)
+                        with stage_timer.measure("合并页面"):
+                            updated_page = self._copy_page_for_update(page)
+                            self._draw_form_xobject(updated_page, *stamp)
+                            update.update_object(page.indirect_reference, updated_page)
+                stage_timer.pages = len(input_pdf.pages)
+                # 原文件字节不变，压缩级别只作用于追加的对象（均已Flate压缩）
+                self.log(f"增量更新输出 {os.path.getsize(output_path) / 1024:.1f} KB，"
+                         f"用时 {time.time() - start_time:.2f} 秒")
+                return
+
+            output_pdf = PdfWriter()
+            for page in input_pdf.pages:
+                stamp = get_stamp(page, output_pdf._add_object, clone_into=output_pdf)
+
+                # 添加页面到输出PDF，并在复制后的页面上引用水印
+                with stage_timer.measure("合并页面"):
+                    self._draw_form_xobject(output_pdf.add_page(page), *stamp)
+
+            # 保存输出PDF，应用压缩
+            with stage_timer.measure("写入"):
+                self._write_vector_pdf(output_pdf, output_path, int_compression)
+            stage_timer.pages = len(output_pdf.pages)
+            self.log(f"PDF压缩级别 {int_compression}: 输出 {os.path.getsize(output_path) / 1024:.1f} KB，"
+                     f"用时 {time.time() - start_time:.2f} 秒")
+
+        except Exception as e:
+            raise Exception(f"添加水印到PDF失败: {str(e)}")
+
+    def _get_overlay_template(self, key, build):
+        """返回矢量水印叠加页模板，按样式参数和页面尺寸缓存，未命中时调用 build 生成"""
+        with self._template_lock:
+            template = self._overlay_templates.get(key)
+            if template is not None:
+                self._overlay_templates.move_to_end(key)
+                return template
+
+        template = build()
+        with self._template_lock:
+            self._overlay_templates[key] = template
+            while len(self._overlay_templates) > OVERLAY_TEMPLATE_CACHE_SIZE:
+                self._overlay_templates.popitem(last=False)
+        return template
+
+    def _write_vector_pdf(self, writer, output_path, compression_level):
+        """按压缩级别写出矢量模式的输出PDF
+
+        0=原样写出，1=Flate压缩未压缩的流，2=另外合并重复对象，
+        3=另外把非流对象打包进对象流并使用xref流
+        """
+        if compression_level >= 1:
+            compress_pdf_streams(writer)
+        if compression_level >= 2:
+            merged = write_compact_pdf(writer, output_path, object_streams=compression_level >= 3)
+            if merged:
+                self.log(f"合并重复对象 {merged} 个")
+        else:
+            with open(output_path, 'wb') as output_file:
+                writer.write(output_file)
+
+    def _get_font_subset(self, font_name, charset):
+        """为已注册的TrueType字体生成覆盖 charset 的子集字体，返回 (子集字体引用列表, 字符编码表)
+
+        用一个只写入全部字符的载体文档让reportlab完成子集化，并记录其字符编码，
+        结果按 (字体, 字符集) 缓存，同一批次的所有输出复用同一份子集字体。
+        """
+        key = (font_name, charset)
+        with self._font_lock:
+            subset = self._font_subsets.get(key)
+        if subset is not None:
+            return subset
+
+        font = pdfmetrics.getFont(font_name)
+        packet = io.BytesIO()
+        c = canvas.Canvas(packet)
+        c.setFont(font_name, 12)
+        c.drawString(0, 0, charset)
+
+        # reportlab在保存文档时会清除字符编码状态，需先记录
+        state = font.state[c._doc]
+        assignments = dict(state.assignments)
+        internal_names = [font.getSubsetInternalName(n, c._doc) for n in range(len(state.subsets))]
+        c.save()
+
+        fonts = PdfReader(packet).pages[0]["/Resources"]["/Font"]
+        subset = ([fonts.raw_get(name) for name in internal_names], assignments)
+        with self._font_lock:
+            self._font_subsets[key] = subset
+        return subset
+
+    @staticmethod
+    def _encode_subset_text(text, assignments):
+        """按子集字体的字符编码表编码文字，返回 [(子集序号, 编码字节)]"""
+        runs = []
+        for char in text:
+            code = assignments.get(32 if char == '\xa0' else ord(char), 0)
+            if runs and runs[-1][0] == code >> 8:
+                runs[-1][1].append(code & 0xFF)
+            else:
+                runs.append((code >> 8, bytearray([code & 0xFF])))
+        return [(n, bytes(codes)) for n, codes in runs]
+
+    @staticmethod
+    def _add_form_xobject(add_object, overlay_content, resources, tiling, page_size, name):
+        """将水印叠加页内容写入为表单XObject，add_object 为输出端写入对象并返回间接引用的方法
+
+        tiling 不为 None 时，叠加页内容（原点处的单个图章）写入为单独的表单XObject，
+        表单中按原先的 列数 × 行数 网格逐个放置该图章，网格之外不绘制；图章内容只写入一次。
+        返回 (名称, XObject引用, 前置内容流引用, 追加内容流引用)，后两个内容流由同尺寸的页面共用。
+        """
+        page_width, page_height = page_size
+        content = DecodedStreamObject()
+        content.set_data(overlay_content)
+
+        if tiling is not None:
+            x_step, y_step, cols, rows, bbox = tiling
+            tile = content.flate_encode()
+            tile.update({
+                NameObject("/Type"): NameObject("/XObject"),
+                NameObject("/Subtype"): NameObject("/Form"),
+                NameObject("/BBox"): ArrayObject([FloatObject(v) for v in bbox]),
+                NameObject("/Resources"): resources,
+            })
+            resources = DictionaryObject({
+                NameObject("/XObject"): DictionaryObject({NameObject("/WmTile"): add_object(tile)})
+            })
+            # 与原先逐个绘制的网格位置相同：第 i 列第 j 行的图章位于 (i × 页宽 / 列数, j × 页高 / 行数)
+            content = DecodedStreamObject()
+            content.set_data("".join(
+                f"q 1 0 0 1 {i * page_width / cols:g} {j * page_height / rows:g} cm /WmTile Do Q\n"
+                for i in range(cols) for j in range(rows)
+            ).encode("ascii"))
+
+        form = content.flate_encode()
+        form.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): ArrayObject([FloatObject(0), FloatObject(0),
+                                              FloatObject(page_width), FloatObject(page_height)]),
+            NameObject("/Resources"): resources,
+        })
+        form_ref = add_object(form)
+
+        # 原页面内容包在 q/Q 中，避免其图形状态影响水印
+        prefix = DecodedStreamObject()
+        prefix.set_data(b"q\n")
+        return name, form_ref, add_object(prefix), add_object(WatermarkEngine._stamp_suffix(name))
+
+    @staticmethod
+    def _stamp_suffix(name):
+        """追加在原页面内容之后的内容流：结束原内容的 q，再绘制名为 name 的水印XObject"""
+        suffix = DecodedStreamObject()
+        suffix.set_data(f"\nQ\nq {name} Do Q\n".encode("ascii"))
+        return suffix
+
+    @staticmethod
+    def _free_xobject_name(page, name):
+        """返回页面资源中未被占用的XObject名称，name 已存在时依次添加 _1、_2…后缀"""
+        taken = ()
+        resources = page.get("/Resources")
+        if resources is not None:
+            xobjects = resources.get_object().get("/XObject")
+            if xobjects is not None:
+                taken = xobjects.get_object()
+        free_name = name
+        suffix = 0
+        while free_name in taken:
+            suffix += 1
+            free_name = f"{name}_{suffix}"
+        return free_name
+
+    @staticmethod
+    def _copy_page_for_update(page):
+        """浅复制页面字典及其资源字典，用于增量更新（不修改源PDF解析结果中的对象）"""
+        updated_page = DictionaryObject(page)
+        resources = page.get("/Resources")
+        if resources is not None:
+            resources = DictionaryObject(resources.get_object())
+            xobjects = resources.get("/XObject")
+            if xobjects is not None:
+                resources[NameObject("/XObject")] = DictionaryObject(xobjects.get_object())
+            updated_page[NameObject("/Resources")] = resources
+        return updated_page
+
+    @staticmethod
+    def _draw_form_xobject(page, name, form_ref, prefix_ref, suffix_ref):
+        """在输出PDF中的页面上引用水印XObject（只修改写入器中复制的页面或增量更新用的页面副本）"""
+        resources = page.get("/Resources")
+        if resources is None:
+            resources = page[NameObject("/Resources")] = DictionaryObject()
+        resources = resources.get_object()
+        xobjects = resources.get("/XObject")
+        if xobjects is None:
+            xobjects = resources[NameObject("/XObject")] = DictionaryObject()
+        xobjects.get_object()[NameObject(name)] = form_ref
+
+        contents = page.get("/Contents")
+        if contents is None:
+            streams = []
+        elif isinstance(contents.get_object(), ArrayObject):
+            streams = list(contents.get_object())
+        else:
+            streams = [contents]
+        page[NameObject("/Contents")] = ArrayObject([prefix_ref] + streams + [suffix_ref])
+
+    # 根据压缩级别返回JPEG质量
+    def get_jpg_quality_from_compression_level(self, compression_level):
+        # 压缩级别：0=不压缩，1=轻度，2=中度，3=高度
+        quality_map = {
+            0: 95,  # 高质量，几乎不压缩
+            1: 85,  # 轻度压缩
+            2: 70,  # 中度压缩
+            3: 50  # 高度压缩
+        }
+        return quality_map.get(compression_level, 95)  # 默认高质量
+
+
+# 批处理子进程内的引擎、页面缓存和事件队列（由 _init_batch_worker 初始化）
+_worker_engine = None
+_worker_page_cache = None
+_worker_source_cache = None
+_worker_events = None
+
+
+def _init_batch_worker(system_fonts, temp_root, events, rasterize, disk_cache_config=None):
+    """批处理子进程初始化：每个进程使用独立的临时目录、页面缓存和源PDF缓存
+
+    disk_cache_config 为 (缓存目录, 大小上限) 时，页面缓存使用共享的跨运行磁盘缓存。
+    """
+    global _worker_engine, _worker_page_cache, _worker_source_cache, _worker_events
+    worker_dir = tempfile.mkdtemp(prefix=f"worker_{os.getpid()}_", dir=temp_root)
+    multiprocessing.util.Finalize(None, shutil.rmtree, args=(worker_dir, True), exitpriority=10)
+
+    _worker_events = events
+    _worker_engine = WatermarkEngine(system_fonts, worker_dir, log=lambda message: events.put(("log", message)))
+    if rasterize:
+        disk_cache = RasterDiskCache(*disk_cache_config) if disk_cache_config is not None else None
+        _worker_page_cache = PageRasterCache(os.path.join(worker_dir, "raster_cache"), disk_cache=disk_cache)
+    else:
+        _worker_source_cache = SourcePdfCache()
+
+
+def _run_batch_job(job_index, input_path, output_path, text, options):
+    """在子进程中为单个公司生成水印PDF，返回 (各阶段计时样本, 写入页数, 子进程峰值内存, 异常)
+
+    处理出错时异常作为结果返回而不是抛出，失败任务的计时样本与单进程模式一样计入报告。
+    """
+    _worker_events.put(("start", job_index))
+    stage_timer = StageTimer()
+    try:
+        with stage_timer.measure("生成PDF"):
+            _worker_engine.apply_watermark_to_pdf(input_path, output_path, text, page_cache=_worker_page_cache,
+                                                  source_cache=_worker_source_cache, stage_timer=stage_timer,
+                                                  **options)
+    except Exception as e:
+        error = e
+    else:
+        error = None
+    return stage_timer.samples, stage_timer.pages, peak_rss_bytes(), error
+
+
+def setup_poppler_path(log=print):
+    """确保Poppler工具在应用程序路径中可用"""
+    # 获取应用程序运行路径
+    if getattr(sys, 'frozen', False):
+        # 如果是打包后的应用
+        application_path = os.path.dirname(sys.executable)
+
+        # 如果是Mac应用包
+        if platform.system() == 'Darwin':
+            # 检查各种可能的Mac应用包结构
+            if os.path.isdir(os.path.join(application_path, '../Resources')):
+                application_path = os.path.join(application_path, '../Resources')
+            elif os.path.isdir(os.path.join(application_path, 'Contents/Resources')):
+                application_path = os.path.join(application_path, 'Contents/Resources')
+            elif os.path.isdir(os.path.join(application_path, 'Contents/MacOS')):
+                application_path = os.path.join(application_path, 'Contents/MacOS')
+    else:
+        # 如果是直接运行Python脚本
+        application_path = os.path.dirname(os.path.abspath(__file__))
+
+    # 将应用程序路径添加到系统PATH中，使pdf2image能找到poppler二进制文件
+    os.environ['PATH'] = application_path + os.pathsep + os.environ.get('PATH', '')
+
+    # 打印调试信息
+    log(f"设置Poppler路径: {application_path}")
+    log(f"系统PATH: {os.environ['PATH']}")
+
+    # 检查是否有从PyInstaller打包时添加的Poppler二进制文件
+    poppler_files = glob.glob(os.path.join(application_path, "pdftoppm*"))
+    if poppler_files:
+        log(f"找到Poppler文件: {poppler_files}")
+    else:
+        log("未在应用程序目录中找到Poppler文件，将使用系统Poppler")
+
+
+def find_system_fonts(log=print):
+    """获取系统安装的字体"""
+    system_fonts = {}
+
+    # Windows系统字体路径
+    if platform.system() == 'Windows':
+        font_dir = 'C:\\Windows\\Fonts'
+        system_fonts = {
+            "宋体": "C:\\Windows\\Fonts\\simsun.ttc",
+            "黑体": "C:\\Windows\\Fonts\\simhei.ttf",
+            "微软雅黑": "C:\\Windows\\Fonts\\msyh.ttc",
+            "微软雅黑粗体": "C:\\Windows\\Fonts\\msyhbd.ttc",  # 添加粗体版本
+            "Arial": "C:\\Windows\\Fonts\\arial.ttf",
+            "Times New Roman": "C:\\Windows\\Fonts\\times.ttf",
+            "Arial Black": "C:\\Windows\\Fonts\\ariblk.ttf",  # 添加非常宽的字体
+            "Impact": "C:\\Windows\\Fonts\\impact.ttf"  # 添加非常宽的字体
+        }
+
+    # MacOS系统字体路径
+    elif platform.system() == 'Darwin':  # macOS
+        font_dirs = [
+            '/System/Library/Fonts',
+            '/Library/Fonts',
+            os.path.expanduser('~/Library/Fonts'),
+            '/System/Library/Fonts/Supplemental'  # 添加补充字体
+        ]
+
+        # 增强的 macOS 中文字体映射
+        potential_fonts = {
+            "宋体": ["STSong", "Songti", "SimSun", "Songti.ttc", "宋体", "STSongti-SC"],
+            "黑体": ["STHeiti", "Heiti", "SimHei", "Heiti.ttc", "黑体", "STHeiti-Medium"],
+            "微软雅黑": ["Microsoft YaHei", "MicrosoftYaHei", "微软雅黑", "PingFang", "PingFangSC"],
+            "微软雅黑粗体": ["Microsoft YaHei Bold", "PingFang SC Bold", "PingFang-SC-Bold"],
+            "Arial": ["Arial", "Arial.ttf", "ArialMT"],
+            "Times New Roman": ["Times New Roman", "Times", "TimesNewRoman"],
+            "Arial Black": ["Arial Black", "Arial-Black"],
+            "Impact": ["Impact", "Impact.ttf"]
+        }
+
+        # 查找字体文件
+        for font_name, patterns in potential_fonts.items():
+            for font_dir in font_dirs:
+                for pattern in patterns:
+                    matches = glob.glob(f"{font_dir}/**/*{pattern}*", recursive=True)
+                    if matches:
+                        system_fonts[font_name] = matches[0]
+                        break
+                if font_name in system_fonts:
+                    break
+
+        # 确保我们至少有一些基本字体
+        if "黑体" not in system_fonts:
+            # 尝试查找任何中文字体作为备用
+            for font_dir in font_dirs:
+                cn_fonts = glob.glob(f"{font_dir}/**/华文*.ttf", recursive=True)
+                cn_fonts += glob.glob(f"{font_dir}/**/STSong*.ttf", recursive=True)
+                cn_fonts += glob.glob(f"{font_dir}/**/Songti*.ttc", recursive=True)
+                cn_fonts += glob.glob(f"{font_dir}/**/Heiti*.ttc", recursive=True)
+                if cn_fonts:
+                    system_fonts["黑体"] = cn_fonts[0]
+                    break
+
+    # Linux系统字体路径
+    elif platform.system() == 'Linux':
+        font_dirs = [
+            '/usr/share/fonts/',
+            '/usr/local/share/fonts/',
+            os.path.expanduser('~/.fonts/')
+        ]
+
+        # 常见中文字体映射
+        potential_fonts = {
+            "宋体": ["SimSun", "simsun", "song"],
+            "黑体": ["SimHei", "simhei"],
+            "微软雅黑": ["Microsoft YaHei", "msyh"],
+            "微软雅黑粗体": ["Microsoft YaHei Bold", "msyhbd"],
+            "Arial": ["Arial", "arial"],
+            "Times New Roman": ["Times New Roman", "times"],
+            "Arial Black": ["Arial Black", "ariblk"],
+            "Impact": ["Impact"]
+        }
+
+        # 查找字体文件
+        for font_name, patterns in potential_fonts.items():
+            for font_dir in font_dirs:
+                for pattern in patterns:
+                    matches = glob.glob(f"{font_dir}/**/*{pattern}*", recursive=True)
+                    if matches:
+                        system_fonts[font_name] = matches[0]
+                        break
+                if font_name in system_fonts:
+                    break
+
+    # 记录字体查找结果
+    for font_name, path in system_fonts.items():
+        log(f"找到字体: {font_name} -> {path}")
+
+    return system_fonts
+
+
+def is_valid_email(email):
+    """验证邮箱地址格式 - 增强版RFC 5322合规检查"""
+    if not email or not isinstance(email, str):
+        return False
+
+    email = email.strip()
+
+    # 基本长度检查
+    if len(email) > 254:  # RFC 5322规定最大长度
+        return False
+
+    # 更严格的正则表达式，符合RFC 5322标准
+    pattern = r'^[a-zA-Z0-9!#$%&\'*+/=?^_`{|}~-]+(?:\.[a-zA-Z0-9!#$%&\'*+/=?^_`{|}~-]+)*@(?:[a-zA-Z0-9](?:[a-zA-Z0-9-]*[a-zA-Z0-9])?\.)+[a-zA-Z0-9](?:[a-zA-Z0-9-]*[a-zA-Z0-9])?$'
+
+    if not re.match(pattern, email):
+        return False
+
+    # 额外检查：确保域名部分有效
+    local_part, domain_part = email.split('@', 1)
+
+    # 检查本地部分长度
+    if len(local_part) > 64:  # RFC 5322规定本地部分最大长度
+        return False
+
+    # 检查域名部分
+    if len(domain_part) > 253 or '.' not in domain_part:
+        return False
+
+    # 检查域名各部分
+    domain_parts = domain_part.split('.')
+    if any(len(part) == 0 or len(part) > 63 for part in domain_parts):
+        return False
+
+    return True
+
+
+def parse_email_cell(email_cell):
+    """解析分号分隔的邮箱单元格（支持中文全角和英文半角分号），返回 (有效邮箱列表, 无效邮箱列表)"""
+    valid, invalid = [], []
+    if pd.notna(email_cell):
+        # 先将中文全角分号替换为英文半角分号，然后统一分割
+        for email in str(email_cell).replace('；', ';').split(';'):
+            email_str = email.strip()
+            if email_str and is_valid_email(email_str):
+                valid.append(email_str)
+            elif email_str:
+                invalid.append(email_str)
+    return valid, invalid
+
+
+def load_company_list(path, name_column=None, email_column=None, log=print):
+    """读取公司列表，返回 (公司名称列表, 公司名称到邮箱列表的映射)
+
+    Excel/CSV 文件按列读取，name_column 缺省为第一列，指定 email_column 时读取同一行的邮箱；
+    其他文件按每行一个公司名称读取。
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in (".xlsx", ".xls", ".csv"):
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            company_names = [line.strip() for line in f if line.strip()]
+        return company_names, {}
+
+    df = pd.read_csv(path) if extension == ".csv" else pd.read_excel(path)
+    name_column = name_column or df.columns[0]
+    company_names = []
+    company_email_map = {}
+    invalid_emails = []
+    for _, row in df.iterrows():
+        if pd.isna(row[name_column]):
+            continue
+        company_name = str(row[name_column])
+        company_names.append(company_name)
+        if email_column:
+            email_list, invalid = parse_email_cell(row[email_column])
+            company_email_map[company_name] = email_list
+            invalid_emails.extend(invalid)
+
+    if invalid_emails:
+        log(f"发现 {len(invalid_emails)} 个无效邮箱地址，已自动过滤: "
+            f"{', '.join(invalid_emails[:5])}{'...' if len(invalid_emails) > 5 else ''}")
+    return company_names, company_email_map
+
+
+def build_watermark_options(settings):
+    """由 watermark_config.json 格式的设置生成 apply_watermark_to_pdf 的参数，缺省值与界面一致"""
+    return {
+        "opacity": int(settings.get("opacity", 24)) / 100,  # 转换为0-1范围的浮点数
+        "angle": int(settings.get("angle", 45)),
+        "font_size": int(settings.get("font_size", 48)),
+        "font_family": settings.get("font_family", "黑体"),
+        "color": settings.get("text_color", "#FF0000"),
+        "density": int(settings.get("watermark_density", 7)),
+        "position": settings.get("watermark_position", "tile"),
+        "quality": int(settings.get("conversion_quality", 200)),
+        "rasterize": bool(settings.get("enable_rasterize", True)),
+        "incremental": bool(settings.get("incremental_output", False)),
+        "compression_level": int(settings.get("compression_level", 2)),
+        "effect_type": settings.get("effect_type", "outline"),
+        "outline_width": int(settings.get("outline_width", 2)),
+        "shadow_offset": int(settings.get("shadow_offset", 3)),
+        "effect_intensity": int(settings.get("effect_intensity", 70)),
+        "pattern_density": int(settings.get("pattern_density", 5)),
+        "page_threads": max(1, int(settings.get("page_threads", 1)))
+    }
+
+
+def build_batch_jobs(pdf_paths, company_names, prefix_text, suffix_text, filename_pattern, output_dir):
+    """为每个源PDF和公司的组合生成水印文本和输出文件名
+
+    pdf_paths 为一个或多个源PDF路径；返回 [(公司名称, 水印文本, 输出路径, 输出文件名, 源PDF路径)]，
+    按公司排列（同一公司的各文档相邻），便于尽早发送合并邮件。不同组合的输出文件名相同时抛出 ValueError。
+    """
+    if isinstance(pdf_paths, str):
+        pdf_paths = [pdf_paths]
+    jobs = []
+    output_paths = set()
+    for company_name in company_names:
+        watermark_text = f"{prefix_text}{company_name}{suffix_text}"
+        for pdf_path in pdf_paths:
+            # 获取上传文件的名称（不含扩展名）
+            base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+            # 替换命名规则中的占位符
+            output_filename = filename_pattern.replace("文件名", base_filename).replace("{company}", company_name)
+            # 处理文件名中的无效字符
+            output_filename = re.sub(r'[\\/*?:"<>|]', "_", output_filename)
+            output_path = os.path.join(output_dir, f"{output_filename}.pdf")
+            if len(pdf_paths) > 1 and output_path in output_paths:
+                raise ValueError(f"多个源PDF的输出文件名重复: {output_filename}.pdf，"
+                                 f"请在命名规则中包含“文件名”并确保源PDF文件名互不相同")
+            output_paths.add(output_path)
+            jobs.append((company_name, watermark_text, output_path, output_filename, pdf_path))
+    return jobs
+
+
+class EmailSender:
+    """按 email_config.json 中的SMTP设置和邮件模板发送带附件的邮件，不依赖Tk界面
+
+    同一个发送器的多封邮件复用同一个已登录的SMTP会话，服务器断开后自动重新连接；
+    用完后调用 close()（或使用 with 块）退出会话。
+    """
+
+    def __init__(self, smtp_server, smtp_port, smtp_username, smtp_password, sender_name, email_subject, email_body):
+        self.smtp_server = smtp_server
+        self.smtp_port = int(smtp_port)
+        self.smtp_username = smtp_username
+        self.smtp_password = smtp_password
+        self.sender_name = sender_name
+        self.email_subject = email_subject
+        self.email_body = email_body
+        self._server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @classmethod
+    def from_settings(cls, settings):
+        """由 email_config.json 格式的设置创建，缺省值与界面一致"""
+        return cls(settings.get("smtp_server", "smtp.exmail.qq.com"), settings.get("smtp_port", 465),
+                   settings.get("smtp_username", ""), settings.get("smtp_password", ""),
+                   settings.get("sender_name", "系统管理员"),
+                   settings.get("email_subject", "您的加水印文件已准备好"),
+                   settings.get("email_body",
+                                "尊敬的{company}，\n\n您的加水印文件已处理完成，请查收附件。\n\n如有任何问题，请及时联系我们。\n\n祝好！"))
+
+    def _connection(self):
+        """返回已登录的SMTP会话，首次使用或断开后重新连接"""
+        if self._server is None:
+            if self.smtp_port == 465:  # SSL
+                server = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port)
+            else:  # TLS (587 for Gmail)
+                server = smtplib.SMTP(self.smtp_server, self.smtp_port)
+                server.starttls()
+            try:
+                server.login(self.smtp_username, self.smtp_password)
+            except Exception:
+                server.close()
+                raise
+            self._server = server
+        return self._server
+
+    def close(self):
+        """退出SMTP会话"""
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+    def send(self, company_name, email_address, attachments):
+        """发送邮件，专门针对Gmail和其他邮箱优化
+
+        attachments 为 [(文件路径, 文件名)]，邮件模板中的 {filename} 替换为所有附件的文件名。
+        """
+        try:
+            # 创建邮件对象，使用mixed类型以确保Gmail兼容性
+            msg = MIMEMultipart('mixed')
+
+            # 设置基本邮件头 - 确保RFC 5322合规
+            sender_name = self.sender_name.strip()
+            sender_email = self.smtp_username.strip()
+            
+            # 验证邮箱地址格式
+            if not is_valid_email(sender_email):
+                raise Exception(f"发件人邮箱地址格式无效: {sender_email}")
+            
+            # 安全地设置From头部，处理特殊字符
+            try:
+                # 尝试直接设置（ASCII字符）
+                sender_name.encode('ascii')
+                # 如果是ASCII字符，可以直接使用
+                msg['From'] = f"{sender_name} <{sender_email}>"
+            except UnicodeEncodeError:
+                # 如果包含非ASCII字符，需要使用RFC 2047编码
+                from email.header import Header
+                encoded_name = Header(sender_name, 'utf-8').encode()
+                msg['From'] = f"{encoded_name} <{sender_email}>"
+            
+            msg['To'] = email_address
+
+            filename = "、".join(name for path, name in attachments)
+
+            # 处理邮件主题，确保Gmail能正确显示
+            subject = self.email_subject.replace("{company}", company_name).replace("{filename}", filename)
+
+            # Gmail特殊处理：确保主题编码正确
+            try:
+                # 先尝试ASCII编码
+                subject.encode('ascii')
+                msg['Subject'] = subject
+            except UnicodeEncodeError:
+                # 如果包含非ASCII字符，使用base64编码
+                from email.header import Header
+                msg['Subject'] = Header(subject, 'utf-8', header_name='Subject').encode()
+
+            # 添加Gmail友好的邮件头
+            import email.utils
+            msg['Date'] = email.utils.formatdate(localtime=True)
+            msg['Message-ID'] = email.utils.make_msgid()
+            msg['X-Mailer'] = 'PDF-Watermark-Tool'
+            msg['X-Priority'] = '3'
+            msg['MIME-Version'] = '1.0'
+
+            # 替换邮件内容中的变量
+            body = self.email_body.replace("{company}", company_name).replace("{filename}", filename)
+
+            # 创建文本部分，使用quoted-printable编码以提高Gmail兼容性
+            from email.mime.text import MIMEText
+            text_part = MIMEText(body, 'plain', 'utf-8')
+            text_part.set_charset('utf-8')
+            msg.attach(text_part)
+
+            # 添加PDF附件，特殊处理确保Gmail能正确识别
+            for file_path, attachment_name in attachments:
+                with open(file_path, 'rb') as f:
+                    pdf_data = f.read()
+                    attachment = MIMEApplication(pdf_data, _subtype='pdf', name=f"{attachment_name}.pdf")
+                    attachment.add_header('Content-Disposition', 'attachment', filename=f"{attachment_name}.pdf")
+                    attachment.add_header('Content-Type', 'application/pdf', name=f"{attachment_name}.pdf")
+                    attachment.add_header('Content-Transfer-Encoding', 'base64')
+                    msg.attach(attachment)
+
+            # 发送邮件，使用更兼容的方法
+            from_addr = self.smtp_username
+            to_addr = [email_address]
+
+            # 将邮件转换为字符串，确保编码正确
+            msg_bytes = msg.as_string().encode('utf-8')
+
+            # 复用SMTP会话；服务器已断开空闲会话时重新连接一次，其他错误后丢弃会话，下一封邮件重新连接
+            try:
+                try:
+                    self._connection().sendmail(from_addr, to_addr, msg_bytes)
+                except smtplib.SMTPServerDisconnected:
+                    self._server = None
+                    self._connection().sendmail(from_addr, to_addr, msg_bytes)
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+                raise
+            except Exception:
+                self.close()
+                raise
+
+            return True
+
+        except Exception as e:
+            raise Exception(f"发送邮件失败: {str(e)}")
+
+    def send_to_company(self, company_name, emails, attachments, log=print, on_sent=None, stage_timer=None):
+        """把输出文件 [(文件路径, 文件名)] 发送到该公司的所有邮箱，返回 (成功数, 失败数)；
+        每发送成功一封调用 on_sent(邮箱)，指定 stage_timer 时记录每封邮件的发送耗时"""
+        stage_timer = stage_timer or StageTimer()
+        sent_count = 0
+        failed_count = 0
+        if not emails:
+            log(f"跳过邮件发送: {company_name} (无邮箱地址)")
+        for email in emails:
+            try:
+                with stage_timer.measure("发送邮件"):
+                    self.send(company_name, email, attachments)
+                log(f"邮件已发送: {company_name} -> {email}")
+                sent_count += 1
+                if on_sent is not None:
+                    on_sent(email)
+            except Exception as e:
+                log(f"发送邮件给 {company_name} ({email}) 失败: {str(e)}")
+                failed_count += 1
+        return sent_count, failed_count
+
+
+class BatchRunner:
+    """批量任务调度，不依赖Tk界面：单进程时依次处理，多进程时分配到进程池
+
+    日志通过 log 回调输出，每个任务开始时调用 on_job_start(公司名称, 序号, 总数)。
+    """
+
+    def __init__(self, engine, temp_dir, log=None, on_job_start=None):
+        self.engine = engine
+        self.temp_dir = temp_dir
+        self.log = log or print
+        self.on_job_start = on_job_start or (lambda company_name, index, total: None)
+
+    def run_jobs(self, jobs, options, worker_count=1, disk_cache=None, report=None):
+        """处理所有任务（可来自多个源PDF），按完成顺序逐个返回 (任务, 异常)
+
+        disk_cache 为 RasterDiskCache 时，图片化模式的页面渲染结果跨运行保留。
+        report 为 BatchReport 时，每个任务的各阶段计时（多进程时由子进程返回）合并到其中。
+        """
+        # 矢量模式的子集字体覆盖前缀、后缀和所有公司名称中的字符，整个批次（所有源PDF）只子集化一次
+        options = dict(options, font_charset="".join(sorted(set("".join(job[1] for job in jobs)))))
+        if worker_count > 1 and len(jobs) > 1:
+            return self._run_in_process_pool(jobs, options, min(worker_count, len(jobs)), disk_cache, report)
+        return self._run_sequentially(jobs, options, disk_cache, report)
+
+    def run_batch(self, jobs, options, manifest, worker_count=1, disk_cache=None,
+                  email_sender=None, company_email_map=None, combine_emails=False):
+        """处理整个批次：跳过清单中未变化的输出，生成其余输出，登记到清单并发送邮件
+
+        生成、登记和邮件发送是由有界队列连接的流水线阶段，发送邮件时后续公司的生成继续进行。
+        combine_emails 为True时，一个公司的所有文档都处理完后作为附件合并到一封邮件中发送。
+        按完成顺序逐个返回 (任务, 异常, 是否跳过, 邮件成功数, 邮件失败数)；
+        结束后的流水线统计保存在 last_pipeline 中，计时与吞吐量报告保存在 last_report 中
+        并写入输出目录的 batch_report.json/csv。
+        """
+        self.last_report = report = BatchReport("raster" if options["rasterize"] else "vector", worker_count)
+        pending_jobs, up_to_date_jobs = manifest.partition(jobs)
+        if up_to_date_jobs:
+            self.log(f"跳过 {len(up_to_date_jobs)} 个未变化的输出，需要生成 {len(pending_jobs)} 个")
+
+        def iter_results():
+            """先返回已是最新的任务，再返回新生成的结果；提前停止时关闭 run_jobs 生成器，及时清理缓存和进程池"""
+            for job in up_to_date_jobs:
+                yield job, None, True
+            job_results = self.run_jobs(pending_jobs, options, worker_count, disk_cache, report)
+            try:
+                for job, error in job_results:
+                    yield job, error, False
+            finally:
+                job_results.close()
+
+        def record(result):
+            job, error, skipped = result
+            report.add_output(job, error, skipped)
+            if error is not None:
+                self.log(f"处理 {job[0]} 时出错: {str(error)}")
+            elif not skipped:
+                manifest.record_output(job)
+                self.log(f"已完成: {job[0]} -> {job[3]}.pdf")
+            return result
+
+        # 合并邮件时，每个公司等待的文档数和已完成的任务
+        remaining_jobs = Counter(job[0] for job in jobs)
+        finished_jobs = {}
+
+        def deliver(result):
+            job, error, skipped = result
+            company_name = job[0]
+            sent_count = failed_count = 0
+            if email_sender is None:
+                return job, error, skipped, sent_count, failed_count
+            if combine_emails:
+                remaining_jobs[company_name] -= 1
+                if error is None:
+                    finished_jobs.setdefault(company_name, []).append(job)
+                if remaining_jobs[company_name] > 0 or company_name not in finished_jobs:
+                    return job, error, skipped, sent_count, failed_count
+                company_jobs = finished_jobs.pop(company_name)
+            elif error is None:
+                company_jobs = [job]
+            else:
+                return job, error, skipped, sent_count, failed_count
+            email_timer = StageTimer()
+            sent_count, failed_count = send_job_emails(email_sender, manifest, company_jobs,
+                                                       (company_email_map or {}).get(company_name, []), log=self.log,
+                                                       stage_timer=email_timer)
+            report.merge(company_name, email_timer.samples)
+            report.add_emails(company_name, sent_count, failed_count)
+            return job, error, skipped, sent_count, failed_count
+
+        self.last_pipeline = StagedPipeline("生成", iter_results(), [
+            ("登记", record, 1),
+            ("邮件" if email_sender is not None else "汇总", deliver, 1),
+        ])
+        yield from self.last_pipeline
+        self.log(f"批处理流水线: {self.last_pipeline.summary()}")
+
+        report.finish(self.last_pipeline)
+        try:
+            json_path, csv_path = report.write(manifest.output_dir)
+            self.log(f"计时报告已保存: {os.path.basename(json_path)}, {os.path.basename(csv_path)}")
+        except OSError as e:
+            self.log(f"保存计时报告失败: {str(e)}")
+
+    def _run_sequentially(self, jobs, options, disk_cache=None, report=None):
+        """在当前线程中依次处理每个任务，逐个返回 (任务, 异常)"""
+        # 图片化模式下，所有公司共用同一份页面栅格缓存；矢量模式下共用同一份解析后的源PDF（按源PDF分别缓存）
+        page_cache = None
+        source_cache = None
+        if options["rasterize"]:
+            page_cache = PageRasterCache(os.path.join(self.temp_dir, "raster_cache"), disk_cache=disk_cache)
+        else:
+            source_cache = SourcePdfCache()
+
+        try:
+            for i, job in enumerate(jobs):
+                company_name, watermark_text, output_path, output_filename, pdf_path = job
+                self.on_job_start(company_name, i + 1, len(jobs))
+                stage_timer = StageTimer()
+                try:
+                    with stage_timer.measure("生成PDF"):
+                        self.engine.apply_watermark_to_pdf(pdf_path, output_path, watermark_text,
+                                                           page_cache=page_cache, source_cache=source_cache,
+                                                           stage_timer=stage_timer, **options)
+                except Exception as e:
+                    error = e
+                else:
+                    error = None
+                if report is not None:
+                    report.merge(company_name, stage_timer.samples, pages=stage_timer.pages)
+                yield job, error
+        finally:
+            if page_cache is not None:
+                self.log(f"页面缓存: 渲染 {page_cache.rendered_pages} 页，复用 {page_cache.hit_pages} 页，"
+                         f"从磁盘缓存载入 {page_cache.disk_pages} 页，溢出到磁盘 {page_cache.spilled_pages} 页")
+                page_cache.clear()
+            if source_cache is not None:
+                self.log(f"源PDF缓存: 解析 {source_cache.parsed_documents} 次，复用 {source_cache.hit_documents} 次")
+                source_cache.clear()
+
+    def _run_in_process_pool(self, jobs, options, worker_count, disk_cache=None, report=None):
+        """将任务分配到多个子进程并行处理，按完成顺序返回 (任务, 异常)
+
+        每个子进程有独立的临时目录和页面缓存，日志与进度事件经队列转发回主进程。
+        """
+        self.log(f"使用 {worker_count} 个进程并行处理")
+        mp_context = multiprocessing.get_context("spawn")
+        events = mp_context.Queue()
+        disk_cache_config = (disk_cache.cache_dir, disk_cache.size_limit) if disk_cache is not None else None
+
+        with ProcessPoolExecutor(max_workers=worker_count, mp_context=mp_context,
+                                 initializer=_init_batch_worker,
+                                 initargs=(self.engine.system_fonts, self.temp_dir, events,
+                                           options["rasterize"], disk_cache_config)) as pool:
+            futures = {}
+            for index, job in enumerate(jobs):
+                company_name, watermark_text, output_path, output_filename, pdf_path = job
+                future = pool.submit(_run_batch_job, index, pdf_path, output_path, watermark_text, options)
+                futures[future] = job
+
+            pending = set(futures)
+            try:
+                while pending:
+                    done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                    self._forward_worker_events(events, jobs)
+                    for future in done:
+                        # 子进程异常退出等情况下没有计时结果，只有任务本身出错时才随结果返回异常
+                        error = future.exception()
+                        if error is None:
+                            samples, pages, worker_peak_rss, error = future.result()
+                            if report is not None:
+                                report.merge(futures[future][0], samples, worker_peak_rss, pages)
+                        yield futures[future], error
+            finally:
+                # 提前停止（取消或出错）时取消尚未开始的任务，退出 with 块只需等待正在处理的公司
+                for future in pending:
+                    future.cancel()
+
+        self._forward_worker_events(events, jobs)
+
+    def _forward_worker_events(self, events, jobs):
+        """将子进程的日志和进度事件转发到 log 和 on_job_start"""
+        while True:
+            try:
+                kind, payload = events.get_nowait()
+            except queue.Empty:
+                return
+            if kind == "log":
+                self.log(payload)
+            elif kind == "start":
+                self.on_job_start(jobs[payload][0], payload + 1, len(jobs))
+
+
+class BatchManifest:
+    """批处理进度清单，保存在输出目录的 batch_manifest.json 中
+
+    每个输出文件记录 (源PDF内容, 水印设置, 水印文本) 的哈希、输出路径、文件大小和已发送的邮箱，
+    同一个清单可以包含来自多个源PDF的输出。
+    重新运行时哈希和文件大小都未变化的输出直接跳过，未发送的邮件继续发送。
+    清单按 MANIFEST_SAVE_INTERVAL 节流写入，退出 with 块时写入最终状态。
+    """
+
+    # 不影响输出内容的参数不计入哈希
+    IGNORED_OPTIONS = ("page_threads", "font_charset")
+
+    def __init__(self, output_dir, options):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self._options = {k: v for k, v in options.items() if k not in self.IGNORED_OPTIONS}
+        self._settings_digests = {}  # 源PDF路径 -> (源PDF内容, 水印设置) 的哈希
+        self._dirty = False
+        self._saved_at = time.time()
+        # 批处理流水线中登记输出和记录邮件在不同线程中进行
+        self._lock = threading.RLock()
+
+        self.outputs = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.outputs = json.load(f).get("outputs", {})
+            except (OSError, ValueError):
+                # 清单损坏时视为没有清单，全部重新生成
+                self.outputs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.save(force=True)
+
+    def _settings_digest(self, pdf_path):
+        digest = self._settings_digests.get(pdf_path)
+        if digest is None:
+            digest = self._settings_digests[pdf_path] = hashlib.sha256(json.dumps(
+                [file_digest(pdf_path), self._options], sort_keys=True, ensure_ascii=False
+            ).encode('utf-8')).hexdigest()
+        return digest
+
+    def job_key(self, job):
+        """任务的内容哈希：源PDF、水印设置和水印文本"""
+        company_name, watermark_text, output_path, output_filename, pdf_path = job
+        return hashlib.sha256(f"{self._settings_digest(pdf_path)}\0{watermark_text}".encode('utf-8')).hexdigest()
+
+    def is_up_to_date(self, job):
+        """输出文件是否已按相同的内容哈希生成且未被改动"""
+        company_name, watermark_text, output_path, output_filename, pdf_path = job
+        entry = self.outputs.get(output_filename)
+        if (entry is None or entry.get("key") != self.job_key(job)
+                or entry.get("output_path") != os.path.abspath(output_path)):
+            return False
+        try:
+            return os.path.getsize(output_path) == entry.get("size")
+        except OSError:
+            return False
+
+    def partition(self, jobs):
+        """返回 (需要生成的任务, 已是最新的任务)"""
+        pending, up_to_date = [], []
+        for job in jobs:
+            (up_to_date if self.is_up_to_date(job) else pending).append(job)
+        return pending, up_to_date
+
+    def record_output(self, job):
+        """记录新生成的输出；内容变化后之前发送的邮件不再计入"""
+        company_name, watermark_text, output_path, output_filename, pdf_path = job
+        key = self.job_key(job)
+        with self._lock:
+            entry = self.outputs.get(output_filename, {})
+            self.outputs[output_filename] = {
+                "company": company_name,
+                "key": key,
+                "output_path": os.path.abspath(output_path),
+                "size": os.path.getsize(output_path),
+                "emails_sent": entry.get("emails_sent", []) if entry.get("key") == key else [],
+            }
+            self._changed()
+
+    def unsent_emails(self, job, emails):
+        """返回尚未成功发送过当前输出的邮箱"""
+        with self._lock:
+            sent = set(self.outputs.get(job[3], {}).get("emails_sent", []))
+        return [email for email in emails if email not in sent]
+
+    def record_email(self, job, email):
+        """记录邮件已成功发送"""
+        with self._lock:
+            entry = self.outputs.get(job[3])
+            if entry is not None and email not in entry["emails_sent"]:
+                entry["emails_sent"].append(email)
+                self._changed()
+
+    def _changed(self):
+        self._dirty = True
+        if time.time() - self._saved_at >= MANIFEST_SAVE_INTERVAL:
+            self.save()
+
+    def save(self, force=False):
+        """写入清单（先写临时文件再替换，中途退出不会留下损坏的清单）"""
+        with self._lock:
+            if not self._dirty and not force:
+                return
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": 1, "outputs": self.outputs}, f, ensure_ascii=False, indent=1)
+            os.replace(temp_path, self.path)
+            self._dirty = False
+            self._saved_at = time.time()
+
+
+class BatchReport:
+    """批处理的计时与吞吐量报告
+
+    按公司汇总各任务的阶段计时样本（StageTimer）、输出数、页数、写入字节数和邮件发送数，
+    计算整个批次的页/秒、各阶段的 p50/p95 延迟和峰值内存（含子进程），写入输出目录的
+    batch_report.json（完整报告）和 batch_report.csv（每个公司一行，各阶段合计耗时）。
+    """
+
+    COUNTERS = ("outputs", "skipped", "failed", "pages", "bytes_written", "emails_sent", "emails_failed")
+
+    def __init__(self, mode, worker_count=1):
+        self.mode = mode
+        self.worker_count = worker_count
+        self.started_at = time.time()
+        self.elapsed = 0.0
+        self.samples = []  # (阶段, 秒, 公司)
+        self.companies = OrderedDict()  # 公司 -> 计数
+        self.peak_rss = None
+        self.worker_peak_rss = None
+        self.pipeline = None
+        self._lock = threading.Lock()
+
+    def _counts(self, company_name):
+        return self.companies.setdefault(company_name, dict.fromkeys(self.COUNTERS, 0))
+
+    def merge(self, company_name, samples, worker_peak_rss=None, pages=0):
+        """合并一个公司的计时样本 [(阶段, 秒)]；worker_peak_rss 为执行该任务的子进程的峰值内存，
+        pages 为生成流程已统计的写入页数（StageTimer.pages）"""
+        with self._lock:
+            self.samples.extend((stage, seconds, company_name) for stage, seconds in samples)
+            if pages:
+                self._counts(company_name)["pages"] += pages
+            if worker_peak_rss is not None:
+                self.worker_peak_rss = max(self.worker_peak_rss or 0, worker_peak_rss)
+
+    def add_output(self, job, error, skipped):
+        """记录任务结果，新生成的输出计入写入字节数（页数在 merge 时计入）"""
+        company_name, watermark_text, output_path, output_filename, pdf_path = job
+        with self._lock:
+            counts = self._counts(company_name)
+            if error is not None:
+                counts["failed"] += 1
+            elif skipped:
+                counts["skipped"] += 1
+            else:
+                counts["outputs"] += 1
+                counts["bytes_written"] += os.path.getsize(output_path)
+
+    def add_emails(self, company_name, sent_count, failed_count):
+        with self._lock:
+            counts = self._counts(company_name)
+            counts["emails_sent"] += sent_count
+            counts["emails_failed"] += failed_count
+
+    def finish(self, pipeline=None):
+        """批次结束：记录总耗时、本进程峰值内存和流水线统计"""
+        self.elapsed = time.time() - self.started_at
+        self.peak_rss = peak_rss_bytes()
+        self.pipeline = pipeline.stats() if pipeline is not None else None
+
+    def totals(self):
+        """整个批次的计数合计"""
+        return {key: sum(counts[key] for counts in self.companies.values()) for key in self.COUNTERS}
+
+    def stages(self):
+        """阶段名称 -> 耗时样本列表，按首次出现的顺序"""
+        stages = OrderedDict()
+        for stage, seconds, company_name in self.samples:
+            stages.setdefault(stage, []).append(seconds)
+        return stages
+
+    @staticmethod
+    def _latency(values):
+        p50, p95 = np.percentile(values, [50, 95])
+        return {
+            "count": len(values),
+            "total_seconds": round(sum(values), 3),
+            "mean_ms": round(sum(values) / len(values) * 1000, 2),
+            "p50_ms": round(p50 * 1000, 2),
+            "p95_ms": round(p95 * 1000, 2),
+            "max_ms": round(max(values) * 1000, 2),
+        }
+
+    def summary(self):
+        """完整报告（可直接序列化为JSON）"""
+        totals = self.totals()
+        stage_names = list(self.stages())
+        company_stages = {}
+        for stage, seconds, company_name in self.samples:
+            stage_seconds = company_stages.setdefault(company_name, dict.fromkeys(stage_names, 0.0))
+            stage_seconds[stage] += seconds
+
+        def megabytes(value):
+            return round(value / (1024 * 1024), 3) if value is not None else None
+
+        return {
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+            "seconds": round(self.elapsed, 3),
+            "mode": self.mode,
+            "workers": self.worker_count,
+            "companies_count": len(self.companies),
+            **totals,
+            "pages_per_sec": round(totals["pages"] / self.elapsed, 2) if self.elapsed > 0 else None,
+            "mb_written": megabytes(totals["bytes_written"]),
+            "peak_rss_mb": megabytes(self.peak_rss),
+            "worker_peak_rss_mb": megabytes(self.worker_peak_rss),
+            "stages": {stage: self._latency(values) for stage, values in self.stages().items()},
+            "companies": {
+                company_name: dict(counts, stage_seconds={stage: round(seconds, 3) for stage, seconds in
+                                                          company_stages.get(company_name, {}).items()})
+                for company_name, counts in self.companies.items()
+            },
+            "pipeline": self.pipeline,
+        }
+
+    def write(self, output_dir):
+        """写入 batch_report.json 和 batch_report.csv，返回 (JSON路径, CSV路径)"""
+        summary = self.summary()
+        json_path = os.path.join(output_dir, f"{REPORT_FILENAME}.json")
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=1)
+
+        # CSV带BOM，Excel可以直接打开
+        stage_names = list(summary["stages"])
+        csv_path = os.path.join(output_dir, f"{REPORT_FILENAME}.csv")
+        with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["company", *self.COUNTERS, *(f"{stage}_seconds" for stage in stage_names)])
+            for company_name, counts in summary["companies"].items():
+                writer.writerow([company_name, *(counts[key] for key in self.COUNTERS),
+                                 *(counts["stage_seconds"].get(stage, 0.0) for stage in stage_names)])
+        return json_path, csv_path
+
+
+def send_job_emails(email_sender, manifest, jobs, emails, log=print, stage_timer=None):
+    """把同一公司的一个或多个输出作为附件发送到尚未收到它们的邮箱，返回 (成功数, 失败数)
+
+    每个邮箱只附带它还没有收到过的输出，附件相同的邮箱一起发送。
+    """
+    company_name = jobs[0][0]
+    unsent_jobs = OrderedDict()  # 附带的任务 -> 邮箱列表
+    for email in emails:
+        email_jobs = tuple(job for job in jobs if manifest.unsent_emails(job, [email]))
+        if email_jobs:
+            unsent_jobs.setdefault(email_jobs, []).append(email)
+    if emails and not unsent_jobs:
+        log(f"跳过邮件发送: {company_name} (已发送)")
+        return 0, 0
+    if not emails:
+        return email_sender.send_to_company(company_name, [], [], log=log, stage_timer=stage_timer)
+
+    sent_count = failed_count = 0
+    for email_jobs, group_emails in unsent_jobs.items():
+        def record_sent(email, email_jobs=email_jobs):
+            for job in email_jobs:
+                manifest.record_email(job, email)
+
+        sent, failed = email_sender.send_to_company(company_name, group_emails,
+                                                    [(job[2], job[3]) for job in email_jobs],
+                                                    log=log, on_sent=record_sent, stage_timer=stage_timer)
+        sent_count += sent
+        failed_count += failed
+    return sent_count, failed_count
+
+
 class PDFWatermarkTool:
     def __init__(self, master):
         # 设置Poppler路径（在其他初始化之前）
@@ -195,6 +3225,7 @@ class PDFWatermarkTool:
 
         # 初始化变量
         self.pdf_path = None
+        self.pdf_paths = []  # 批处理的所有源PDF，预览使用第一个
         self.excel_path = None
         self.company_names = []
         self.company_emails = []  # 公司邮箱列表，支持一对多关系
@@ -213,6 +3244,7 @@ class PDFWatermarkTool:
         self.smtp_password = tk.StringVar()
         self.sender_name = tk.StringVar(value="系统管理员")
         self.enable_email = tk.BooleanVar(value=False)  # 是否启用邮件发送
+        self.combine_emails = tk.BooleanVar(value=False)  # 同一公司的多个文档合并为一封邮件
 
         # 初始化默认值
         self.text_color = "#FF0000"  # 默认红色
@@ -226,6 +3258,8 @@ class PDFWatermarkTool:
         self.conversion_quality = tk.IntVar()  # 将在load_default_settings中设置
         self.compression_level = tk.IntVar()  # 将在load_default_settings中设置
         self.enable_rasterize = tk.BooleanVar()  # 将在load_default_settings中设置
+        self.incremental_output = tk.BooleanVar()  # 将在load_default_settings中设置
+        self.persistent_raster_cache = tk.BooleanVar()  # 将在load_default_settings中设置
 
         # 新增高级效果参数
         self.effect_type = tk.StringVar()  # 将在load_default_settings中设置
@@ -234,6 +3268,8 @@ class PDFWatermarkTool:
         self.effect_intensity = tk.IntVar()  # 将在load_default_settings中设置
         self.pattern_density = tk.IntVar()  # 将在load_default_settings中设置
         self.filename_pattern = tk.StringVar()  # 将在load_default_settings中设置
+        self.worker_count = tk.IntVar()  # 将在load_default_settings中设置
+        self.page_threads = tk.IntVar()  # 将在load_default_settings中设置
 
         # 创建颜色按钮存储列表
         self.color_buttons = []
@@ -241,6 +3277,13 @@ class PDFWatermarkTool:
         # 获取系统中文字体 - 移到UI设置之前
         self.system_fonts = self.get_system_fonts()
 
+        # 水印处理引擎和批量任务调度
+        self.engine = WatermarkEngine(self.system_fonts, self.temp_dir, log=self.log)
+        self.batch_runner = BatchRunner(self.engine, self.temp_dir, log=self.log, on_job_start=self._show_job_status)
+
+        # 跨运行的页面栅格磁盘缓存（批处理和预览共用）
+        self.raster_disk_cache = RasterDiskCache()
+
         # 设置样式（使用现代化样式）
         self.setup_ui_styles()
 
@@ -270,137 +3313,12 @@ class PDFWatermarkTool:
         pass
 
     def setup_poppler_path(self):
-        """确保Poppler工具在应用程序路径中可用"""
-        # 获取应用程序运行路径
-        if getattr(sys, 'frozen', False):
-            # 如果是打包后的应用
-            application_path = os.path.dirname(sys.executable)
-
-            # 如果是Mac应用包
-            if platform.system() == 'Darwin':
-                # 检查各种可能的Mac应用包结构
-                if os.path.isdir(os.path.join(application_path, '../Resources')):
-                    application_path = os.path.join(application_path, '../Resources')
-                elif os.path.isdir(os.path.join(application_path, 'Contents/Resources')):
-                    application_path = os.path.join(application_path, 'Contents/Resources')
-                elif os.path.isdir(os.path.join(application_path, 'Contents/MacOS')):
-                    application_path = os.path.join(application_path, 'Contents/MacOS')
-        else:
-            # 如果是直接运行Python脚本
-            application_path = os.path.dirname(os.path.abspath(__file__))
-
-        # 将应用程序路径添加到系统PATH中，使pdf2image能找到poppler二进制文件
-        os.environ['PATH'] = application_path + os.pathsep + os.environ.get('PATH', '')
-
-        # 打印调试信息
-        print(f"设置Poppler路径: {application_path}")
-        print(f"系统PATH: {os.environ['PATH']}")
-
-        # 检查是否有从PyInstaller打包时添加的Poppler二进制文件
-        poppler_files = glob.glob(os.path.join(application_path, "pdftoppm*"))
-        if poppler_files:
-            print(f"找到Poppler文件: {poppler_files}")
-        else:
-            print("未在应用程序目录中找到Poppler文件，将使用系统Poppler")
-
-    def get_system_fonts(self):
-        """获取系统安装的字体"""
-        system_fonts = {}
-
-        # Windows系统字体路径
-        if platform.system() == 'Windows':
-            font_dir = 'C:\\Windows\\Fonts'
-            system_fonts = {
-                "宋体": "C:\\Windows\\Fonts\\simsun.ttc",
-                "黑体": "C:\\Windows\\Fonts\\simhei.ttf",
-                "微软雅黑": "C:\\Windows\\Fonts\\msyh.ttc",
-                "微软雅黑粗体": "C:\\Windows\\Fonts\\msyhbd.ttc",  # 添加粗体版本
-                "Arial": "C:\\Windows\\Fonts\\arial.ttf",
-                "Times New Roman": "C:\\Windows\\Fonts\\times.ttf",
-                "Arial Black": "C:\\Windows\\Fonts\\ariblk.ttf",  # 添加非常宽的字体
-                "Impact": "C:\\Windows\\Fonts\\impact.ttf"  # 添加非常宽的字体
-            }
-
-        # MacOS系统字体路径
-        elif platform.system() == 'Darwin':  # macOS
-            font_dirs = [
-                '/System/Library/Fonts',
-                '/Library/Fonts',
-                os.path.expanduser('~/Library/Fonts'),
-                '/System/Library/Fonts/Supplemental'  # 添加补充字体
-            ]
-
-            # 增强的 macOS 中文字体映射
-            potential_fonts = {
-                "宋体": ["STSong", "Songti", "SimSun", "Songti.ttc", "宋体", "STSongti-SC"],
-                "黑体": ["STHeiti", "Heiti", "SimHei", "Heiti.ttc", "黑体", "STHeiti-Medium"],
-                "微软雅黑": ["Microsoft YaHei", "MicrosoftYaHei", "微软雅黑", "PingFang", "PingFangSC"],
-                "微软雅黑粗体": ["Microsoft YaHei Bold", "PingFang SC Bold", "PingFang-SC-Bold"],
-                "Arial": ["Arial", "Arial.ttf", "ArialMT"],
-                "Times New Roman": ["Times New Roman", "Times", "TimesNewRoman"],
-                "Arial Black": ["Arial Black", "Arial-Black"],
-                "Impact": ["Impact", "Impact.ttf"]
-            }
-
-            # 查找字体文件
-            for font_name, patterns in potential_fonts.items():
-                for font_dir in font_dirs:
-                    for pattern in patterns:
-                        matches = glob.glob(f"{font_dir}/**/*{pattern}*", recursive=True)
-                        if matches:
-                            system_fonts[font_name] = matches[0]
-                            break
-                    if font_name in system_fonts:
-                        break
-
-            # 确保我们至少有一些基本字体
-            if "黑体" not in system_fonts:
-                # 尝试查找任何中文字体作为备用
-                for font_dir in font_dirs:
-                    cn_fonts = glob.glob(f"{font_dir}/**/华文*.ttf", recursive=True)
-                    cn_fonts += glob.glob(f"{font_dir}/**/STSong*.ttf", recursive=True)
-                    cn_fonts += glob.glob(f"{font_dir}/**/Songti*.ttc", recursive=True)
-                    cn_fonts += glob.glob(f"{font_dir}/**/Heiti*.ttc", recursive=True)
-                    if cn_fonts:
-                        system_fonts["黑体"] = cn_fonts[0]
-                        break
-
-        # Linux系统字体路径
-        elif platform.system() == 'Linux':
-            font_dirs = [
-                '/usr/share/fonts/',
-                '/usr/local/share/fonts/',
-                os.path.expanduser('~/.fonts/')
-            ]
-
-            # 常见中文字体映射
-            potential_fonts = {
-                "宋体": ["SimSun", "simsun", "song"],
-                "黑体": ["SimHei", "simhei"],
-                "微软雅黑": ["Microsoft YaHei", "msyh"],
-                "微软雅黑粗体": ["Microsoft YaHei Bold", "msyhbd"],
-                "Arial": ["Arial", "arial"],
-                "Times New Roman": ["Times New Roman", "times"],
-                "Arial Black": ["Arial Black", "ariblk"],
-                "Impact": ["Impact"]
-            }
-
-            # 查找字体文件
-            for font_name, patterns in potential_fonts.items():
-                for font_dir in font_dirs:
-                    for pattern in patterns:
-                        matches = glob.glob(f"{font_dir}/**/*{pattern}*", recursive=True)
-                        if matches:
-                            system_fonts[font_name] = matches[0]
-                            break
-                    if font_name in system_fonts:
-                        break
-
-        # 记录字体查找结果
-        for font_name, path in system_fonts.items():
-            print(f"找到字体: {font_name} -> {path}")
+        """确保Poppler工具在应用程序路径中可用"""
+        setup_poppler_path()
 
-        return system_fonts
+    def get_system_fonts(self):
+        """获取系统安装的字体"""
+        return find_system_fonts()
 
     def setup_ui(self):
         # 创建现代化选项卡容器
@@ -827,6 +3745,34 @@ class PDFWatermarkTool:
             ttk.Radiobutton(compression_frame, text=text, variable=self.compression_level, value=value).pack(
                 side=tk.LEFT, padx=8)
 
+        # 多进程并行处理
+        ttk.Label(output_group, text="并行进程数:").grid(row=4, column=0, sticky="w", pady=8)
+        worker_frame = self.create_modern_frame(output_group)
+        worker_frame.grid(row=4, column=1, sticky="w", pady=8)
+        ttk.Spinbox(worker_frame, from_=1, to=os.cpu_count() or 1, textvariable=self.worker_count,
+                    width=5).pack(side=tk.LEFT)
+        ttk.Label(worker_frame, text="(1 = 单进程顺序处理)").pack(side=tk.LEFT, padx=8)
+
+        # 单个文档内按页多线程处理（图片化模式）
+        ttk.Label(output_group, text="页面并行线程数:").grid(row=5, column=0, sticky="w", pady=8)
+        page_thread_frame = self.create_modern_frame(output_group)
+        page_thread_frame.grid(row=5, column=1, sticky="w", pady=8)
+        ttk.Spinbox(page_thread_frame, from_=1, to=os.cpu_count() or 1, textvariable=self.page_threads,
+                    width=5).pack(side=tk.LEFT)
+        ttk.Label(page_thread_frame, text="(图片化模式下同一文档的页面并行加水印)").pack(side=tk.LEFT, padx=8)
+
+        # 矢量模式增量更新输出
+        ttk.Label(output_group, text="矢量输出方式:").grid(row=6, column=0, sticky="w", pady=8)
+        ttk.Checkbutton(output_group, text="增量更新(保留原文件内容，仅追加水印，适合大文件)",
+                        variable=self.incremental_output).grid(row=6, column=1, sticky="w", pady=8)
+
+        # 跨运行的页面栅格磁盘缓存
+        ttk.Label(output_group, text="页面缓存:").grid(row=7, column=0, sticky="w", pady=8)
+        ttk.Checkbutton(output_group, text="跨运行保留图片化页面(同一PDF再次处理或预览时不重新渲染)",
+                        variable=self.persistent_raster_cache).grid(row=7, column=1, sticky="w", pady=8)
+        ttk.Button(output_group, text="缓存统计", command=self.show_raster_cache_stats).grid(row=7, column=2,
+                                                                                          sticky="w", pady=8)
+
         # 邮件发送设置显示
         email_display_frame = ttk.LabelFrame(frame, text="邮件发送状态", padding="15")
         email_display_frame.pack(fill=tk.X, pady=(0, 10))
@@ -885,6 +3831,8 @@ class PDFWatermarkTool:
 
         ttk.Checkbutton(enable_frame, text="启用邮件发送功能", variable=self.enable_email,
                         command=self.update_email_status).pack(anchor="w")
+        ttk.Checkbutton(enable_frame, text="选择多个PDF时，同一公司的所有文档合并为一封邮件",
+                        variable=self.combine_emails).pack(anchor="w")
 
         # SMTP服务器设置 - 现代化分组
         smtp_frame = ttk.LabelFrame(frame, text="SMTP服务器设置", padding="15")
@@ -1008,10 +3956,17 @@ Gmail邮箱优化：
             self._preview_timer = self.master.after(100, lambda: self.preview_canvas.configure(scrollregion=self.preview_canvas.bbox("all")))
 
     def load_pdf(self):
-        file_path = filedialog.askopenfilename(filetypes=[("PDF files", "*.pdf")])
-        if file_path:
+        # 可以同时选择多个PDF，批处理时为每个公司分别生成每个文档；预览显示第一个
+        file_paths = filedialog.askopenfilenames(filetypes=[("PDF files", "*.pdf")])
+        if file_paths:
+            file_path = file_paths[0]
+            self.pdf_paths = list(file_paths)
             self.pdf_path = file_path
-            self.pdf_path_label.config(text=os.path.basename(file_path))
+            if len(file_paths) > 1:
+                self.pdf_path_label.config(text=f"{os.path.basename(file_path)} 等 {len(file_paths)} 个文件")
+                self.log(f"已选择 {len(file_paths)} 个PDF: {', '.join(os.path.basename(path) for path in file_paths)}")
+            else:
+                self.pdf_path_label.config(text=os.path.basename(file_path))
 
             # 读取PDF页数
             try:
@@ -1142,19 +4097,10 @@ Gmail邮箱优化：
                     company_name = self.company_names[i]
 
                     # 解析分号分隔的邮箱地址，支持中文全角和英文半角分号
-                    email_list = []
-                    if pd.notna(email_cell):
-                        # 先将中文全角分号替换为英文半角分号，然后统一分割
-                        email_cell_normalized = str(email_cell).replace('；', ';')
-                        emails = email_cell_normalized.split(';')
-                        for email in emails:
-                            email_str = email.strip()
-                            if email_str and self.is_valid_email(email_str):
-                                email_list.append(email_str)
-                                all_valid_emails.append(email_str)
-                                total_email_count += 1
-                            elif email_str:
-                                invalid_emails.append(email_str)
+                    email_list, invalid = parse_email_cell(email_cell)
+                    all_valid_emails.extend(email_list)
+                    total_email_count += len(email_list)
+                    invalid_emails.extend(invalid)
 
                     # 建立公司名称到邮箱列表的映射
                     self.company_email_map[company_name] = email_list
@@ -1186,39 +4132,7 @@ Gmail邮箱优化：
 
     def is_valid_email(self, email):
         """验证邮箱地址格式 - 增强版RFC 5322合规检查"""
-        if not email or not isinstance(email, str):
-            return False
-        
-        email = email.strip()
-        
-        # 基本长度检查
-        if len(email) > 254:  # RFC 5322规定最大长度
-            return False
-        
-        # 更严格的正则表达式，符合RFC 5322标准
-        import re
-        pattern = r'^[a-zA-Z0-9!#$%&\'*+/=?^_`{|}~-]+(?:\.[a-zA-Z0-9!#$%&\'*+/=?^_`{|}~-]+)*@(?:[a-zA-Z0-9](?:[a-zA-Z0-9-]*[a-zA-Z0-9])?\.)+[a-zA-Z0-9](?:[a-zA-Z0-9-]*[a-zA-Z0-9])?$'
-        
-        if not re.match(pattern, email):
-            return False
-        
-        # 额外检查：确保域名部分有效
-        local_part, domain_part = email.split('@', 1)
-        
-        # 检查本地部分长度
-        if len(local_part) > 64:  # RFC 5322规定本地部分最大长度
-            return False
-        
-        # 检查域名部分
-        if len(domain_part) > 253 or '.' not in domain_part:
-            return False
-        
-        # 检查域名各部分
-        domain_parts = domain_part.split('.')
-        if any(len(part) == 0 or len(part) > 63 for part in domain_parts):
-            return False
-        
-        return True
+        return is_valid_email(email)
 
     def update_email_status(self):
         """更新邮件状态显示"""
@@ -1241,101 +4155,14 @@ Gmail邮箱优化：
 
     def send_email(self, company_name, email_address, file_path, filename):
         """发送邮件，专门针对Gmail和其他邮箱优化"""
-        try:
-            # 创建邮件对象，使用mixed类型以确保Gmail兼容性
-            msg = MIMEMultipart('mixed')
-
-            # 设置基本邮件头 - 确保RFC 5322合规
-            sender_name = self.sender_name.get().strip()
-            sender_email = self.smtp_username.get().strip()
-            
-            # 验证邮箱地址格式
-            if not self.is_valid_email(sender_email):
-                raise Exception(f"发件人邮箱地址格式无效: {sender_email}")
-            
-            # 安全地设置From头部，处理特殊字符
-            try:
-                # 尝试直接设置（ASCII字符）
-                sender_name.encode('ascii')
-                # 如果是ASCII字符，可以直接使用
-                msg['From'] = f"{sender_name} <{sender_email}>"
-            except UnicodeEncodeError:
-                # 如果包含非ASCII字符，需要使用RFC 2047编码
-                from email.header import Header
-                encoded_name = Header(sender_name, 'utf-8').encode()
-                msg['From'] = f"{encoded_name} <{sender_email}>"
-            
-            msg['To'] = email_address
-
-            # 处理邮件主题，确保Gmail能正确显示
-            subject = self.email_subject.get().replace("{company}", company_name).replace("{filename}", filename)
-
-            # Gmail特殊处理：确保主题编码正确
-            try:
-                # 先尝试ASCII编码
-                subject.encode('ascii')
-                msg['Subject'] = subject
-            except UnicodeEncodeError:
-                # 如果包含非ASCII字符，使用base64编码
-                from email.header import Header
-                msg['Subject'] = Header(subject, 'utf-8', header_name='Subject').encode()
-
-            # 添加Gmail友好的邮件头
-            import email.utils
-            msg['Date'] = email.utils.formatdate(localtime=True)
-            msg['Message-ID'] = email.utils.make_msgid()
-            msg['X-Mailer'] = 'PDF-Watermark-Tool'
-            msg['X-Priority'] = '3'
-            msg['MIME-Version'] = '1.0'
-
-            # 替换邮件内容中的变量
-            body = self.email_body.get().replace("{company}", company_name).replace("{filename}", filename)
-
-            # 创建文本部分，使用quoted-printable编码以提高Gmail兼容性
-            from email.mime.text import MIMEText
-            text_part = MIMEText(body, 'plain', 'utf-8')
-            text_part.set_charset('utf-8')
-            msg.attach(text_part)
-
-            # 添加PDF附件，特殊处理确保Gmail能正确识别
-            with open(file_path, 'rb') as f:
-                pdf_data = f.read()
-                attachment = MIMEApplication(pdf_data, _subtype='pdf', name=f"{filename}.pdf")
-                attachment.add_header('Content-Disposition', 'attachment', filename=f"{filename}.pdf")
-                attachment.add_header('Content-Type', 'application/pdf', name=f"{filename}.pdf")
-                attachment.add_header('Content-Transfer-Encoding', 'base64')
-                msg.attach(attachment)
-
-            # 连接SMTP服务器
-            server = None
-            try:
-                if self.smtp_port.get() == 465:  # SSL
-                    server = smtplib.SMTP_SSL(self.smtp_server.get(), self.smtp_port.get())
-                else:  # TLS (587 for Gmail)
-                    server = smtplib.SMTP(self.smtp_server.get(), self.smtp_port.get())
-                    server.starttls()
-
-                # 登录
-                server.login(self.smtp_username.get(), self.smtp_password.get())
-
-                # 发送邮件，使用更兼容的方法
-                from_addr = self.smtp_username.get()
-                to_addr = [email_address]
-
-                # 将邮件转换为字符串，确保编码正确
-                msg_string = msg.as_string()
-
-                # 发送邮件
-                server.sendmail(from_addr, to_addr, msg_string.encode('utf-8'))
-
-            finally:
-                if server:
-                    server.quit()
+        with self._create_email_sender() as email_sender:
+            return email_sender.send(company_name, email_address, [(file_path, filename)])
 
-            return True
-
-        except Exception as e:
-            raise Exception(f"发送邮件失败: {str(e)}")
+    def _create_email_sender(self):
+        """按界面中的邮件设置创建发送器"""
+        return EmailSender(self.smtp_server.get(), self.smtp_port.get(), self.smtp_username.get(),
+                           self.smtp_password.get(), self.sender_name.get(), self.email_subject.get(),
+                           self.email_body.get())
 
     def test_email_settings(self):
         """测试邮件设置"""
@@ -1403,7 +4230,8 @@ Gmail邮箱优化：
             "sender_name": self.sender_name.get(),
             "email_subject": self.email_subject.get(),
             "email_body": self.email_body.get(),
-            "enable_email": self.enable_email.get()
+            "enable_email": self.enable_email.get(),
+            "combine_emails": self.combine_emails.get()
         }
 
         config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "email_config.json")
@@ -1434,6 +4262,7 @@ Gmail邮箱优化：
             self.email_body.set(settings.get("email_body",
                                              "尊敬的{company}，\n\n您的加水印文件已处理完成，请查收附件。\n\n如有任何问题，请及时联系我们。\n\n祝好！"))
             self.enable_email.set(settings.get("enable_email", False))
+            self.combine_emails.set(settings.get("combine_emails", False))
 
             # 更新Text widget内容
             if hasattr(self, 'body_text'):
@@ -1517,8 +4346,11 @@ Gmail邮箱优化：
             # 使用当前设置的质量设置进行预览 - 修复预览质量问题
             quality = int(self.conversion_quality.get())
 
-            # 将PDF页面转换为图像，使用与最终输出相同的质量设置
-            images = convert_from_path(self.pdf_path, first_page=page_num, last_page=page_num, dpi=quality)
+            # 将PDF页面转换为图像，使用与最终输出相同的质量设置（启用页面缓存时优先从磁盘缓存载入）
+            if self.persistent_raster_cache.get():
+                images = [self.raster_disk_cache.get_page(self.pdf_path, page_num, quality)]
+            else:
+                images = convert_from_path(self.pdf_path, first_page=page_num, last_page=page_num, dpi=quality)
             if images:
                 image = images[0]
                 self.show_preview(image)
@@ -1582,7 +4414,7 @@ Gmail邮箱优化：
         image = self.preview_image.copy()
 
         # 添加水印
-        watermarked_image = self.add_text_watermark_to_image(
+        watermarked_image = self.engine.add_text_watermark_to_image(
             image,
             watermark_text,
             opacity=int(self.opacity_scale.get()) / 100,
@@ -1606,9 +4438,9 @@ Gmail邮箱优化：
         self.preview_label.config(text=f"水印预览: {watermark_text}")
 
     # 保存默认设置
-    def save_default_settings(self):
-        """保存当前水印设置为默认设置"""
-        settings = {
+    def _collect_settings(self):
+        """以 watermark_config.json 的格式返回界面中的当前水印设置"""
+        return {
             "opacity": self.opacity_scale.get(),
             "angle": self.watermark_angle.get(),
             "font_size": self.font_size.get(),
@@ -1624,9 +4456,17 @@ Gmail邮箱优化：
             "conversion_quality": self.conversion_quality.get(),
             "compression_level": self.compression_level.get(),
             "filename_pattern": self.filename_pattern.get(),
-            "enable_rasterize": self.enable_rasterize.get()
+            "enable_rasterize": self.enable_rasterize.get(),
+            "incremental_output": self.incremental_output.get(),
+            "persistent_raster_cache": self.persistent_raster_cache.get(),
+            "worker_count": self.worker_count.get(),
+            "page_threads": self.page_threads.get()
         }
 
+    def save_default_settings(self):
+        """保存当前水印设置为默认设置"""
+        settings = self._collect_settings()
+
         # 保存到配置文件
         config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "watermark_config.json")
         try:
@@ -1666,6 +4506,10 @@ Gmail邮箱优化：
             self.compression_level.set(settings.get("compression_level", 2))
             self.filename_pattern.set(settings.get("filename_pattern", "文件名{company}"))
             self.enable_rasterize.set(settings.get("enable_rasterize", True))
+            self.incremental_output.set(settings.get("incremental_output", False))
+            self.persistent_raster_cache.set(settings.get("persistent_raster_cache", True))
+            self.worker_count.set(settings.get("worker_count", 1))
+            self.page_threads.set(settings.get("page_threads", 1))
 
             # 更新UI显示
             self.update_color_button(self.text_color)
@@ -1718,310 +4562,79 @@ Gmail邮箱优化：
         if not self.pattern_density.get():
             self.pattern_density.set(5)
 
-        # 确保水印密度选项正确选择
-        if not self.watermark_density.get():
-            self.watermark_density.set(7)
-
-        # 确保水印位置选项正确选择
-        if not self.watermark_position.get():
-            self.watermark_position.set("tile")
-
-        # 确保转换质量选项正确选择
-        if not self.conversion_quality.get():
-            self.conversion_quality.set(200)
-
-        # 确保图片化处理选项正确选择
-        if not self.enable_rasterize.get():
-            self.enable_rasterize.set(True)
-
-        # 确保压缩级别选项正确选择
-        if not self.compression_level.get():
-            self.compression_level.set(2)
-
-        # 确保文件命名规则正确设置
-        if not self.filename_pattern.get():
-            self.filename_pattern.set("文件名{company}")
-
-    # 获取与背景颜色对比度较高的文本颜色
-    def get_contrasting_text_color(self, hex_color):
-        # 将十六进制颜色转换为RGB分量
-        r = int(hex_color[1:3], 16)
-        g = int(hex_color[3:5], 16)
-        b = int(hex_color[5:7], 16)
-
-        # 计算颜色亮度 (基于ITU-R BT.709标准)
-        luminance = (0.2126 * r + 0.7152 * g + 0.0722 * b) / 255
-
-        # 根据亮度返回黑色或白色文本
-        return "#000000" if luminance > 0.5 else "#FFFFFF"
-
-    # 更新颜色按钮的外观
-    def update_color_button(self, color):
-        # 更新颜色指示器
-        self.color_indicator.config(bg=color)
-
-        # 更新选中状态
-        for btn, btn_color in self.color_buttons:
-            if btn_color == color:
-                btn.config(relief=tk.SUNKEN)
-            else:
-                btn.config(relief=tk.RAISED)
-
-    def update_intensity_value(self, event=None):
-        value = int(self.effect_intensity.get())
-        self.intensity_value.config(text=f"{value}%")
-
-    def add_text_watermark_to_image(self, image, text, opacity=0.5, angle=30, font_size=36,
-                                    font_family="宋体", color="#FF0000", density=1, position="center",
-                                    effect_type="outline", outline_width=2, shadow_offset=3,
-                                    effect_intensity=70, pattern_density=5):
-        # 确保所有参数为正确类型
-        float_opacity = float(opacity)
-        int_angle = int(angle)
-        int_font_size = int(font_size)
-        int_density = int(density)
-        int_outline_width = int(outline_width)
-        int_shadow_offset = int(shadow_offset)
-        int_effect_intensity = int(effect_intensity)
-        int_pattern_density = int(pattern_density)
-
-        # 转换为RGBA模式以支持透明度
-        if image.mode != 'RGBA':
-            image = image.convert('RGBA')
-
-        # 创建透明图层
-        watermark = Image.new('RGBA', image.size, (0, 0, 0, 0))
-        draw = ImageDraw.Draw(watermark)
-
-        # 解析颜色（支持十六进制）- 修复颜色问题
-        if color.startswith('#'):
-            r = int(color[1:3], 16)
-            g = int(color[3:5], 16)
-            b = int(color[5:7], 16)
-        else:
-            # 为常见颜色名称提供映射
-            color_map = {
-                "red": (255, 0, 0),
-                "green": (0, 255, 0),
-                "blue": (0, 0, 255),
-                "black": (0, 0, 0),
-                "white": (255, 255, 255),
-                "gray": (128, 128, 128)
-            }
-            r, g, b = color_map.get(color.lower(), (255, 0, 0))  # 默认红色
-
-        # 设置水印文字透明度（0-255）
-        alpha = int(float_opacity * 255)
-
-        # 尝试加载字体
-        font = None
-        try:
-            # 尝试从系统字体映射获取字体路径
-            font_path = None
-            if font_family in self.system_fonts:
-                font_path = self.system_fonts[font_family]
-
-            # 根据字体粗细调整字体路径
-            if font_path and os.path.exists(font_path):
-                font = ImageFont.truetype(font_path, int_font_size)
-                self.log(f"使用字体: {font_family} ({font_path})")
-            else:
-                # 尝试常见中文字体路径
-                if platform.system() == 'Darwin':  # macOS
-                    possible_fonts = [
-                        '/System/Library/Fonts/PingFang.ttc',
-                        '/Library/Fonts/Arial Unicode.ttf',
-                        '/System/Library/Fonts/STHeiti Medium.ttc',
-                        '/System/Library/Fonts/STHeiti Bold.ttc',
-                        '/System/Library/Fonts/Hiragino Sans GB.ttc'
-                    ]
-                    for path in possible_fonts:
-                        if os.path.exists(path):
-                            font = ImageFont.truetype(path, int_font_size)
-                            self.log(f"使用备用字体: {path}")
-                            break
-
-                # 如果找不到合适的字体，使用默认字体
-                if font is None:
-                    font = ImageFont.load_default()
-                    self.log("使用系统默认字体")
-                    int_font_size = 24  # 调整默认字体大小
-        except Exception as e:
-            self.log(f"加载字体时出错: {str(e)}")
-            font = ImageFont.load_default()
-            int_font_size = 24
-
-        # 获取文本尺寸
-        if font is not None:
-            if hasattr(draw, 'textsize'):
-                text_width, text_height = draw.textsize(text, font=font)
-            elif hasattr(font, 'getsize'):
-                text_width, text_height = font.getsize(text)
-            else:
-                text_width, text_height = int_font_size * len(text), int_font_size * 1.5
-        else:
-            text_width, text_height = int_font_size * len(text), int_font_size * 1.5
-
-        # 根据位置和密度设置水印
-        if position == "tile":
-            # 计算平铺的水印间距
-            x_spacing = max(text_width * 1.5, image.width // int_density)  # 确保足够的间距，防止拥挤
-            y_spacing = max(text_height * 1.5, image.height // int_density)
-
-            # 计算水印覆盖的行列数
-            cols = max(int_density, int(image.width / x_spacing) + 1)  # 确保至少有density个水印，并覆盖整个宽度
-            rows = max(int_density, int(image.height / y_spacing) + 1)  # 确保至少有density个水印，并覆盖整个高度
-
-            for i in range(cols):
-                for j in range(rows):
-                    # 计算水印位置，确保均匀分布
-                    x = i * image.width / cols
-                    y = j * image.height / rows
-
-                    # 创建旋转后的水印文字
-                    txt = Image.new('RGBA', (int(text_width + 60), int(text_height + 60)), (0, 0, 0, 0))
-                    d = ImageDraw.Draw(txt)
-
-                    # 根据效果类型应用不同的水印效果
-                    if effect_type == "outline":
-                        # 轮廓效果
-                        self._apply_outline_effect(d, text, font, r, g, b, alpha, int_outline_width,
-                                                   int_effect_intensity)
-                    elif effect_type == "shadow":
-                        # 阴影效果
-                        self._apply_shadow_effect(d, text, font, r, g, b, alpha, int_shadow_offset,
-                                                  int_effect_intensity)
-                    elif effect_type == "emboss":
-                        # 浮雕效果
-                        self._apply_emboss_effect(d, text, font, r, g, b, alpha, int_effect_intensity)
-                    elif effect_type == "texture":
-                        # 纹理效果
-                        self._apply_texture_effect(d, text, font, r, g, b, alpha, int_pattern_density,
-                                                   int_effect_intensity)
-                    else:
-                        # 默认效果
-                        d.text((30, 30), text, font=font, fill=(r, g, b, alpha))
-
-                    rotated = txt.rotate(int_angle, expand=True)
-
-                    # 将旋转后的水印粘贴到透明图层
-                    watermark.paste(rotated, (int(x), int(y)), rotated)
-        else:  # center
-            # 居中放置单个水印
-            x = (image.width - text_width) // 2
-            y = (image.height - text_height) // 2
-
-            # 创建旋转后的水印文字
-            txt = Image.new('RGBA', (int(text_width + 60), int(text_height + 60)), (0, 0, 0, 0))
-            d = ImageDraw.Draw(txt)
-
-            # 根据效果类型应用不同的水印效果
-            if effect_type == "outline":
-                # 轮廓效果
-                self._apply_outline_effect(d, text, font, r, g, b, alpha, int_outline_width, int_effect_intensity)
-            elif effect_type == "shadow":
-                # 阴影效果
-                self._apply_shadow_effect(d, text, font, r, g, b, alpha, int_shadow_offset, int_effect_intensity)
-            elif effect_type == "emboss":
-                # 浮雕效果
-                self._apply_emboss_effect(d, text, font, r, g, b, alpha, int_effect_intensity)
-            elif effect_type == "texture":
-                # 纹理效果
-                self._apply_texture_effect(d, text, font, r, g, b, alpha, int_pattern_density, int_effect_intensity)
-            else:
-                # 默认效果
-                d.text((30, 30), text, font=font, fill=(r, g, b, alpha))
-
-            rotated = txt.rotate(int_angle, expand=True)
-
-            # 将旋转后的水印粘贴到透明图层
-            watermark.paste(rotated, (int(x - rotated.width // 2), int(y - rotated.height // 2)), rotated)
-
-        # 将水印叠加到原图
-        return Image.alpha_composite(image, watermark)
-
-    def _apply_outline_effect(self, draw, text, font, r, g, b, alpha, outline_width, intensity):
-        """应用轮廓效果"""
-        # 计算轮廓颜色（稍深于主颜色）
-        outline_r = max(0, r - 50)
-        outline_g = max(0, g - 50)
-        outline_b = max(0, b - 50)
-
-        # 计算轮廓透明度（基于强度）
-        outline_alpha = int(alpha * (intensity / 100))
-
-        # 绘制多层轮廓
-        for i in range(outline_width, 0, -1):
-            # 绘制8个方向的轮廓
-            draw.text((30 + i, 30 + i), text, font=font, fill=(outline_r, outline_g, outline_b, outline_alpha))
-            draw.text((30 + i, 30 - i), text, font=font, fill=(outline_r, outline_g, outline_b, outline_alpha))
-            draw.text((30 - i, 30 + i), text, font=font, fill=(outline_r, outline_g, outline_b, outline_alpha))
-            draw.text((30 - i, 30 - i), text, font=font, fill=(outline_r, outline_g, outline_b, outline_alpha))
-            draw.text((30 + i, 30), text, font=font, fill=(outline_r, outline_g, outline_b, outline_alpha))
-            draw.text((30 - i, 30), text, font=font, fill=(outline_r, outline_g, outline_b, outline_alpha))
-            draw.text((30, 30 + i), text, font=font, fill=(outline_r, outline_g, outline_b, outline_alpha))
-            draw.text((30, 30 - i), text, font=font, fill=(outline_r, outline_g, outline_b, outline_alpha))
-
-        # 绘制主文字
-        draw.text((30, 30), text, font=font, fill=(r, g, b, alpha))
+        # 确保水印密度选项正确选择
+        if not self.watermark_density.get():
+            self.watermark_density.set(7)
 
-    def _apply_shadow_effect(self, draw, text, font, r, g, b, alpha, shadow_offset, intensity):
-        """应用阴影效果"""
-        # 计算阴影透明度（基于强度）
-        shadow_alpha = int(alpha * 0.5 * (intensity / 100))
+        # 确保水印位置选项正确选择
+        if not self.watermark_position.get():
+            self.watermark_position.set("tile")
 
-        # 绘制阴影
-        draw.text((30 + shadow_offset, 30 + shadow_offset), text, font=font, fill=(0, 0, 0, shadow_alpha))
+        # 确保转换质量选项正确选择
+        if not self.conversion_quality.get():
+            self.conversion_quality.set(200)
 
-        # 绘制主文字
-        draw.text((30, 30), text, font=font, fill=(r, g, b, alpha))
+        # 确保图片化处理选项正确选择
+        if not self.enable_rasterize.get():
+            self.enable_rasterize.set(True)
 
-    def _apply_emboss_effect(self, draw, text, font, r, g, b, alpha, intensity):
-        """应用浮雕效果"""
-        # 计算高光和阴影颜色
-        highlight_r = min(255, r + 100)
-        highlight_g = min(255, g + 100)
-        highlight_b = min(255, b + 100)
+        # 确保压缩级别选项正确选择
+        if not self.compression_level.get():
+            self.compression_level.set(2)
 
-        shadow_r = max(0, r - 100)
-        shadow_g = max(0, g - 100)
-        shadow_b = max(0, b - 100)
+        # 确保文件命名规则正确设置
+        if not self.filename_pattern.get():
+            self.filename_pattern.set("文件名{company}")
 
-        # 计算效果透明度（基于强度）
-        effect_alpha = int(alpha * (intensity / 100))
+        # 确保并行进程数正确设置
+        if not self.worker_count.get():
+            self.worker_count.set(1)
 
-        # 绘制高光（左上角）
-        draw.text((28, 28), text, font=font, fill=(highlight_r, highlight_g, highlight_b, effect_alpha))
+        # 确保页面并行线程数正确设置
+        if not self.page_threads.get():
+            self.page_threads.set(1)
 
-        # 绘制阴影（右下角）
-        draw.text((32, 32), text, font=font, fill=(shadow_r, shadow_g, shadow_b, effect_alpha))
+    # 获取与背景颜色对比度较高的文本颜色
+    def get_contrasting_text_color(self, hex_color):
+        # 将十六进制颜色转换为RGB分量
+        r = int(hex_color[1:3], 16)
+        g = int(hex_color[3:5], 16)
+        b = int(hex_color[5:7], 16)
 
-        # 绘制主文字（中间）
-        draw.text((30, 30), text, font=font, fill=(r, g, b, alpha))
+        # 计算颜色亮度 (基于ITU-R BT.709标准)
+        luminance = (0.2126 * r + 0.7152 * g + 0.0722 * b) / 255
 
-    def _apply_texture_effect(self, draw, text, font, r, g, b, alpha, pattern_density, intensity):
-        """应用纹理效果"""
-        # 创建临时图像用于纹理
-        temp_img = Image.new('RGBA', (200, 200), (0, 0, 0, 0))
-        temp_draw = ImageDraw.Draw(temp_img)
+        # 根据亮度返回黑色或白色文本
+        return "#000000" if luminance > 0.5 else "#FFFFFF"
 
-        # 绘制主文字
-        draw.text((30, 30), text, font=font, fill=(r, g, b, alpha))
+    # 更新颜色按钮的外观
+    def update_color_button(self, color):
+        # 更新颜色指示器
+        self.color_indicator.config(bg=color)
 
-        # 添加纹理点
-        point_alpha = int(alpha * 0.7 * (intensity / 100))
-        point_size = max(1, pattern_density // 3)
+        # 更新选中状态
+        for btn, btn_color in self.color_buttons:
+            if btn_color == color:
+                btn.config(relief=tk.SUNKEN)
+            else:
+                btn.config(relief=tk.RAISED)
 
-        # 在文字周围随机添加点
-        import random
-        for _ in range(pattern_density * 10):
-            x = random.randint(20, 180)
-            y = random.randint(20, 180)
-            temp_draw.ellipse([x, y, x + point_size, y + point_size], fill=(r, g, b, point_alpha))
+    def update_intensity_value(self, event=None):
+        value = int(self.effect_intensity.get())
+        self.intensity_value.config(text=f"{value}%")
 
-        # 将纹理图像应用到主文字
-        texture = temp_img.rotate(0, expand=True)
-        draw.bitmap((30, 30), texture, fill=(r, g, b, point_alpha))
+    def show_raster_cache_stats(self):
+        """显示页面磁盘缓存的统计信息，可选择清空缓存"""
+        stats = self.raster_disk_cache.stats()
+        message = (f"缓存目录: {stats['cache_dir']}\n"
+                   f"文档: {stats['documents']} 个，页面: {stats['pages']} 页\n"
+                   f"占用: {stats['bytes'] / (1024 * 1024):.1f} MB / 上限 {stats['size_limit'] / (1024 * 1024):.0f} MB\n"
+                   f"本次运行: 载入 {stats['hit_pages']} 页，写入 {stats['stored_pages']} 页，"
+                   f"淘汰 {stats['evicted_pages']} 页\n\n"
+                   f"是否清空缓存？")
+        if messagebox.askyesno("页面缓存统计", message):
+            self.raster_disk_cache.clear()
+            self.log("页面缓存已清空")
 
     def select_output_dir(self):
         directory = filedialog.askdirectory()
@@ -2126,97 +4739,45 @@ Gmail邮箱优化：
 
     def process_watermarks(self):
         try:
-            total_companies = len(self.company_names)
-            self.log(f"开始处理 {total_companies} 个公司的水印PDF...")
+            pdf_paths = self.pdf_paths or [self.pdf_path]
+            if len(pdf_paths) > 1:
+                self.log(f"开始处理 {len(self.company_names)} 个公司 × {len(pdf_paths)} 个文档的水印PDF...")
+            else:
+                self.log(f"开始处理 {len(self.company_names)} 个公司的水印PDF...")
 
             # 获取处理参数
-            opacity = int(self.opacity_scale.get()) / 100  # 转换为0-1范围的浮点数
-            angle = int(self.watermark_angle.get())
-            font_size = int(self.font_size.get())
-            font_family = self.font_family.get()
-            color = self.text_color
-            density = int(self.watermark_density.get())
-            position = self.watermark_position.get()
-            quality = int(self.conversion_quality.get())
-            enable_rasterize = self.enable_rasterize.get()
-            compression_level = int(self.compression_level.get())
-            effect_type = self.effect_type.get()
-            outline_width = int(self.outline_width.get())
-            shadow_offset = int(self.shadow_offset.get())
-            effect_intensity = int(self.effect_intensity.get())
-            pattern_density = int(self.pattern_density.get())
-
-            # 获取输出目录和文件命名规则
-            output_dir = self.output_dir.get()
-            filename_pattern = self.filename_pattern.get()
+            watermark_options = build_watermark_options(self._collect_settings())
 
             # 统计邮件发送结果
             email_sent_count = 0
             email_failed_count = 0
-
-            for i, company_name in enumerate(self.company_names):
-                # 更新进度
-                progress_value = int((i / total_companies) * 100)
-                self.master.after(0, lambda v=progress_value: self.progress.config(value=v))
-                self.master.after(0, lambda c=company_name, i=i + 1, t=total_companies:
-                self.status_bar.config(text=f"处理中: {c} ({i}/{t})"))
-
-                # 生成水印文本
-                watermark_text = f"{self.prefix_text.get()}{company_name}{self.suffix_text.get()}"
-
-                # 处理PDF
-                try:
-                    # 创建输出文件名
-                    # 获取上传文件的名称（不含扩展名）
-                    base_filename = os.path.splitext(os.path.basename(self.pdf_path))[0]
-                    # 替换命名规则中的占位符
-                    output_filename = filename_pattern.replace("文件名", base_filename).replace("{company}",
-                                                                                                company_name)
-                    # 处理文件名中的无效字符
-                    output_filename = re.sub(r'[\\/*?:"<>|]', "_", output_filename)
-                    output_path = os.path.join(output_dir, f"{output_filename}.pdf")
-
-                    # 添加水印
-                    self.apply_watermark_to_pdf(
-                        self.pdf_path,
-                        output_path,
-                        watermark_text,
-                        opacity=opacity,
-                        angle=angle,
-                        font_size=font_size,
-                        font_family=font_family,
-                        color=color,
-                        density=density,
-                        position=position,
-                        quality=quality,
-                        rasterize=enable_rasterize,
-                        compression_level=compression_level,
-                        effect_type=effect_type,
-                        outline_width=outline_width,
-                        shadow_offset=shadow_offset,
-                        effect_intensity=effect_intensity,
-                        pattern_density=pattern_density
-                    )
-
-                    self.log(f"已完成: {company_name} -> {output_filename}.pdf")
-
-                    # 如果启用邮件发送，发送邮件到该公司的所有邮箱
-                    if self.enable_email.get() and hasattr(self, 'company_email_map'):
-                        company_emails = self.company_email_map.get(company_name, [])
-                        if company_emails:
-                            for email in company_emails:
-                                try:
-                                    self.send_email(company_name, email, output_path, output_filename)
-                                    self.log(f"邮件已发送: {company_name} -> {email}")
-                                    email_sent_count += 1
-                                except Exception as e:
-                                    self.log(f"发送邮件给 {company_name} ({email}) 失败: {str(e)}")
-                                    email_failed_count += 1
-                        else:
-                            self.log(f"跳过邮件发送: {company_name} (无邮箱地址)")
-
-                except Exception as e:
-                    self.log(f"处理 {company_name} 时出错: {str(e)}")
+            email_sender = self._create_email_sender() if self.enable_email.get() else None
+
+            # 为每个公司和文档的组合生成水印文本和输出文件名
+            jobs = build_batch_jobs(pdf_paths, self.company_names, self.prefix_text.get(),
+                                    self.suffix_text.get(), self.filename_pattern.get(), self.output_dir.get())
+            total_companies = len(jobs)
+
+            worker_count = max(1, int(self.worker_count.get()))
+            disk_cache = self.raster_disk_cache if self.persistent_raster_cache.get() else None
+
+            # 输出目录中的进度清单记录已完成的输出和已发送的邮件，重新运行时跳过未变化的输出；
+            # 邮件在独立的流水线阶段中发送，不阻塞后续公司的处理
+            skipped_count = 0
+            company_email_map = getattr(self, 'company_email_map', None)
+            with BatchManifest(self.output_dir.get(), watermark_options) as manifest, \
+                    (email_sender or contextlib.nullcontext()):
+                results = self.batch_runner.run_batch(
+                    jobs, watermark_options, manifest, worker_count, disk_cache=disk_cache,
+                    email_sender=email_sender if company_email_map is not None else None,
+                    company_email_map=company_email_map, combine_emails=self.combine_emails.get()
+                )
+                for done_count, (job, error, skipped, sent_count, failed_count) in enumerate(results, start=1):
+                    self.master.after(0, lambda v=int(done_count / total_companies * 100):
+                                      self.progress.config(value=v))
+                    skipped_count += skipped
+                    email_sent_count += sent_count
+                    email_failed_count += failed_count
 
             # 处理完成
             self.master.after(0, lambda: self.progress.config(value=100))
@@ -2226,6 +4787,11 @@ Gmail邮箱优化：
 
             # 生成完成报告
             completion_msg = f"已完成所有 {total_companies} 个PDF的水印添加"
+            if skipped_count:
+                completion_msg += f"（其中 {skipped_count} 个未变化，已跳过）"
+            report = self.batch_runner.last_report.summary()
+            completion_msg += f"\n用时 {report['seconds']:.1f} 秒，{report['pages_per_sec'] or 0} 页/秒"
+            completion_msg += f"\n计时报告: {REPORT_FILENAME}.json / {REPORT_FILENAME}.csv"
             if self.enable_email.get():
                 completion_msg += f"\n邮件发送统计："
                 completion_msg += f"\n✓ 成功发送: {email_sent_count} 封"
@@ -2253,322 +4819,8 @@ Gmail邮箱优化：
             self.master.after(0, lambda: self.start_button.config(state='normal') if hasattr(self, 'start_button') else None)
             self.log(f"批量处理失败: {str(e)}")
 
-    def apply_watermark_to_pdf(self, input_path, output_path, text, opacity=0.5, angle=30,
-                               font_size=36, font_family="宋体", color="#FF0000",
-                               density=1, position="center", quality=100, rasterize=True,
-                               compression_level=0, effect_type="outline", outline_width=2,
-                               shadow_offset=3, effect_intensity=70, pattern_density=5):
-        if rasterize:
-            # 将PDF转换为图像，添加水印，然后转回PDF
-            self.rasterize_pdf_with_watermark(
-                input_path, output_path, text, opacity, angle, font_size,
-                font_family, color, density, position, quality, compression_level,
-                effect_type, outline_width, shadow_offset, effect_intensity, pattern_density
-            )
-        else:
-            # 直接添加水印到PDF（不图片化）
-            self.add_watermark_to_pdf(
-                input_path, output_path, text, opacity, angle, font_size,
-                font_family, color, density, position, compression_level,
-                effect_type, outline_width, shadow_offset, effect_intensity, pattern_density
-            )
-
-    def rasterize_pdf_with_watermark(self, input_path, output_path, text, opacity, angle,
-                                     font_size, font_family, color, density, position, quality,
-                                     compression_level=0, effect_type="outline", outline_width=2,
-                                     shadow_offset=3, effect_intensity=70, pattern_density=5):
-        # 创建临时目录
-        temp_img_dir = os.path.join(self.temp_dir, "temp_images")
-        if not os.path.exists(temp_img_dir):
-            os.makedirs(temp_img_dir, exist_ok=True)
-
-        try:
-            # 确保关键参数为正确类型
-            int_quality = int(quality)  # 保证是整数
-            float_opacity = float(opacity)  # 保证是浮点数
-            int_angle = int(angle)  # 保证是整数
-            int_font_size = int(font_size)  # 保证是整数
-            int_density = int(density)  # 保证是整数
-            int_compression = int(compression_level)  # 保证是整数
-            int_outline_width = int(outline_width)  # 保证是整数
-            int_shadow_offset = int(shadow_offset)  # 保证是整数
-            int_effect_intensity = int(effect_intensity)  # 保证是整数
-            int_pattern_density = int(pattern_density)  # 保证是整数
-
-            # 将PDF转换为图像
-            images = convert_from_path(input_path, dpi=int_quality)
-
-            # 添加水印到每个图像
-            watermarked_images = []
-
-            # 为每个图像单独创建临时PDF文件
-            pdf_files = []
-
-            for i, img in enumerate(images):
-                # 添加水印
-                watermarked = self.add_text_watermark_to_image(
-                    img, text, float_opacity, int_angle, int_font_size, font_family,
-                    color, int_density, position, effect_type, int_outline_width,
-                    int_shadow_offset, int_effect_intensity, int_pattern_density
-                )
-
-                # 根据压缩级别设置JPEG质量
-                jpg_quality = self.get_jpg_quality_from_compression_level(int_compression)
-
-                # 将水印图像保存为临时JPG文件
-                temp_jpg = os.path.join(temp_img_dir, f"page_{i}.jpg")
-                watermarked = watermarked.convert('RGB')  # 转换为RGB模式
-                watermarked.save(temp_jpg, "JPEG", quality=jpg_quality)
-
-                # 从JPG创建单页PDF
-                temp_pdf = os.path.join(temp_img_dir, f"page_{i}.pdf")
-                c = canvas.Canvas(temp_pdf, pagesize=(watermarked.width, watermarked.height))
-                c.drawImage(temp_jpg, 0, 0, watermarked.width, watermarked.height)
-                c.save()
-
-                pdf_files.append(temp_pdf)
-
-            # 合并所有PDF页面
-            merger = PdfMerger()
-            for pdf_file in pdf_files:
-                merger.append(pdf_file)
-
-            # 保存最终PDF
-            merger.write(output_path)
-            merger.close()
-
-        except Exception as e:
-            self.log(f"图片化PDF处理出错: {str(e)}")
-            raise e
-        finally:
-            # 清理临时文件
-            try:
-                shutil.rmtree(temp_img_dir)
-            except Exception as e:
-                self.log(f"清理临时文件出错: {str(e)}")
-
-    def add_watermark_to_pdf(self, input_path, output_path, text, opacity, angle,
-                             font_size, font_family, color, density, position, compression_level=0,
-                             effect_type="outline", outline_width=2, shadow_offset=3,
-                             effect_intensity=70, pattern_density=5):
-        try:
-            # 确保参数类型正确
-            float_opacity = float(opacity)  # 保证是浮点数
-            int_angle = int(angle)  # 保证是整数
-            int_font_size = int(font_size)  # 保证是整数
-            int_density = int(density)  # 保证是整数
-            int_compression = int(compression_level)  # 保证是整数
-            int_outline_width = int(outline_width)  # 保证是整数
-            int_shadow_offset = int(shadow_offset)  # 保证是整数
-            int_effect_intensity = int(effect_intensity)  # 保证是整数
-            int_pattern_density = int(pattern_density)  # 保证是整数
-
-            # 读取输入PDF
-            input_pdf = PdfReader(open(input_path, 'rb'))
-            output_pdf = PdfWriter()
-
-            # 查找报告中可用的中文字体
-            reportlab_font = "Helvetica-Bold"  # 默认使用粗体字体
-            if font_family in self.system_fonts:
-                font_path = self.system_fonts[font_family]
-                self.log(f"使用字体: {font_family} ({font_path})")
-                # 对于ReportLab，需要使用字体的基本名称，而不是完整路径
-                if font_family == "宋体":
-                    reportlab_font = "SimSun-Bold"
-                elif font_family == "黑体":
-                    reportlab_font = "SimHei-Bold"
-                elif font_family == "微软雅黑":
-                    reportlab_font = "MicrosoftYaHei-Bold"
-                elif font_family == "微软雅黑粗体":
-                    reportlab_font = "MicrosoftYaHei-Bold"
-                elif font_family == "Arial Black":
-                    reportlab_font = "Arial-Black"
-                elif font_family == "Impact":
-                    reportlab_font = "Impact"
-                else:
-                    reportlab_font = font_family + "-Bold"
-
-            # 解析颜色 - 修复颜色问题
-            if color.startswith('#'):
-                r = int(color[1:3], 16) / 255.0
-                g = int(color[3:5], 16) / 255.0
-                b = int(color[5:7], 16) / 255.0
-                # 添加日志，确认颜色值
-                self.log(f"水印颜色: RGB({r:.2f}, {g:.2f}, {b:.2f}) 来自 {color}")
-            else:
-                # 为常见颜色名称提供映射
-                color_map = {
-                    "red": (1, 0, 0),
-                    "green": (0, 1, 0),
-                    "blue": (0, 0, 1),
-                    "black": (0, 0, 0),
-                    "white": (1, 1, 1),
-                    "gray": (0.5, 0.5, 0.5)
-                }
-                r, g, b = color_map.get(color.lower(), (1, 0, 0))  # 默认红色
-                self.log(f"水印颜色: 使用命名颜色 {color} -> RGB({r}, {g}, {b})")
-
-            for page_num in range(len(input_pdf.pages)):
-                page = input_pdf.pages[page_num]
-
-                # 创建水印
-                packet = io.BytesIO()
-
-                # 获取页面尺寸并转换为float类型
-                page_width = float(page.mediabox.width)
-                page_height = float(page.mediabox.height)
-
-                c = canvas.Canvas(packet, pagesize=(page_width, page_height))
-
-                # 设置透明度和颜色 - 确保颜色正确设置
-                c.setFillColorRGB(r, g, b, alpha=float_opacity)
-
-                # 设置字体
-                try:
-                    c.setFont(reportlab_font, int_font_size)
-                except:
-                    c.setFont("Helvetica-Bold", int_font_size)
-                    self.log(f"ReportLab无法加载字体 {reportlab_font}，使用默认Helvetica-Bold")
-
-                # 保存当前图形状态
-                c.saveState()
-
-                if position == "tile":
-                    # 测量文本尺寸（在ReportLab中）
-                    text_width = c.stringWidth(text, reportlab_font, int_font_size)
-                    text_height = int_font_size * 1.2  # 估计文本高度
-
-                    # 计算平铺的水印间距，确保足够的覆盖
-                    x_spacing = max(text_width * 1.5, page_width / int_density)
-                    y_spacing = max(text_height * 1.5, page_height / int_density)
-
-                    # 计算水印覆盖的行列数
-                    cols = max(int_density, int(page_width / x_spacing) + 1)
-                    rows = max(int_density, int(page_height / y_spacing) + 1)
-
-                    for i in range(cols):
-                        for j in range(rows):
-                            # 计算水印位置，确保均匀分布
-                            x = i * page_width / cols
-                            y = j * page_height / rows
-
-                            # 绘制旋转的文字
-                            c.saveState()
-                            c.translate(float(x), float(y))
-                            c.rotate(int_angle)
-
-                            # 根据效果类型应用不同的水印效果
-                            if effect_type == "outline":
-                                # 轮廓效果
-                                c.setLineWidth(int_outline_width)
-                                c.setStrokeColorRGB(r * 0.7, g * 0.7, b * 0.7, alpha=float_opacity * 0.7)
-                                c.setFillColorRGB(r, g, b, alpha=float_opacity)
-                                c.drawString(0, 0, text)
-                            elif effect_type == "shadow":
-                                # 阴影效果
-                                c.setFillColorRGB(0, 0, 0, alpha=float_opacity * 0.5)
-                                c.drawString(int_shadow_offset, -int_shadow_offset, text)
-                                c.setFillColorRGB(r, g, b, alpha=float_opacity)
-                                c.drawString(0, 0, text)
-                            elif effect_type == "emboss":
-                                # 浮雕效果
-                                c.setFillColorRGB(min(1, r + 0.4), min(1, g + 0.4), min(1, b + 0.4),
-                                                  alpha=float_opacity * 0.7)
-                                c.drawString(-1, 1, text)
-                                c.setFillColorRGB(max(0, r - 0.4), max(0, g - 0.4), max(0, b - 0.4),
-                                                  alpha=float_opacity * 0.7)
-                                c.drawString(1, -1, text)
-                                c.setFillColorRGB(r, g, b, alpha=float_opacity)
-                                c.drawString(0, 0, text)
-                            elif effect_type == "texture":
-                                # 纹理效果
-                                c.setFillColorRGB(r, g, b, alpha=float_opacity)
-                                c.drawString(0, 0, text)
-                                # 添加纹理点
-                                c.setFillColorRGB(r, g, b, alpha=float_opacity * 0.7)
-                                for _ in range(int_pattern_density):
-                                    import random
-                                    tx = random.randint(-20, 20)
-                                    ty = random.randint(-20, 20)
-                                    c.circle(tx, ty, 1, fill=1, stroke=0)
-                            else:
-                                # 默认效果
-                                c.drawString(0, 0, text)
-
-                            c.restoreState()
-                else:  # center
-                    # 居中放置单个水印
-                    c.saveState()
-                    c.translate(page_width / 2, page_height / 2)
-                    c.rotate(int_angle)
-
-                    # 根据效果类型应用不同的水印效果
-                    if effect_type == "outline":
-                        # 轮廓效果
-                        c.setLineWidth(int_outline_width)
-                        c.setStrokeColorRGB(r * 0.7, g * 0.7, b * 0.7, alpha=float_opacity * 0.7)
-                        c.setFillColorRGB(r, g, b, alpha=float_opacity)
-                        c.drawCentredString(0, 0, text)
-                    elif effect_type == "shadow":
-                        # 阴影效果
-                        c.setFillColorRGB(0, 0, 0, alpha=float_opacity * 0.5)
-                        c.drawCentredString(int_shadow_offset, -int_shadow_offset, text)
-                        c.setFillColorRGB(r, g, b, alpha=float_opacity)
-                        c.drawCentredString(0, 0, text)
-                    elif effect_type == "emboss":
-                        # 浮雕效果
-                        c.setFillColorRGB(min(1, r + 0.4), min(1, g + 0.4), min(1, b + 0.4), alpha=float_opacity * 0.7)
-                        c.drawCentredString(-1, 1, text)
-                        c.setFillColorRGB(max(0, r - 0.4), max(0, g - 0.4), max(0, b - 0.4), alpha=float_opacity * 0.7)
-                        c.drawCentredString(1, -1, text)
-                        c.setFillColorRGB(r, g, b, alpha=float_opacity)
-                        c.drawCentredString(0, 0, text)
-                    elif effect_type == "texture":
-                        # 纹理效果
-                        c.setFillColorRGB(r, g, b, alpha=float_opacity)
-                        c.drawCentredString(0, 0, text)
-                        # 添加纹理点
-                        c.setFillColorRGB(r, g, b, alpha=float_opacity * 0.7)
-                        for _ in range(int_pattern_density):
-                            import random
-                            tx = random.randint(-20, 20)
-                            ty = random.randint(-20, 20)
-                            c.circle(tx, ty, 1, fill=1, stroke=0)
-                    else:
-                        # 默认效果
-                        c.drawCentredString(0, 0, text)
-
-                    c.restoreState()
-
-                # 恢复图形状态
-                c.restoreState()
-                c.save()
-
-                # 将水印叠加到原始页面
-                packet.seek(0)
-                watermark_pdf = PdfReader(packet)
-                page.merge_page(watermark_pdf.pages[0])
-
-                # 添加处理后的页面到输出PDF
-                output_pdf.add_page(page)
-
-            # 保存输出PDF，应用压缩
-            with open(output_path, 'wb') as output_file:
-                output_pdf.write(output_file)
-
-        except Exception as e:
-            raise Exception(f"添加水印到PDF失败: {str(e)}")
-
-    # 根据压缩级别返回JPEG质量
-    def get_jpg_quality_from_compression_level(self, compression_level):
-        # 压缩级别：0=不压缩，1=轻度，2=中度，3=高度
-        quality_map = {
-            0: 95,  # 高质量，几乎不压缩
-            1: 85,  # 轻度压缩
-            2: 70,  # 中度压缩
-            3: 50  # 高度压缩
-        }
-        return quality_map.get(compression_level, 95)  # 默认高质量
+    def _show_job_status(self, company_name, index, total):
+        self.master.after(0, lambda: self.status_bar.config(text=f"处理中: {company_name} ({index}/{total})"))
 
     def log(self, message):
         # 在UI线程中更新日志
@@ -2602,5 +4854,150 @@ def main():
     root.mainloop()
 
 
+def cli_main(argv=None):
+    """命令行批处理入口（以 `batch` 子命令启动），不创建Tk窗口，与界面使用同一套图片化/矢量/邮件流程
+
+    日志输出到标准错误，处理结束后在标准输出打印一行JSON格式的吞吐量统计，指定 --summary-file 时同时写入文件。
+    --windowed 打包的程序没有控制台（sys.stdout/sys.stderr 为 None），此时日志追加到输出目录的 batch.log，
+    未指定 --summary-file 时汇总写入输出目录的 batch_summary.json。
+    返回退出码：全部成功为0，有公司处理或邮件发送失败为1。
+    """
+    parser = argparse.ArgumentParser(prog="PDFWatermark batch", description="PDF批量水印（命令行模式）")
+    parser.add_argument("paths", nargs="*", metavar="PDF... COMPANIES",
+                        help="一个或多个源PDF文件，最后是公司列表：Excel/CSV文件，或每行一个公司名称的文本文件")
+    parser.add_argument("-s", "--settings", help="watermark_config.json 格式的水印设置文件")
+    parser.add_argument("-o", "--output-dir", default=".", help="输出目录（默认当前目录）")
+    parser.add_argument("--name-column", help="公司名称所在列（默认第一列）")
+    parser.add_argument("--email-column", help="邮箱所在列（多个邮箱用分号分隔）")
+    parser.add_argument("--send-email", action="store_true", help="处理完成后按邮箱列发送邮件")
+    parser.add_argument("--email-config", help="email_config.json 格式的邮件设置文件（默认与程序同目录）")
+    parser.add_argument("--combine-emails", action="store_true",
+                        help="多个源PDF时，同一公司的所有文档作为附件合并为一封邮件")
+    parser.add_argument("--prefix", help="水印前缀（默认取设置文件中的 prefix_text）")
+    parser.add_argument("--suffix", help="水印后缀（默认取设置文件中的 suffix_text）")
+    parser.add_argument("--workers", type=int, help="并行进程数（默认取设置文件中的 worker_count）")
+    parser.add_argument("--raster-cache-dir", help="页面磁盘缓存目录（默认用户缓存目录）")
+    parser.add_argument("--raster-cache-limit-mb", type=int, help="页面磁盘缓存大小上限(MB)")
+    parser.add_argument("--no-raster-cache", action="store_true", help="不使用跨运行的页面磁盘缓存")
+    parser.add_argument("--cache-stats", action="store_true", help="只打印页面磁盘缓存统计（JSON）后退出")
+    parser.add_argument("--clear-cache", action="store_true", help="清空页面磁盘缓存后退出")
+    parser.add_argument("--summary-file", help="同时把JSON汇总写入该文件（没有控制台时默认为输出目录的 batch_summary.json）")
+    args = parser.parse_args(argv)
+
+    summary_file = args.summary_file
+    log_file = None
+    if sys.stdout is None or sys.stderr is None:
+        os.makedirs(args.output_dir, exist_ok=True)
+        summary_file = summary_file or os.path.join(args.output_dir, CLI_SUMMARY_FILENAME)
+        log_file = os.path.join(args.output_dir, CLI_LOG_FILENAME)
+
+    def log(message):
+        if log_file is None:
+            print(message, file=sys.stderr, flush=True)
+        else:
+            with open(log_file, 'a', encoding='utf-8') as f:
+                f.write(message + "\n")
+
+    def write_summary(summary):
+        text = json.dumps(summary, ensure_ascii=False)
+        if summary_file:
+            with open(summary_file, 'w', encoding='utf-8') as f:
+                f.write(text + "\n")
+        if sys.stdout is not None:
+            print(text, flush=True)
+
+    disk_cache = RasterDiskCache(args.raster_cache_dir, args.raster_cache_limit_mb * 1024 * 1024
+                                 if args.raster_cache_limit_mb else RASTER_DISK_CACHE_LIMIT)
+    if args.cache_stats or args.clear_cache:
+        if args.clear_cache:
+            disk_cache.clear()
+            log(f"页面缓存已清空: {disk_cache.cache_dir}")
+        write_summary(disk_cache.stats())
+        return 0
+    if len(args.paths) < 2:
+        parser.error("需要指定源PDF文件和公司列表")
+    pdf_paths, companies_path = args.paths[:-1], args.paths[-1]
+
+    settings = {}
+    if args.settings:
+        with open(args.settings, 'r', encoding='utf-8') as f:
+            settings = json.load(f)
+    if args.no_raster_cache or not settings.get("persistent_raster_cache", True):
+        disk_cache = None
+
+    email_sender = None
+    combine_emails = False
+    if args.send_email:
+        if not args.email_column:
+            parser.error("--send-email 需要同时指定 --email-column")
+        email_config = args.email_config or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         "email_config.json")
+        with open(email_config, 'r', encoding='utf-8') as f:
+            email_settings = json.load(f)
+        email_sender = EmailSender.from_settings(email_settings)
+        combine_emails = args.combine_emails or email_settings.get("combine_emails", False)
+
+    setup_poppler_path(log=log)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        company_names, company_email_map = load_company_list(companies_path, args.name_column,
+                                                             args.email_column, log=log)
+        log(f"已加载 {len(company_names)} 个公司名称")
+
+        os.makedirs(args.output_dir, exist_ok=True)
+        prefix_text = args.prefix if args.prefix is not None else settings.get("prefix_text", "IDC圈：仅限")
+        suffix_text = args.suffix if args.suffix is not None else settings.get("suffix_text", "内部使用，转发侵权")
+        jobs = build_batch_jobs(pdf_paths, company_names, prefix_text, suffix_text,
+                                settings.get("filename_pattern", "文件名{company}"), args.output_dir)
+        options = build_watermark_options(settings)
+        worker_count = max(1, args.workers if args.workers is not None else int(settings.get("worker_count", 1)))
+
+        engine = WatermarkEngine(find_system_fonts(log=log), temp_dir, log=log)
+        runner = BatchRunner(engine, temp_dir, log=log,
+                             on_job_start=lambda company_name, index, total: log(
+                                 f"处理中: {company_name} ({index}/{total})"))
+
+        with BatchManifest(args.output_dir, options) as manifest, (email_sender or contextlib.nullcontext()):
+            for result in runner.run_batch(jobs, options, manifest, worker_count, disk_cache=disk_cache,
+                                           email_sender=email_sender, company_email_map=company_email_map,
+                                           combine_emails=combine_emails):
+                pass  # 逐个结果的日志和清单登记在 run_batch 中完成
+
+        # 详细的分阶段计时写在输出目录的 batch_report.json/csv 中，这里只打印汇总
+        report = runner.last_report.summary()
+        email_seconds = runner.last_pipeline.busy_seconds("邮件")
+        failed_count = report["failed"]
+        email_failed_count = report["emails_failed"]
+        write_summary({
+            "companies": len(company_names),
+            "documents": len(pdf_paths),
+            "outputs": len(jobs),
+            "succeeded": report["outputs"],
+            "skipped": report["skipped"],
+            "failed": failed_count,
+            "mode": report["mode"],
+            "workers": worker_count,
+            "pages": report["pages"],
+            "seconds": report["seconds"],
+            "pages_per_sec": report["pages_per_sec"],
+            "mb_written": report["mb_written"],
+            "peak_rss_mb": report["peak_rss_mb"],
+            "worker_peak_rss_mb": report["worker_peak_rss_mb"],
+            "emails_sent": report["emails_sent"],
+            "emails_failed": email_failed_count,
+            "emails_per_sec": round(report["emails_sent"] / email_seconds, 2) if email_seconds > 0 else None,
+            "stage_p95_ms": {stage: latency["p95_ms"] for stage, latency in report["stages"].items()},
+            "raster_cache": disk_cache.stats() if disk_cache is not None and options["rasterize"] else None,
+            "report": os.path.join(args.output_dir, f"{REPORT_FILENAME}.json"),
+        })
+        return 1 if failed_count or email_failed_count else 0
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    # 以 batch 子命令启动时运行命令行模式；其他参数（拖放到程序上的文件、文件关联、macOS的 -psn_*）仍打开图形界面
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(cli_main(sys.argv[2:]))
     main()
@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+from PIL import Image
+from reportlab.pdfgen import canvas
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+import app_main  # noqa: E402
+
+
+def make_pdf(path, page_count):
+    c = canvas.Canvas(str(path))
+    for page_num in range(page_count):
+        c.drawString(100, 700, f"{path.name} page {page_num + 1}")
+        c.showPage()
+    c.save()
+    return str(path)
+
+
+@pytest.fixture
+def fake_poppler(monkeypatch):
+    """用纯色图像代替pdftoppm的渲染结果（测试环境不需要安装Poppler）"""
+    def page_count(pdf_path):
+        return len(app_main.PdfReader(pdf_path).pages)
+
+    def convert_from_path(pdf_path, dpi=200, first_page=None, last_page=None, output_folder=None,
+                          paths_only=False, grayscale=False, **kwargs):
+        images = []
+        for page_num in range(first_page or 1, (last_page or page_count(pdf_path)) + 1):
+            image = Image.new('L' if grayscale else 'RGB', (40, 60), 'white')
+            if output_folder:
+                path = os.path.join(output_folder, f"{page_num:04d}.ppm")
+                image.save(path)
+                images.append(path if paths_only else Image.open(path))
+            else:
+                images.append(image)
+        return images
+
+    monkeypatch.setattr(app_main, "convert_from_path", convert_from_path)
+    monkeypatch.setattr(app_main, "pdfinfo_from_path", lambda pdf_path, **kwargs: {"Pages": page_count(pdf_path)})
+
+
+def iterate_documents(page_cache, pdf_paths, rounds=2):
+    return [[len(list(page_cache.iter_pages(pdf_path, 20))) for pdf_path in pdf_paths] for _ in range(rounds)]
+
+
+def test_eviction_keeps_pages_of_live_batch(tmp_path, fake_poppler):
+    """磁盘缓存上限很小时，完成第二份文档不会删除批次仍在使用的第一份文档的页面"""
+    pdf_paths = [make_pdf(tmp_path / "a.pdf", 3), make_pdf(tmp_path / "b.pdf", 2)]
+    disk_cache = app_main.RasterDiskCache(str(tmp_path / "disk"), size_limit=1)
+    page_cache = app_main.PageRasterCache(str(tmp_path / "spill"), memory_limit=0, disk_cache=disk_cache)
+
+    assert iterate_documents(page_cache, pdf_paths) == [[3, 2], [3, 2]]
+    assert disk_cache.evicted_pages == 0
+
+    # 批次结束后不再保护，超出上限的页面可以被清理
+    page_cache.clear()
+    disk_cache.evict()
+    assert disk_cache.stats()["pages"] == 0
+
+
+def test_spilled_pages_survive_eviction_by_other_process(tmp_path, fake_poppler):
+    """其他进程（独立的 RasterDiskCache 实例）清理磁盘缓存后，溢出的页面仍可读取"""
+    pdf_paths = [make_pdf(tmp_path / "a.pdf", 3), make_pdf(tmp_path / "b.pdf", 2)]
+    disk_cache = app_main.RasterDiskCache(str(tmp_path / "disk"))
+    page_cache = app_main.PageRasterCache(str(tmp_path / "spill"), memory_limit=0, disk_cache=disk_cache)
+    iterate_documents(page_cache, pdf_paths, rounds=1)
+
+    app_main.RasterDiskCache(str(tmp_path / "disk"), size_limit=1).evict()
+    assert disk_cache.stats()["pages"] == 0
+    assert iterate_documents(page_cache, pdf_paths, rounds=1) == [[3, 2]]
+    page_cache.clear()
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+import app_main  # noqa: E402
+
+
+def test_output_replaced_only_after_close(tmp_path):
+    output_path = str(tmp_path / "out.pdf")
+    with app_main.RasterPdfWriter(output_path) as writer:
+        writer.add_image_page(Image.new('RGB', (40, 60), 'white'), 90)
+        assert not os.path.exists(output_path)
+
+    assert len(app_main.PdfReader(output_path).pages) == 1
+    assert os.listdir(tmp_path) == ["out.pdf"]
+
+
+def test_error_leaves_previous_output_untouched(tmp_path):
+    """写入过程中出错时删除临时文件，不留下截断的PDF，已有的输出保持原样"""
+    output_path = tmp_path / "out.pdf"
+    output_path.write_bytes(b"previous")
+    with pytest.raises(RuntimeError):
+        with app_main.RasterPdfWriter(str(output_path)) as writer:
+            writer.add_image_page(Image.new('RGB', (40, 60), 'white'), 90)
+            raise RuntimeError("render failed")
+
+    assert output_path.read_bytes() == b"previous"
+    assert os.listdir(tmp_path) == ["out.pdf"]
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+from reportlab.pdfgen import canvas
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+import app_main  # noqa: E402
+
+
+def make_pdf(path, page_count):
+    c = canvas.Canvas(str(path))
+    for page_num in range(page_count):
+        c.drawString(100, 700, f"page {page_num + 1}")
+        c.showPage()
+    c.save()
+    return str(path)
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_rewatermarking_output_keeps_previous_watermark(tmp_path, incremental):
+    """再次为本工具的输出添加水印时，新水印使用未占用的XObject名称，原水印保留"""
+    engine = app_main.WatermarkEngine({}, str(tmp_path), log=lambda message: None)
+    paths = [make_pdf(tmp_path / "source.pdf", 2)]
+    for text in ("FIRST", "SECOND", "THIRD"):
+        paths.append(str(tmp_path / f"{text}.pdf"))
+        engine.apply_watermark_to_pdf(paths[-2], paths[-1], text, rasterize=False, position="center",
+                                      incremental=incremental)
+
+    for page_num, page in enumerate(app_main.PdfReader(paths[-1]).pages):
+        assert page.extract_text().split() == ["page", str(page_num + 1), "FIRST", "SECOND", "THIRD"]
+        assert sorted(page["/Resources"]["/XObject"]) == ["/WmStamp0", "/WmStamp0_1", "/WmStamp0_2"]
+
+
+def test_failed_incremental_update_leaves_no_output(tmp_path, monkeypatch):
+    """增量更新出错时不留下只含原文件字节（无水印但仍可打开）的输出"""
+    engine = app_main.WatermarkEngine({}, str(tmp_path), log=lambda message: None)
+    source_path = make_pdf(tmp_path / "source.pdf", 2)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("stamp failed")
+
+    monkeypatch.setattr(engine, "_draw_form_xobject", fail)
+    with pytest.raises(Exception, match="stamp failed"):
+        engine.apply_watermark_to_pdf(source_path, str(tmp_path / "out.pdf"), "FIRST", rasterize=False,
+                                      incremental=True)
+    assert sorted(os.listdir(tmp_path)) == ["source.pdf"]